@@ -0,0 +1,193 @@
+'''
+Backcast calibration of the Census projection adjustments.
+
+The CDC fertility and mortality adjustments are calibrated by launching the
+projection from an earlier vintage, the intercensal county population of
+LAUNCH_YEAR (2010, from county_population_ageracegender_2010_to_2020),
+projecting it to TARGET_YEAR (2020) and scoring the result against the 2020
+launch population of the projections (county_population_ageracesex_2020).
+
+Everything that does not depend on the adjustments (the populations, the
+input rate tables, county immigration and the prepared migration model) is
+loaded once into a Backcast, which then projects any number of parameter
+sets at once along a leading axis. calibrate() searches the adjustments with
+a grid that is refined around the best point of the previous grid, so every
+iteration is one batched backcast.
+
+The Census multipliers and immigration are projections; for backcast years
+before the first year of a table, its first year is used. Counties missing
+from either vintage are left out of the score.
+'''
+import os
+import time
+
+import numpy as np
+import polars as pl
+
+from iclus_v3_config import OUTPUT_FOLDER, POP_DB, TIME_STAMP
+from iclus_v3_dense import CohortLayout, YearRates, deaths_and_immigration, migration_births_and_aging
+from iclus_v3_dimensions import AGE_GROUPS
+from iclus_v3_migration import dense_migration_plum_v3 as DenseMigrationModel, migration_plum_v3 as MigrationModel
+from iclus_v3_projector import set_launch_population
+from iclus_v3_rates import CensusRateStore
+from iclus_v3_schedule import Scheduler
+from iclus_v3_validation import Validator, county_totals
+
+
+OUTPUT_DATABASE = os.path.join(OUTPUT_FOLDER, f'iclus_v3_calibration_{TIME_STAMP}.sqlite')
+
+
+def intercensal_population(year):
+    '''
+    Census 2010-2020 intercensal population estimates for one YEAR, in the
+    format of the launch population
+    '''
+    uri = f'sqlite:{POP_DB}'
+    query = f'SELECT COFIPS AS GEOID, AGE_GROUP, RACE, SEX, POPULATION \
+              FROM county_population_ageracegender_2010_to_2020 \
+              WHERE YEAR = {year}'
+    df = pl.read_database_uri(query=query, uri=uri)
+
+    df = df.with_columns(pl.col('AGE_GROUP').str.replace('_TO_', '-').str.replace('_AND_OVER', '+')
+                           .cast(pl.Enum(AGE_GROUPS)))
+
+    return df
+
+
+class Backcast():
+    '''
+    Projects the population of LAUNCH_YEAR to TARGET_YEAR for any number of
+    (cdc_fert_adj, cdc_mort_adj) pairs at once. Migration of each parameter
+    set is a task on a pool of WORKERS threads.
+    '''
+    def __init__(self, scenario='hi', census_imm_hist2324=False, launch_year=2010, target_year=2020, workers=1):
+
+        self.launch_year = launch_year
+        self.target_year = target_year
+
+        target = set_launch_population()
+        self.layout = CohortLayout.from_frame(target)
+        self.target = self.layout.to_array(target, 'POPULATION', complete=True)
+        self.launch = self.layout.to_array(intercensal_population(launch_year), 'POPULATION')
+
+        # counties scored
+        self.counties = (county_totals(self.launch) > 0) & (county_totals(self.target) > 0)
+
+        self.rates = CensusRateStore(self.layout, scenario, census_imm_hist2324)
+
+        migration_model = MigrationModel()
+        self.coefs = migration_model.coefs
+        self.migration_model = DenseMigrationModel(self.layout, migration_model.distance)
+
+        self.scheduler = Scheduler(workers)
+
+        # backcasts are scored rather than balanced; the validator only
+        # clips and rounds
+        self.validator = Validator(self.layout, 'off')
+
+    def net_migration(self, pop):
+        inflows, outflows = self.migration_model.migrate(pop, self.coefs)
+
+        return inflows - outflows
+
+    def project(self, cdc_fert_adj, cdc_mort_adj):
+        '''
+        The TARGET_YEAR population for each pair of adjustments, as a
+        (parameter set x county x race x sex x age group) array
+        '''
+        cdc_fert_adj = np.asarray(cdc_fert_adj, dtype=float).reshape(-1, 1, 1, 1, 1)
+        cdc_mort_adj = np.asarray(cdc_mort_adj, dtype=float).reshape(-1, 1, 1, 1, 1)
+        assert cdc_fert_adj.shape == cdc_mort_adj.shape
+
+        pop = np.stack([self.launch] * cdc_fert_adj.shape[0])
+        for year in range(self.launch_year + 1, self.target_year + 1):
+            mortality_year = max(year - 1, self.rates.mort_multipliers.first_year)
+            fertility_year = max(year - 1, self.rates.fert_multipliers.first_year)
+            immigration_year = max(year, self.rates.county_immigrants.first_year)
+            rates = YearRates(self.rates.mortality_rates(mortality_year, cdc_mort_adj),
+                              self.rates.fertility_rates(fertility_year, cdc_fert_adj))
+
+            deaths_and_immigration(pop, rates, self.rates.county_immigrants[immigration_year], self.validator)
+
+            tasks = [self.scheduler.submit(self.net_migration, member_pop) for member_pop in pop]
+            net_migration = np.stack([task.result() for task in tasks])
+
+            migration_births_and_aging(pop, net_migration, rates, self.validator)
+
+        return pop
+
+    def score(self, pop):
+        '''
+        Weighted absolute percentage error of the county x age group totals of
+        each projected population in POP against the target population
+        '''
+        projected = pop[..., self.counties, :, :, :].sum(axis=(-3, -2))
+        target = self.target[self.counties].sum(axis=(-3, -2))
+
+        return np.abs(projected - target).sum(axis=(-2, -1)) / target.sum()
+
+    def evaluate(self, cdc_fert_adj, cdc_mort_adj):
+        return self.score(self.project(cdc_fert_adj, cdc_mort_adj))
+
+    def close(self):
+        self.scheduler.close()
+
+
+def calibrate(backcast, center=(-0.055, -0.15), width=(0.1, 0.3), points=5, iterations=4):
+    '''
+    Search the (cdc_fert_adj, cdc_mort_adj) that minimize the backcast score.
+    Each iteration evaluates a POINTS x POINTS grid of WIDTH around CENTER in
+    one batched backcast, then centers the next grid on the best point and
+    halves its width. Returns the best (cdc_fert_adj, cdc_mort_adj, score)
+    and every evaluation.
+    '''
+    center = np.array(center, dtype=float)
+    width = np.array(width, dtype=float)
+
+    evaluations = []
+    for iteration in range(iterations):
+        fert, mort = np.meshgrid(np.linspace(-0.5, 0.5, points) * width[0] + center[0],
+                                 np.linspace(-0.5, 0.5, points) * width[1] + center[1])
+        fert, mort = fert.ravel(), mort.ravel()
+
+        scores = backcast.evaluate(fert, mort)
+        evaluations.append(pl.DataFrame({'ITERATION': iteration,
+                                         'CDC_FERT_ADJ': fert,
+                                         'CDC_MORT_ADJ': mort,
+                                         'SCORE': scores}))
+
+        best = np.argmin(scores)
+        center = np.array([fert[best], mort[best]])
+        width = width / 2
+        print(f"Iteration {iteration}: best score {scores[best]:.5f} at cdc_fert_adj={center[0]:.4f}, cdc_mort_adj={center[1]:.4f}")
+
+    evaluations = pl.concat(evaluations)
+    best = evaluations.sort('SCORE').row(0, named=True)
+
+    return (best['CDC_FERT_ADJ'], best['CDC_MORT_ADJ'], best['SCORE']), evaluations
+
+
+def main(scenario='hi', census_imm_hist2324=False, points=5, iterations=4, workers=1):
+    '''
+    Calibrate the adjustments and record every evaluation in the
+    "calibration_evaluations" table of the output database
+    '''
+    backcast = Backcast(scenario, census_imm_hist2324, workers=workers)
+    try:
+        best, evaluations = calibrate(backcast, points=points, iterations=iterations)
+    finally:
+        backcast.close()
+
+    evaluations.with_columns(pl.lit(scenario).alias('SCENARIO')).write_database(table_name='calibration_evaluations',
+                                                                              connection=f'sqlite:{OUTPUT_DATABASE}',
+                                                                              if_table_exists='replace',
+                                                                              engine='adbc')
+    print(f"cdc_fert_adj={best[0]:.4f}, cdc_mort_adj={best[1]:.4f} (score {best[2]:.5f})")
+
+    return best
+
+
+if __name__ == '__main__':
+    print(time.ctime())
+    main(workers=4)
+    print(time.ctime())
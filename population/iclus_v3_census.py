@@ -7,576 +7,406 @@ Created: April 26th, 2025
 import os
 import time
 
-from datetime import datetime
-
 import numpy as np
 import polars as pl
 
+from iclus_v3_config import OUTPUT_FOLDER, TIME_STAMP
+import iclus_v3_projector
+from iclus_v3_dense import CohortLayout, YearRates, deaths_and_immigration, migration_births_and_aging
+from iclus_v3_dimensions import AGE_GROUPS
 from iclus_v3_migration import migration_plum_v3 as MigrationModel
+from iclus_v3_output import OutputWriter
+from iclus_v3_projector import set_launch_population
+from iclus_v3_rates import CensusRateStore, RateProvider, census_national_immigration
+from iclus_v3_schedule import Scheduler
+from iclus_v3_validation import BatchValidator, Validator
+
 
+OUTPUT_DATABASE = os.path.join(OUTPUT_FOLDER, f'iclus_v3_census_{TIME_STAMP}.sqlite')
 
-BASE_FOLDER = 'D:\\OneDrive\\ICLUS_v3\\population'
-if os.path.isdir('D:\\projects\\ICLUS_v3\\population'):
-    BASE_FOLDER = 'D:\\projects\\ICLUS_v3\\population'
+# value columns written to the output database each year, and the name of
+# each one in the wide (one column per year) output tables
+OUTPUT_TABLES = {'deaths': {'DEATHS': '{year}'},
+                 'immigration': {'NET_IMMIGRATION': '{year}'},
+                 'migration': {'INFLOWS': 'INMIG{year}',
+                               'OUTFLOWS': 'OUTMIG{year}',
+                               'NET_MIGRATION': 'NETMIG{year}'},
+                 'births': {'BIRTHS': '{year}'},
+                 'population': {'POPULATION': '{year}'}}
 
-d = datetime.now()
-TIME_STAMP = f'{d.year}{d.month}{d.day}{d.hour}{d.minute}{d.second}'
 
-INPUT_FOLDER = os.path.join(BASE_FOLDER, 'inputs')
-OUTPUT_FOLDER = os.path.join(BASE_FOLDER, 'outputs')
-OUTPUT_DATABASE = os.path.join(OUTPUT_FOLDER, f'iclus_v3_census_{TIME_STAMP}.sqlite')
-POP_DB = os.path.join(INPUT_FOLDER, 'databases', 'population.sqlite')
-MIG_DB = os.path.join(INPUT_FOLDER, 'databases', 'migration.sqlite')
-CDC_DB = os.path.join(INPUT_FOLDER, 'databases', 'cdc.sqlite')
-WITT_DB = os.path.join(INPUT_FOLDER, 'databases', 'wittgenstein.sqlite')
-CENSUS_DB = os.path.join(INPUT_FOLDER, 'databases', 'census.sqlite')
-ACS_DB = os.path.join(INPUT_FOLDER, 'databases', 'acs.sqlite')
-
-ETHNICITIES = ('HISPANIC', 'NONHISPANIC')
-SEXES = ('MALE', 'FEMALE')
-RACES = ('WHITE', 'BLACK', 'ASIAN', 'AIAN', 'NHPI', 'TWO_OR_MORE')
-AGE_GROUPS = ('0-4', '5-9', '10-14', '15-19', '20-24', '25-29', '30-34',
-              '35-39', '40-44', '45-49', '50-54', '55-59', '60-64', '65-69',
-              '70-74', '75-79', '80-84', '85+')
-
-
-def set_launch_population():
+class CensusRates(RateProvider):
     '''
-    2020 launch population is taken from Census 2020-2023 Intercensal Population
-    Estimates.
+    Census NP2023 multipliers and immigration for SCENARIO ('hi', 'mid',
+    'low'), with historical immigration for 2023-2024 if
+    CENSUS_IMM_HIST2324
     '''
-    uri = f'sqlite:{POP_DB}'
-    query = 'SELECT * FROM county_population_ageracesex_2020'
-    df = pl.read_database_uri(query=query, uri=uri)
+    output_tables = OUTPUT_TABLES
 
-    df = df.with_columns(pl.col('AGE_GROUP').cast(pl.Enum(AGE_GROUPS)))
-    df = df.sort(['GEOID', 'RACE', 'AGE_GROUP', 'SEX'])
+    def __init__(self, scenario, census_imm_hist2324):
 
-    #assert df.shape[0] == 675648
-    return df
+        super().__init__(scenario)
+        self.census_imm_hist2324 = census_imm_hist2324
+
+    def parameters(self):
+        return {'scenario': self.scenario,
+                'census_imm_hist2324': self.census_imm_hist2324}
+
+    def print_parameters(self):
+        print("Census immigration historical 2023-2024:", self.census_imm_hist2324)
 
-def main(scenario, cdc_fert_adj, cdc_mort_adj, census_imm_hist2324):
+    def rate_store(self, layout):
+        return CensusRateStore(layout, self.scenario, self.census_imm_hist2324)
+
+def main(scenario, cdc_fert_adj, cdc_mort_adj, census_imm_hist2324, engine='frame',
+         output_database=None, migration_inputs=None, resume_from=None, workers=1,
+         validation='cheap', validation_sample=None, region=None, boundary_inputs=None):
     '''
-    TODO: Add docstring
+    Project one Census scenario through 2099, e.g.
+
+    main(scenario='hi', cdc_fert_adj=-0.055, cdc_mort_adj=-0.15, census_imm_hist2324=False)
+
+    SCENARIO is the Census NP2023 immigration series ('hi', 'mid' or 'low'),
+    CDC_FERT_ADJ and CDC_MORT_ADJ adjust the CDC fertility and mortality
+    rates (e.g. -0.15 lowers mortality by 15%), and CENSUS_IMM_HIST2324 uses
+    the Census historical immigration estimates for 2023 and 2024. ENGINE is
+    'frame', 'dense', 'leslie', 'lazy' or 'streaming'. Results go to
+    OUTPUT_DATABASE unless another OUTPUT_DATABASE is given. The remaining
+    arguments are those of iclus_v3_projector.Projector: MIGRATION_INPUTS (a
+    prepared county to county table), RESUME_FROM (an output database to
+    resume from its last checkpoint), WORKERS (threads migrating races at
+    once), VALIDATION and VALIDATION_SAMPLE (see iclus_v3_validation), and
+    REGION and BOUNDARY_INPUTS (a run of a subset of states or counties, see
+    iclus_v3_region).
     '''
     model = Projector(scenario=scenario,
                       cdc_fert_adj=cdc_fert_adj,
                       cdc_mort_adj=cdc_mort_adj,
-                      census_imm_hist2324=census_imm_hist2324)
+                      census_imm_hist2324=census_imm_hist2324,
+                      engine=engine,
+                      output_database=output_database,
+                      migration_inputs=migration_inputs,
+                      resume_from=resume_from,
+                      workers=workers,
+                      validation=validation,
+                      validation_sample=validation_sample,
+                      region=region,
+                      boundary_inputs=boundary_inputs)
     model.run()
 
+def main_batch(scenarios, census_imm_hist2324, output_database=None, workers=1, validation='cheap',
+               validation_sample=None):
+    '''
+    Run several scenarios together. SCENARIOS is a list of (scenario,
+    cdc_fert_adj, cdc_mort_adj) tuples, e.g.
 
-class Projector():
+    main_batch(scenarios=[(s, f, m) for s in ('hi', 'mid', 'low')
+                                    for f in (-0.055, 0.0)
+                                    for m in (-0.15, 0.0, 0.15)],
+               census_imm_hist2324=False)
     '''
-    TODO: Add docstring
+    model = BatchProjector(scenarios=scenarios,
+                           census_imm_hist2324=census_imm_hist2324,
+                           output_database=output_database,
+                           workers=workers,
+                           validation=validation,
+                           validation_sample=validation_sample)
+    model.run()
+
+
+class Projector(iclus_v3_projector.Projector):
+    '''
+    Census NP2023 projection; the remaining arguments are those of
+    iclus_v3_projector.Projector
     '''
-    def __init__(self, scenario, cdc_fert_adj, cdc_mort_adj, census_imm_hist2324):
+    def __init__(self, scenario, cdc_fert_adj, cdc_mort_adj, census_imm_hist2324, output_database=None, **kwargs):
 
-        # time-related attributes
-        self.launch_year = 2020
-        self.current_projection_year = self.launch_year + 1
+        self.census_imm_hist2324 = census_imm_hist2324
 
-        # scenario-related attributes
-        self.scenario = scenario
+        super().__init__(CensusRates(scenario, census_imm_hist2324),
+                         OUTPUT_DATABASE if output_database is None else output_database,
+                         cdc_fert_adj=cdc_fert_adj,
+                         cdc_mort_adj=cdc_mort_adj,
+                         **kwargs)
 
-        # population-related attributes
-        self.current_pop = None
-        self.population_time_series = None
 
-        # immigration-related attributes
-        self.immigrants = None
-        self.census_imm_hist2324 = census_imm_hist2324
+class BatchMember(Projector):
+    '''
+    One scenario of a BatchProjector. Its migration outputs are kept for the
+    batch to write (see BatchProjector.save_migration()), since members
+    migrate on worker threads and share one output database.
+    '''
+    def __init__(self, *args, **kwargs):
+
+        super().__init__(*args, **kwargs)
+
+        self.migration_output = None
+
+    def save_migration(self):
+        self.migration_output = self.net_migration
+
+
+class BatchProjector():
+    '''
+    Projects a batch of scenarios at once. The populations are held in a
+    single (scenario x county x race x sex x age group) array, so mortality,
+    immigration, fertility and aging are applied to every scenario in one
+    vectorized pass, with the input rate tables read only once. Domestic
+    migration depends on each scenario's population and is still run one
+    scenario at a time, on a pool of WORKERS threads.
+
+    Every scenario is a Projector (a "member") that supplies the migration
+    step and its own output tables. All members write to one output
+    database, OUTPUT_DATABASE unless another OUTPUT_DATABASE is given. Output
+    tables are suffixed with the member's label (e.g.
+    "population_by_race_sex_age_hi_00"), and the parameters behind each
+    label are written to the "batch_scenarios" table.
+    Each member's projection years are balanced by its own Validator at
+    VALIDATION (see iclus_v3_validation).
+    '''
+    def __init__(self, scenarios, census_imm_hist2324, output_database=None, workers=1, validation='cheap',
+                 validation_sample=None):
 
-        # mortality-related attributes
-        self.deaths = None
-        self.cdc_mort_adj = cdc_mort_adj
+        self.output_database = OUTPUT_DATABASE if output_database is None else output_database
 
-        # migration-related attributes
-        self.net_migration = None
+        # time-related attributes
+        self.launch_year = 2020
+        self.current_projection_year = self.launch_year + 1
 
-        # fertility-related attributes
-        self.births = None
-        self.cdc_fert_adj = cdc_fert_adj
+        # scenario-related attributes
+        self.census_imm_hist2324 = census_imm_hist2324
+        self.members = []
+        for i, (scenario, cdc_fert_adj, cdc_mort_adj) in enumerate(scenarios):
+            member = BatchMember(scenario=scenario,
+                                 cdc_fert_adj=cdc_fert_adj,
+                                 cdc_mort_adj=cdc_mort_adj,
+                                 census_imm_hist2324=census_imm_hist2324,
+                                 output_database=self.output_database,
+                                 engine='dense',
+                                 validation=validation,
+                                 validation_sample=validation_sample)
+            member.label = f'{scenario}_{i:02d}'
+            self.members.append(member)
+        assert len(self.members) > 0
+
+        # per-scenario adjustments, shaped to broadcast over the population
+        # array
+        self.cdc_fert_adj = np.array([m.cdc_fert_adj for m in self.members]).reshape(-1, 1, 1, 1, 1)
+        self.cdc_mort_adj = np.array([m.cdc_mort_adj for m in self.members]).reshape(-1, 1, 1, 1, 1)
+
+        # per-scenario multiplier of county net immigration (see
+        # iclus_v3_sensitivity)
+        self.immigration_scale = np.ones((len(self.members), 1, 1, 1, 1))
+
+        # shared input attributes
+        self.layout = None
+        self.rates = None
+        self.county_immigrants = None
+        self.migration_distance = None
+        self.validator = None
+
+        # each member's migration is a task on the scheduler
+        self.scheduler = Scheduler(workers)
 
     def run(self, final_projection_year=2099):
         '''
-        TODO:
+        Project every scenario in the batch through FINAL_PROJECTION_YEAR
         '''
-        self.current_pop = set_launch_population()
+        launch_pop = set_launch_population()
+        self.layout = CohortLayout.from_frame(launch_pop)
+
+        # all scenarios share the CDC rates and Census multipliers; only
+        # national immigration depends on the Census scenario
+        first = self.members[0]
+        self.rates = first.rate_provider.rate_store(self.layout)
+        county_immigrants = {first.scenario: self.rates.county_immigrants}
+        for member in self.members:
+            if member.scenario not in county_immigrants:
+                national = census_national_immigration(member.scenario, self.census_imm_hist2324)
+                county_immigrants[member.scenario] = self.rates.get_county_immigrants(national)
+        self.county_immigrants = [county_immigrants[member.scenario] for member in self.members]
+
+        # the static migration inputs are also shared by every member
+        migration_model = MigrationModel()
+        self.migration_distance = self.layout.dimensions.encode(migration_model.distance)
 
-        print("\n")
-        print("***************** PARAMETERS ******************")
-        print("Scenario: ", self.scenario)
-        print("CDC fertility adjustment:", f'{self.cdc_fert_adj * 100}%')
-        print("CDC mortality adjustment:", f'{self.cdc_mort_adj * 100}%')
-        print("Census immigration historical 2023-2024:", self.census_imm_hist2324)
-        print("***********************************************")
+        for member in self.members:
+            member.layout = self.layout
+            member.rates = self.rates
+            member.migration_distance = self.migration_distance
+            member.migration_coefficients = self.migration_coefficients(member, migration_model.coefs)
+            member.validator = Validator(self.layout, member.validation, member.validation_sample)
+        self.validator = BatchValidator([member.validator for member in self.members])
+        self.start()
+
+        pop = np.stack([self.layout.to_array(launch_pop, 'POPULATION', complete=True)] * len(self.members))
 
         while self.current_projection_year <= final_projection_year:
-            print("##############")
-            print("###        ###")
-            print(f"###  {self.current_projection_year}  ###")
-            print("###        ###")
-            print("##############")
-            print(f"{time.ctime()}")
-            print(f"Total population (start): {self.current_pop.select('POPULATION').sum()[0, 0]:,}\n")
-
-            ############
-            ## DEATHS ##
-            ############
-
-            self.mortality()  # creates self.death
-            self.current_pop = (self.current_pop.join(self.deaths,
-                                                      on=['GEOID', 'AGE_GROUP', 'RACE', 'SEX'],
-                                                      how='left',
-                                                      coalesce=True)
-                                .with_columns(pl.col('POPULATION') - pl.col('DEATHS')
-                                .alias('POPULATION'))
-                                .drop('DEATHS'))
-
-            # assert self.current_pop.shape == (675648, 5)
-            # self.current_pop = self.current_pop.with_columns(pl.col('POPULATION').clip(lower_bound=0))
-            assert sum(self.current_pop.null_count()).item() == 0
-            assert self.current_pop.filter(pl.col('POPULATION') < 0).shape[0] == 0
-            self.deaths = None
-
-            #################
-            ## IMMIGRATION ##
-            #################
-
-            # calculate net international immigration
-            self.immigration()  # creates self.immigrants
-            self.current_pop = (self.current_pop.join(self.immigrants,
-                                                      on=['GEOID', 'AGE_GROUP', 'RACE', 'SEX'],
-                                                      how='left',
-                                                      coalesce=True)
-                                .with_columns(pl.when(pl.col('NET_IMMIGRATION').is_not_null()).then(pl.col('POPULATION') + pl.col('NET_IMMIGRATION'))
-                                .otherwise(pl.col('POPULATION'))
-                                .alias('POPULATION'))
-                                .drop('NET_IMMIGRATION'))
-
-            # assert self.current_pop.shape == (675648, 5)
-            self.current_pop = self.current_pop.with_columns(pl.col('POPULATION').clip(lower_bound=0))
-            assert sum(self.current_pop.null_count()).item() == 0
-            assert self.current_pop.filter(pl.col('POPULATION') < 0).shape[0] == 0
-            self.immigrants = None
+            self.print_year_header()
+            year = self.current_projection_year
+            self.validator.start(year, pop)
+            rates = YearRates(self.rates.mortality_rates(year - 1, self.cdc_mort_adj),
+                              self.rates.fertility_rates(year - 1, self.cdc_fert_adj))
+
+            ############################
+            ## DEATHS AND IMMIGRATION ##
+            ############################
+
+            print("Calculating mortality and net immigration...", end='')
+            immigrants = np.stack([c[year] for c in self.county_immigrants]) * self.immigration_scale
+            deaths = deaths_and_immigration(pop, rates, immigrants, self.validator)
+            self.save_component('deaths', 'DEATHS', deaths)
+            self.save_component('immigration', 'NET_IMMIGRATION', immigrants)
+            print("finished!")
 
             ###############
             ## MIGRATION ##
             ###############
 
-            # calculate domestic migration
-            self.migration()  # creates self.net_migration
-            self.current_pop = (self.current_pop.join(other=self.net_migration,
-                                                      on=['GEOID', 'AGE_GROUP', 'RACE', 'SEX'],
-                                                      how='left',
-                                                      coalesce=True)
-                                .fill_null(0)
-                                .with_columns((pl.col('POPULATION') + pl.col('NET_MIGRATION'))
-                                .alias('POPULATION')
-                                .round(0)
-                                .cast(pl.UInt64)))
-            self.current_pop = self.current_pop.drop('NET_MIGRATION')
-
-            # assert self.current_pop.shape == (675648, 5)
-            self.current_pop = self.current_pop.with_columns(pl.col('POPULATION').clip(lower_bound=0))
-            assert sum(self.current_pop.null_count()).item() == 0
-            assert self.current_pop.filter(pl.col('POPULATION') < 0).shape[0] == 0
-            self.net_migration = None
-
-            ############
-            ## BIRTHS ##
-            ############
-
-            # calculate births
-            self.fertility()  # create self.births
-
-            # age everyone by one year
-            self.advance_age_groups()
-            assert self.current_pop.shape == (675648, 5)
-
-            # add births
-            self.current_pop = (self.current_pop.join(other=self.births,
-                                                     on=['GEOID', 'RACE', 'AGE_GROUP', 'SEX'],
-                                                     how='left',
-                                                     coalesce=True)
-                                .with_columns(pl.when(pl.col('BIRTHS').is_not_null())
-                                              .then(pl.col('POPULATION') + pl.col('BIRTHS'))
-                                              .otherwise(pl.col('POPULATION'))
-                                .alias('POPULATION'))
-                                .drop('BIRTHS'))
-
-            assert self.current_pop.shape == (675648, 5)
-            self.births = None
-
-            self.current_pop = self.current_pop.sort(['GEOID', 'RACE', 'SEX', 'AGE_GROUP'])
-            self.current_pop = self.current_pop.with_columns(pl.col('POPULATION').round().alias('POPULATION').cast(pl.UInt64))
-
-            if self.population_time_series is None:
-                self.population_time_series = self.current_pop.clone()
-            else:
-                self.population_time_series = pl.concat(items=[self.population_time_series, self.current_pop], how='align')
-            self.population_time_series = self.population_time_series.rename({'POPULATION': str(self.current_projection_year)})
+            # every member's migration only reads its own population, so they
+            # all run at once
+            tasks = [self.scheduler.submit(self.member_migration, member, member_pop) for member, member_pop in zip(self.members, pop)]
+            net_migration = np.stack([task.result() for task in tasks])
+            self.save_migration()
+
+            ######################
+            ## BIRTHS AND AGING ##
+            ######################
+
+            print("Calculating fertility...", end='')
+            births = migration_births_and_aging(pop, net_migration, rates, self.validator)
+            self.save_births(births)
+            print("finished!")
+
+            self.validator.balance(pop)
+            self.save_population(pop)
+
+            self.print_year_footer(pop)
             self.current_projection_year += 1
 
-            print(f"Total population (end): {self.current_pop.select('POPULATION').sum().item():,}\n")
-
-            print("\n")
-            print("***************** PARAMETERS ******************")
-            print("Scenario: ", self.scenario)
-            print("CDC fertility adjustment:", f'{self.cdc_fert_adj * 100}%')
-            print("CDC mortality adjustment:", f'{self.cdc_mort_adj * 100}%')
-            print("Census immigration historical 2023-2024:", self.census_imm_hist2324)
-            print("Output database:", os.path.basename(OUTPUT_DATABASE))
-            print("***********************************************")
-
-            # save results to sqlite3 database
-            uri = f'sqlite:{OUTPUT_DATABASE}'
-            temp = self.population_time_series.clone()
-            temp = temp.sort(by=['GEOID', 'RACE', 'SEX', 'AGE_GROUP'])
-            temp.write_database(table_name=f'population_by_race_sex_age_{self.scenario}',
-                                connection=uri,
-                                if_table_exists='replace',
-                                engine='adbc')
-            del temp
-
-    def advance_age_groups(self):
+        self.finish()
+
+    def migration_coefficients(self, member, coefs):
         '''
-        Since cohorts are aggregated into 5-year age groups, advance 20 percent
-        of the population in each cohorts to the next AGE_GROUP
+        The migration model coefficients MEMBER uses, given the fitted COEFS
         '''
-        print("Advancing the age of the population by one year...", end='')
-        starting_pop = self.current_pop.select('POPULATION').sum().item()
-
-        # VERY IMPORTANT that the dataframe is sorted exactly like this
-        self.current_pop = self.current_pop.sort(['GEOID', 'RACE', 'SEX', 'AGE_GROUP'])
+        return coefs
 
-        # shift 20 percent of the population in each cohort
+    def member_migration(self, member, member_pop):
+        '''
+        Net domestic migration of one member for the current projection
+        year, as a population-shaped array
+        '''
+        print(f"[{member.label}] ", end='')
+        member.current_projection_year = self.current_projection_year
+        member.current_pop = self.layout.to_frame(member_pop, 'POPULATION')
+        member.migration(member_pop)  # creates member.net_migration
+        net_migration = self.layout.to_array(member.net_migration, 'NET_MIGRATION', complete=True)
+        member.net_migration = None
+        member.current_pop = None
 
-        self.current_pop = self.current_pop.with_columns((pl.col('POPULATION') * 0.2)
-                                           .shift(fill_value=0)
-                                           .over('GEOID', 'RACE', 'SEX')
-                                           .alias('AGE_ADVANCING'))
+        return net_migration
 
-        # reduce the population in each age cohort by 20%, except for 85+
-        self.current_pop = self.current_pop.with_columns(pl.when(pl.col('AGE_GROUP') != pl.lit('85+'))
-                                                         .then(pl.col('POPULATION') * 0.8)
-                                                         .otherwise(pl.col('POPULATION'))
-                                                         .alias('POPULATION'))
+    def save_migration(self):
+        '''
+        Append the migration of every member to its output tables, in member
+        order; members migrate on the worker threads, but only write here, on
+        the main thread
+        '''
+        for member in self.members:
+            member.writer.append('migration', member.migration_output, self.current_projection_year)
+            member.migration_output = None
 
-        self.current_pop = self.current_pop.with_columns((pl.col('POPULATION') + pl.col('AGE_ADVANCING')).alias('POPULATION'))
-        self.current_pop = self.current_pop.drop('AGE_ADVANCING')
+    def start(self):
+        '''
+        Called once the shared inputs are loaded, before the first projection
+        year; opens an output writer for every member
+        '''
+        for member in self.members:
+            member.writer = OutputWriter(self.output_database, member.label, OUTPUT_TABLES)
+        self.save_scenarios()
 
-        # a rounding difference of << 1 is possible
-        assert starting_pop - self.current_pop.select('POPULATION').sum().item() < 1
+    def save_component(self, name, value, arr):
+        '''
+        Append one component (deaths, immigration) of every scenario to its
+        output tables
+        '''
+        for member, member_arr in zip(self.members, arr):
+            member.writer.append(name, self.layout.to_frame(member_arr, value), self.current_projection_year)
 
-        print("finished!")
+    def save_births(self, births):
+        '''
+        Append the births (scenario x county x race x sex) of every scenario
+        to its output tables
+        '''
+        full_births = np.zeros(births.shape + (len(AGE_GROUPS),))
+        full_births[..., 0] = births
+        for member, member_births in zip(self.members, full_births):
+            member.current_projection_year = self.current_projection_year
+            member.births = (self.layout.to_frame(member_births, 'BIRTHS')
+                             .filter(pl.col('AGE_GROUP') == '0-4')
+                             .select(['GEOID', 'RACE', 'SEX', 'BIRTHS', 'AGE_GROUP']))
+            member.save_births()
+            member.births = None
+
+    def save_population(self, pop):
+        '''
+        Append the end-of-year population of every scenario to its output
+        tables
+        '''
+        for member, member_pop in zip(self.members, pop):
+            member.current_pop = (self.layout.to_frame(member_pop, 'POPULATION')
+                                  .with_columns(pl.col('POPULATION').cast(pl.UInt64)))
+            member.writer.append('population', member.current_pop, self.current_projection_year)
+            member.current_pop = None
 
-    def mortality(self):
+    def finish(self):
         '''
-        Placeholder
+        Build the wide output tables of every member
         '''
+        for member in self.members:
+            member.writer.finalize()
+        self.scheduler.close()
 
-        print("Calculating mortality...", end='')
-
-        # get CDC mortality rates by AGE_GROUP, RACE, SEX, and COUNTY
-        uri = f'sqlite:{CDC_DB}'
-        query = 'SELECT RACE, AGE_GROUP, SEX, COFIPS AS GEOID, MORTALITY AS MORTALITY_RATE_100K \
-                 FROM mortality_2018_2022_county'
-        county_mort_rates = pl.read_database_uri(query=query, uri=uri).with_columns(pl.col('AGE_GROUP').cast(pl.Enum(AGE_GROUPS)))
-
-        df = self.current_pop.clone()
-        df = df.join(other=county_mort_rates,
-                     on=['RACE', 'AGE_GROUP', 'SEX', 'GEOID'],
-                     how='left',
-                     coalesce=True)
-
-        # get Census mortality rate adjustments
-        uri = f'sqlite:{CENSUS_DB}'
-        query = f'SELECT AGE_GROUP, SEX, MORT_MULTIPLIER AS MORT_MULTIPLY \
-                  FROM census_np2023_asmr \
-                  WHERE YEAR = "{self.current_projection_year - 1}"'
-        mort_multiply = pl.read_database_uri(query=query, uri=uri).with_columns(pl.col('AGE_GROUP').cast(pl.Enum(AGE_GROUPS)))
-
-        df = df.join(other=mort_multiply,
-                     on=['AGE_GROUP', 'SEX'],
-                     how='left',
-                     coalesce=True)
-
-        df = df.with_columns(((pl.col('MORTALITY_RATE_100K') * (1 + self.cdc_mort_adj) * pl.col('MORT_MULTIPLY')) / 100000.0).alias('MORT_PROJ'))
-
-        # calculate deaths
-        df = df.with_columns((pl.col('MORT_PROJ') * pl.col('POPULATION')).alias('DEATHS'))
-        df = df.select(['GEOID', 'AGE_GROUP', 'RACE', 'SEX', 'DEATHS'])
-        assert sum(df.null_count()).item() == 0
-
-        # store deaths
-        self.deaths = df.clone()
-        total_deaths_this_year = round(self.deaths.select(pl.col('DEATHS').sum()).item())
-
-        # store time series of mortality in sqlite3
-        uri = f'sqlite:{OUTPUT_DATABASE}'
-        if self.current_projection_year == self.launch_year + 1:
-            deaths = self.deaths.rename({'DEATHS': str(self.current_projection_year)})
-        else:
-            query = f'SELECT * FROM deaths_by_race_sex_age_{self.scenario}'
-            deaths = pl.read_database_uri(query=query, uri=uri).with_columns(pl.col('AGE_GROUP').cast(pl.Enum(AGE_GROUPS)))
-            current_deaths = self.deaths.clone()
-            current_deaths = current_deaths.rename({'DEATHS': str(self.current_projection_year)})
-            deaths = pl.concat(items=[deaths, current_deaths], how='align')
-        deaths.sort(by=['GEOID', 'RACE', 'SEX', 'AGE_GROUP'])
-        # assert deaths.shape[0] == 675648
-        assert sum(deaths.null_count()).item() == 0
-
-        deaths.write_database(table_name=f'deaths_by_race_sex_age_{self.scenario}',
-                              connection=uri,
-                              if_table_exists='replace',
-                              engine='adbc')
-
-        print(f"finished! ({total_deaths_this_year:,} deaths this year)")
-
-    def immigration(self):
+    def save_scenarios(self):
         '''
-        Calculate net immigration
+        Record the parameters behind each member label in the output database
         '''
-        print("Calculating net immigration...", end='')
-        # get the County level age-race-ethnicity-sex proportions
-        uri = f'sqlite:{ACS_DB}'
-        query = 'SELECT *  FROM acs_immigration_cohort_fractions_by_age_group_2006_2015'
-        county_weights = pl.read_database_uri(query=query, uri=uri)
-
-        # this is the net migrants for each age-sex combination
-        if self.census_imm_hist2324 is True:
-            table_name = f'census_np2023_asmig_{self.scenario}_with_historical2324'
-        else:
-            table_name = f'census_np2023_asmig_{self.scenario}'
-        uri = f'sqlite:{CENSUS_DB}'
-        query = f'SELECT *  \
-                  FROM {table_name} \
-                  WHERE YEAR = "{self.current_projection_year}"'
-        df_census = pl.read_database_uri(query=query, uri=uri).drop('YEAR')
-        df_census = df_census.unpivot(index=['AGE_GROUP', 'SEX'], variable_name='RACE', value_name='NET_IMMIGRATION')
-
-        df = (county_weights.join(other=df_census,
-                                  on=['RACE', 'AGE_GROUP', 'SEX'],
-                                  how='left',
-                                  coalesce=True)
-                            .with_columns((pl.col('NET_IMMIGRATION') * pl.col('COUNTY_FRACTION'))
-                            .alias('NET_IMMIGRATION'))
-                            .drop('COUNTY_FRACTION'))
-
-        assert sum(df.null_count()).item() == 0
-
-        # clean things up
-        df = df.with_columns(pl.when(pl.col('RACE') == pl.lit('NH_WHITE')).then(pl.lit('WHITE'))
-                               .when(pl.col('RACE') == pl.lit('HISP_WHITE')).then(pl.lit('WHITE'))
-                               .otherwise(pl.col('RACE')).alias('RACE'))
-        df = df.group_by(['GEOID', 'RACE', 'AGE_GROUP', 'SEX']).agg(pl.col('NET_IMMIGRATION').sum())
-        df = df.with_columns(pl.col('AGE_GROUP').cast(pl.Enum(AGE_GROUPS)))
-
-        self.immigrants = df.clone()
-
-        # store time series of immigration in sqlite3
-        uri = f'sqlite:{OUTPUT_DATABASE}'
-        if self.current_projection_year == self.launch_year + 1:
-            immigration = self.immigrants.rename({'NET_IMMIGRATION': str(self.current_projection_year)}).clone()
-        else:
-            query = f'SELECT * FROM immigration_by_race_sex_age_{self.scenario}'
-            immigration = pl.read_database_uri(query=query, uri=uri).with_columns(pl.col('AGE_GROUP').cast(pl.Enum(AGE_GROUPS)))
-            current_immigration = self.immigrants.clone()
-            current_immigration = current_immigration.rename({'NET_IMMIGRATION': str(self.current_projection_year)}).clone()
-            immigration = pl.concat(items=[immigration, current_immigration], how='align')
-
-        assert sum(immigration.null_count()).item() == 0
-
-        immigration.write_database(table_name=f'immigration_by_race_sex_age_{self.scenario}',
-                                   connection=uri,
-                                   if_table_exists='replace',
-                                   engine='adbc')
-
-        total_immigrants_this_year = round(immigration.select(f'{self.current_projection_year}').sum().item())
-        print(f"finished! ({total_immigrants_this_year:,} net immigrants this year)")
-
-    def migration(self):
+        df = pl.DataFrame({'LABEL': [m.label for m in self.members],
+                           'SCENARIO': [m.scenario for m in self.members],
+                           'CDC_FERT_ADJ': [m.cdc_fert_adj for m in self.members],
+                           'CDC_MORT_ADJ': [m.cdc_mort_adj for m in self.members],
+                           'CENSUS_IMM_HIST2324': [m.census_imm_hist2324 for m in self.members]})
+        self.write('batch_scenarios', df, replace=True)
+
+    def write(self, table_name, df, replace=False):
         '''
-        Calculate domestic migration
+        Write (or with REPLACE, overwrite) a table of the output database
         '''
-        print("Calculating domestic migration...")
+        df.write_database(table_name=table_name,
+                          connection=f'sqlite:{self.output_database}',
+                          if_table_exists='replace' if replace else 'append',
+                          engine='adbc')
 
-        migration_model = MigrationModel()
-        migration_model.current_pop = self.current_pop.clone()
-
-        # for race in ('WHITE',):
-        for race in RACES:
-            print(f"\t{race}...")
-
-            # compute all county to county migration flows
-            # 'compute migrants' iterates over all age groups
-            gross_flows = migration_model.compute_migrants(race)
-            gross_flows = gross_flows.with_columns(pl.lit(race).alias('RACE'))
-
-            # calculate a sex fraction for each county/race/age cohort
-            ratios = self.current_pop.filter(pl.col('RACE') == race)
-            ratios = ratios.with_columns(pl.col('POPULATION')
-                                         .sum()
-                                         .over(['GEOID', 'AGE_GROUP'])
-                                         .alias('GEOID_AGE_POP'))
-
-            ratios = ratios.with_columns((pl.col('POPULATION') / pl.col('GEOID_AGE_POP'))
-                                         .fill_null(value=0)
-                                         .alias('SEX_FRACTION'))
-            ratios = ratios.drop(['POPULATION', 'GEOID_AGE_POP', 'RACE'])
-
-            inflows = gross_flows.group_by(pl.col(['DESTINATION_FIPS', 'AGE_GROUP'])).agg(pl.col('MIGRATION').sum())
-            lf = (ratios.join(other=inflows,
-                              how='left',
-                              left_on=['GEOID', 'AGE_GROUP'],
-                              right_on=['DESTINATION_FIPS', 'AGE_GROUP'],
-                              coalesce=True)
-                  .fill_null(value=0)
-                  .fill_nan(value=0)
-                  .with_columns((pl.col('SEX_FRACTION') * pl.col('MIGRATION'))
-                  .alias('INFLOWS')))
-            lf = lf.select(['GEOID', 'AGE_GROUP', 'SEX', 'SEX_FRACTION', 'INFLOWS'])
-
-            outflows = gross_flows.group_by(pl.col(['ORIGIN_FIPS', 'AGE_GROUP'])).agg(pl.col('MIGRATION').sum())
-            lf = (lf.join(other=outflows,
-                          how='left',
-                          left_on=['GEOID', 'AGE_GROUP'],
-                          right_on=['ORIGIN_FIPS', 'AGE_GROUP'],
-                          coalesce=True)
-                  .fill_null(value=0)
-                  .fill_nan(value=0)
-                  .with_columns((pl.col('SEX_FRACTION') * pl.col('MIGRATION'))
-                  .alias('OUTFLOWS')))
-            lf = lf.with_columns((pl.col('INFLOWS') - pl.col('OUTFLOWS'))
-                                 .alias('NET_MIGRATION'))
-            lf = lf.select(['GEOID', 'AGE_GROUP', 'SEX', 'INFLOWS', 'OUTFLOWS', 'NET_MIGRATION'])
-            lf = lf.with_columns(pl.lit(race).alias('RACE'))
-
-            # assert lf.shape == (111960, 5)
-
-            if self.net_migration is None:
-                self.net_migration = lf.clone()
-            else:
-                self.net_migration = pl.concat(items=[self.net_migration, lf], how='vertical')
-
-        total_migrants_this_year = round(self.net_migration.select('INFLOWS').sum().item())
-        self.net_migration = self.net_migration.select(['GEOID', 'RACE', 'SEX', 'AGE_GROUP', 'INFLOWS', 'OUTFLOWS', 'NET_MIGRATION'])
-        self.net_migration = self.net_migration.sort(['GEOID', 'RACE', 'SEX', 'AGE_GROUP'])
-
-        assert self.net_migration.shape[0] == 675648
-        assert self.net_migration.null_count().sum_horizontal().item() == 0
-        assert self.net_migration.filter(pl.col('NET_MIGRATION').is_nan()).shape[0] == 0
-
-        # store time series of migration in sqlite3
-        uri = f'sqlite:{OUTPUT_DATABASE}'
-        if self.current_projection_year == self.launch_year + 1:
-            migration = self.net_migration.rename({'NET_MIGRATION': f'NETMIG{self.current_projection_year}',
-                                                   'INFLOWS': f'INMIG{self.current_projection_year}',
-                                                   'OUTFLOWS': f'OUTMIG{self.current_projection_year}'}).clone()
-        else:
-            query = f'SELECT * FROM migration_by_race_sex_age_{self.scenario}'
-            migration = pl.read_database_uri(query=query, uri=uri).with_columns(pl.col('AGE_GROUP').cast(pl.Enum(AGE_GROUPS)))
-            current_migration = self.net_migration.clone().rename({'NET_MIGRATION': f'NETMIG{self.current_projection_year}',
-                                                                   'INFLOWS': f'INMIG{self.current_projection_year}',
-                                                                   'OUTFLOWS': f'OUTMIG{self.current_projection_year}'})
-            migration = migration.join(current_migration,
-                                       on=['GEOID', 'RACE', 'AGE_GROUP', 'SEX'],
-                                       how='left',
-                                       coalesce=True)
-
-        migration.write_database(table_name=f'migration_by_race_sex_age_{self.scenario}',
-                                 connection=uri,
-                                 if_table_exists='replace',
-                                 engine='adbc')
-
-        self.net_migration = self.net_migration.select(['GEOID', 'RACE', 'SEX', 'AGE_GROUP', 'NET_MIGRATION'])
-        migration = migration.sort(by=['GEOID', 'RACE', 'SEX', 'AGE_GROUP'])
-        assert self.net_migration.shape[0] == 675648
-        assert sum(migration.null_count()).item() == 0
-        assert self.net_migration.filter(pl.col('NET_MIGRATION') == np.nan).shape[0] == 0
-
-        pct_migration = round(((total_migrants_this_year / self.current_pop.select('POPULATION').sum().item())) * 100.0, 1)
-        print(f"...finished! ({total_migrants_this_year:,} total migrants this year; {pct_migration}% of the current population)")
-
-    def fertility(self):
+    def print_year_header(self):
+        '''
+        Print a banner at the start of each projection year
+        '''
+        print("##############")
+        print("###        ###")
+        print(f"###  {self.current_projection_year}  ###")
+        print("###        ###")
+        print("##############")
+        print(f"{time.ctime()}")
+        print(f"Scenarios: {len(self.members)}\n")
+
+    def print_year_footer(self, pop):
         '''
-        Calculate births
+        Print the end-of-year population of every scenario
         '''
-        print("Calculating fertility...", end='')
-
-        fertility_age_groups = ('15-19',
-                                '20-24',
-                                '25-29',
-                                '30-34',
-                                '35-39',
-                                '40-44')
-
-        # get CDC fertility rates by AGE_GROUP (15-44), RACE, and COUNTY
-        uri = f'sqlite:{CDC_DB}'
-        query = 'SELECT COFIPS AS GEOID, RACE, AGE_GROUP, FERTILITY \
-                 FROM fertility_2018_2022_county'
-        county_fert_rates = pl.read_database_uri(query=query, uri=uri)
-        county_fert_rates = county_fert_rates.with_columns(pl.when(pl.col('RACE') == 'MULTI')
-                                             .then(pl.lit('TWO_OR_MORE'))
-                                             .otherwise(pl.col('RACE'))
-                                             .alias('RACE'))
-        county_fert_rates = county_fert_rates.with_columns(pl.col('AGE_GROUP').cast(pl.Enum(AGE_GROUPS)))
-
-        df = self.current_pop.filter(pl.col('SEX').is_in(('FEMALE',)) & pl.col('AGE_GROUP').is_in(fertility_age_groups))
-
-        # get Census fertility rate adjustments
-        uri = f'sqlite:{CENSUS_DB}'
-        query = f'SELECT AGE_GROUP, TFR_MULTIPLIER AS FERT_MULT \
-                  FROM census_np2023_asfr \
-                  WHERE YEAR = "{self.current_projection_year - 1}"'
-        fert_multiply = pl.read_database_uri(query=query, uri=uri).with_columns(pl.col('AGE_GROUP').cast(pl.Enum(AGE_GROUPS)))
-
-        # adjust the county fertility rates using change factors from
-        # Census and then calculate births
-        df = df.join(other=county_fert_rates,
-                     on=['GEOID', 'AGE_GROUP', 'RACE'],
-                     how='left',
-                     coalesce=True)
-
-        df = df.join(other=fert_multiply,
-                     on='AGE_GROUP',
-                     how='left',
-                     coalesce=True)
-
-        df = df.with_columns(((pl.col('FERTILITY') * (1 + self.cdc_fert_adj) * pl.col('FERT_MULT') / 1000) * pl.col('POPULATION')).alias('TOTAL_BIRTHS'))
-        df = df.with_columns((pl.col('TOTAL_BIRTHS') * 0.512195122).alias('MALE'))  # from Mathews, et al. (2005)
-        df = df.with_columns((pl.col('TOTAL_BIRTHS') - pl.col('MALE')).alias('FEMALE'))
-        df = (df.select(['GEOID', 'RACE', 'MALE', 'FEMALE'])
-                .unpivot(index=['GEOID', 'RACE'], variable_name='SEX', value_name='BIRTHS')
-                .group_by(['GEOID', 'RACE', 'SEX']).agg(pl.col('BIRTHS').sum()))
-        df = df.with_columns(pl.lit('0-4').cast(pl.Enum(AGE_GROUPS)).alias('AGE_GROUP'))
-        assert sum(df.null_count()).item() == 0
-
-        # store births
-        self.births = df.clone()
-        total_births_this_year = round(self.births.select('BIRTHS').sum().item())
-
-        # store time series of fertility in sqlite3
-        uri = f'sqlite:{OUTPUT_DATABASE}'
-        if self.current_projection_year == self.launch_year + 1:
-            births = self.births.rename({'BIRTHS': str(self.current_projection_year)})
-        else:
-            query = f'SELECT * FROM births_by_race_sex_age_{self.scenario}'
-            births = pl.read_database_uri(query=query, uri=uri).with_columns(pl.col('AGE_GROUP').cast(pl.Enum(AGE_GROUPS)))
-            current_births = self.births.clone()
-            current_births = current_births.rename({'BIRTHS': str(self.current_projection_year)}).clone()
-            births = pl.concat(items=[births, current_births], how='align')
-        births.sort(by=['GEOID', 'RACE', 'SEX', 'AGE_GROUP'])
-        assert births.shape[0] == 37536
-        assert sum(births.null_count()).item() == 0
-        births.write_database(table_name=f'births_by_race_sex_age_{self.scenario}',
-                      connection=uri,
-                      if_table_exists='replace',
-                      engine='adbc')
-
-        print(f"finished! ({total_births_this_year:,} births this year)")
+        for member, member_pop in zip(self.members, pop):
+            print(f"[{member.label}] Total population (end): {round(member_pop.sum()):,}")
+        print()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,93 @@
+'''
+Per-year checkpoints for the ICLUS v3 projectors.
+
+After each projection year the population state and the run parameters are
+written next to the output database as an uncompressed .npz file. The
+component tables (deaths, immigration, ...) do not need to be copied: they
+are already in the output database's long tables, which are trimmed back to
+the checkpoint year on resume.
+'''
+import glob
+import json
+import os
+import re
+import zipfile
+
+import numpy as np
+
+
+def checkpoint_path(output_database, year):
+    '''
+    Checkpoint file for OUTPUT_DATABASE at the end of YEAR
+    '''
+    return f'{os.path.splitext(output_database)[0]}_checkpoint_{year}.npz'
+
+
+def write_checkpoint(output_database, year, parameters, arrays, keep=2):
+    '''
+    Write a checkpoint for the end of YEAR. PARAMETERS is a dict of run
+    parameters that must match on resume; ARRAYS is a dict of NumPy arrays
+    holding the projection state. Only the KEEP most recent checkpoints are
+    kept.
+    '''
+    path = checkpoint_path(output_database, year)
+
+    # write to a temporary file first so that an interrupted write never
+    # leaves a partial checkpoint behind
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as f:
+        np.savez(f,
+                 YEAR=np.array(year),
+                 PARAMETERS=np.array(json.dumps(parameters, sort_keys=True)),
+                 **arrays)
+    os.replace(temp_path, path)
+
+    for old_year in checkpoint_years(output_database)[:-keep]:
+        os.remove(checkpoint_path(output_database, old_year))
+
+
+def checkpoint_years(output_database):
+    '''
+    Years with a checkpoint for OUTPUT_DATABASE, oldest first
+    '''
+    pattern = re.compile(r'_checkpoint_(\d+)\.npz$')
+
+    years = []
+    for path in glob.glob(checkpoint_path(output_database, '*')):
+        match = pattern.search(path)
+        if match:
+            years.append(int(match.group(1)))
+
+    return sorted(years)
+
+
+def clear_checkpoints(output_database):
+    '''
+    Remove every checkpoint for OUTPUT_DATABASE
+    '''
+    for year in checkpoint_years(output_database):
+        os.remove(checkpoint_path(output_database, year))
+
+
+def latest_checkpoint(output_database, parameters):
+    '''
+    The most recent readable checkpoint for OUTPUT_DATABASE that was written
+    with the same PARAMETERS, as (year, arrays); None if there is not one
+    '''
+    for year in reversed(checkpoint_years(output_database)):
+        try:
+            with np.load(checkpoint_path(output_database, year)) as npz:
+                arrays = {key: npz[key] for key in npz.files}
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+            print(f"Skipping unreadable checkpoint for {year}")
+            continue
+
+        if 'YEAR' not in arrays or arrays.pop('YEAR').item() != year:
+            continue
+        if json.loads(arrays.pop('PARAMETERS').item()) != json.loads(json.dumps(parameters, sort_keys=True)):
+            print(f"Skipping checkpoint for {year}; run parameters do not match")
+            continue
+
+        return year, arrays
+
+    return None
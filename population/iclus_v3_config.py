@@ -0,0 +1,31 @@
+'''
+Folders and input databases shared by every ICLUS v3 module, and the time
+stamp of this run's output names.
+
+The inputs and outputs live under BASE_FOLDER, which is the project folder
+on whichever machine the run is on. Setting the ICLUS_V3_FOLDER environment
+variable points a run at another copy of the inputs (e.g. a small test set).
+'''
+import os
+
+from datetime import datetime
+
+
+BASE_FOLDER = 'D:\\OneDrive\\ICLUS_v3\\population'
+if os.path.isdir('D:\\projects\\ICLUS_v3\\population'):
+    BASE_FOLDER = 'D:\\projects\\ICLUS_v3\\population'
+BASE_FOLDER = os.environ.get('ICLUS_V3_FOLDER', BASE_FOLDER)
+
+INPUT_FOLDER = os.path.join(BASE_FOLDER, 'inputs')
+OUTPUT_FOLDER = os.path.join(BASE_FOLDER, 'outputs')
+
+POP_DB = os.path.join(INPUT_FOLDER, 'databases', 'population.sqlite')
+CDC_DB = os.path.join(INPUT_FOLDER, 'databases', 'cdc.sqlite')
+WITT_DB = os.path.join(INPUT_FOLDER, 'databases', 'wittgenstein.sqlite')
+CENSUS_DB = os.path.join(INPUT_FOLDER, 'databases', 'census.sqlite')
+ACS_DB = os.path.join(INPUT_FOLDER, 'databases', 'acs.sqlite')
+ANALYSIS_DB = os.path.join(INPUT_FOLDER, 'databases', 'analysis.sqlite')
+MIGRATION_DB = os.path.join(INPUT_FOLDER, 'databases', 'migration.sqlite')
+
+d = datetime.now()
+TIME_STAMP = f'{d.year}{d.month}{d.day}{d.hour}{d.minute}{d.second}'
@@ -0,0 +1,285 @@
+'''
+Dense, array-backed population state for the ICLUS v3 projectors.
+
+The population is held as a fixed-shape NumPy array with the axes
+(GEOID, RACE, SEX, AGE_GROUP). Every axis is integer coded, with the Enum
+codes of the layout's dimension registry (see iclus_v3_dimensions), and the
+codes follow the sort order ['GEOID', 'RACE', 'SEX', 'AGE_GROUP'] that the polars
+projector uses, so a flattened array lines up row for row with a sorted
+population DataFrame.
+'''
+import numpy as np
+import polars as pl
+
+from iclus_v3_dimensions import AGE_GROUPS, RACES, SEXES, DimensionRegistry
+
+FERTILITY_AGE_GROUPS = ('15-19', '20-24', '25-29', '30-34', '35-39', '40-44')
+
+MALE_BIRTH_FRACTION = 0.512195122  # from Mathews, et al. (2005)
+
+# width of every age group, in years
+AGE_GROUP_YEARS = 5
+
+
+class CohortLayout():
+    '''
+    Integer coding for the county x race x sex x age group population tensor.
+    '''
+    def __init__(self, geoids):
+
+        self.geoids = tuple(sorted(geoids))
+        self.races = RACES
+        self.sexes = SEXES
+        self.age_groups = AGE_GROUPS
+
+        self.shape = (len(self.geoids), len(RACES), len(SEXES), len(AGE_GROUPS))
+        self.size = int(np.prod(self.shape))
+
+        # the Enum codes of each key are its position on its axis
+        self.dimensions = DimensionRegistry(self.geoids)
+
+        self.keys = self.key_frame()
+
+    @classmethod
+    def from_frame(cls, df):
+        '''
+        Build a layout covering every GEOID found in a population DataFrame
+        '''
+        return cls(df.get_column('GEOID').unique().to_list())
+
+    def key_frame(self):
+        '''
+        One row per cell of the population array, in array order
+        '''
+        g, r, s, a = np.unravel_index(np.arange(self.size), self.shape)
+        df = pl.DataFrame({'GEOID': np.array(self.geoids)[g],
+                           'AGE_GROUP': np.array(self.age_groups)[a],
+                           'RACE': np.array(self.races)[r],
+                           'SEX': np.array(self.sexes)[s]})
+
+        return self.dimensions.encode(df)
+
+    def cell_index(self, df):
+        '''
+        Flat array position of each row of a DataFrame keyed by GEOID, RACE,
+        SEX and AGE_GROUP. Rows with keys outside of the layout get a null.
+        '''
+        codes = self.dimensions.encode(df.select(['GEOID', 'RACE', 'SEX', 'AGE_GROUP']), strict=False)
+        codes = codes.select(pl.all().to_physical().cast(pl.Int64))
+
+        _, n_races, n_sexes, n_ages = self.shape
+        index = (((pl.col('GEOID') * n_races + pl.col('RACE')) * n_sexes + pl.col('SEX')) * n_ages + pl.col('AGE_GROUP'))
+
+        return codes.select(index.alias('INDEX')).get_column('INDEX')
+
+    def to_array(self, df, value, complete=False):
+        '''
+        Scatter one value column of a keyed DataFrame into a population-shaped
+        array. Cells missing from the DataFrame are 0; rows for keys outside
+        of the layout are dropped, just like a left join onto current_pop.
+        '''
+        index = self.cell_index(df)
+        keep = index.is_not_null()
+        index = index.filter(keep).to_numpy()
+        values = df.get_column(value).filter(keep).cast(pl.Float64).to_numpy()
+
+        if complete:
+            assert index.shape[0] == self.size
+            assert np.unique(index).shape[0] == self.size
+            assert not np.isnan(values).any()
+
+        arr = np.bincount(index, weights=values, minlength=self.size)
+
+        return arr.reshape(self.shape)
+
+    def county_totals(self, df, value):
+        '''
+        Totals of one value column of a keyed DataFrame by GEOID, as an array
+        in the order of the layout's GEOIDs
+        '''
+        totals = df.group_by('GEOID').agg(pl.col(value).cast(pl.Float64).sum())
+        index = self.dimensions.codes(totals, 'GEOID')
+        keep = index.is_not_null()
+
+        return np.bincount(index.filter(keep).to_numpy(),
+                           weights=totals.get_column(value).filter(keep).to_numpy(),
+                           minlength=len(self.geoids))
+
+    def to_frame(self, arr, value):
+        '''
+        Gather a population-shaped array back into a keyed DataFrame
+        '''
+        assert arr.shape == self.shape
+
+        # flatten() always copies; polars may otherwise share memory with an
+        # array that is about to be updated in place
+        return self.keys.with_columns(pl.Series(name=value, values=arr.flatten()))
+
+
+class CohortSeries():
+    '''
+    One population-shaped array per year from FIRST_YEAR through LAST_YEAR,
+    preallocated as a single (YEAR x GEOID x RACE x SEX x AGE_GROUP) array in
+    the cell order of LAYOUT. Each year is filled in place, so adding a year
+    costs the same however many years are already held; the wide (one
+    column per year) DataFrame is only built when it is asked for.
+    '''
+    def __init__(self, layout, first_year, last_year, dtype=np.float64):
+
+        self.layout = layout
+        self.first_year = first_year
+        self.values = np.zeros((last_year - first_year + 1,) + layout.shape, dtype=dtype)
+        self.filled = np.zeros(last_year - first_year + 1, dtype=bool)
+
+    def __setitem__(self, year, arr):
+        self.values[year - self.first_year] = arr
+        self.filled[year - self.first_year] = True
+
+    def __getitem__(self, year):
+        assert self.filled[year - self.first_year], f'No values for {year}'
+        return self.values[year - self.first_year]
+
+    @property
+    def years(self):
+        return [self.first_year + i for i in np.flatnonzero(self.filled)]
+
+    def to_frame(self):
+        '''
+        The filled years as a wide DataFrame, one column per year
+        '''
+        return self.layout.keys.with_columns([pl.Series(name=str(year), values=self[year].flatten())
+                                              for year in self.years])
+
+
+def advance_cohorts(pop):
+    '''
+    Advance 20 percent of each cohort to the next AGE_GROUP, in place. The
+    85+ group keeps all of its population. Leading axes (if any) are left
+    alone, so this works just as well on a batch of populations.
+    '''
+    advancing = pop[..., :-1] * 0.2
+    pop[..., :-1] *= 0.8
+    pop[..., 1:] += advancing
+
+
+def advance_cohorts_by(pop, fraction):
+    '''
+    Advance FRACTION of each cohort to the next AGE_GROUP, in place, for a
+    projection step of several years; with 1 (a 5-year step) every cohort
+    moves up a whole age group. The 85+ group keeps all of its population.
+    '''
+    advancing = pop[..., :-1] * fraction
+    pop[..., :-1] -= advancing
+    pop[..., 1:] += advancing
+
+
+def step_survival(mortality_rates, fraction, exposure=1.0):
+    '''
+    Probability of surviving a projection step of several years, given the
+    annual mortality rates of each year of the step (a sequence of
+    population-shaped arrays), when FRACTION of each cohort advances to the
+    next AGE_GROUP over the step. Cohorts that advance are exposed to the
+    mean of the rates of both age groups. EXPOSURE is the share of the step
+    the population is exposed for (e.g. 0.5 for births, which arrive over
+    the step).
+    '''
+    mortality_rates = np.asarray(mortality_rates)
+
+    advancing_rates = mortality_rates.copy()
+    advancing_rates[..., :-1] = (mortality_rates[..., :-1] + mortality_rates[..., 1:]) / 2
+    staying = np.prod(1 - mortality_rates, axis=0) ** exposure
+    advancing = np.prod(1 - advancing_rates, axis=0) ** exposure
+
+    # the 85+ group never advances
+    fractions = np.full(staying.shape[-1], fraction)
+    fractions[-1] = 0
+
+    return (1 - fractions) * staying + fractions * advancing
+
+
+def births_by_sex(pop, fert_rates):
+    '''
+    Total births by GEOID and RACE, split into FEMALE and MALE births. The
+    result has the same shape as pop except for the AGE_GROUP axis.
+    '''
+    total_births = (pop * fert_rates).sum(axis=(-2, -1))
+
+    births = np.empty(pop.shape[:-1])
+    births[..., SEXES.index('MALE')] = total_births * MALE_BIRTH_FRACTION
+    births[..., SEXES.index('FEMALE')] = total_births - births[..., SEXES.index('MALE')]
+
+    return births
+
+
+class YearRates():
+    '''
+    The MORTALITY_RATES and FERTILITY_RATES of one projection year, as
+    population-shaped arrays (any leading axes), applied the way the
+    'dense' engine applies them. The LeslieOperator applies the same rates
+    through one operator, with the same methods. Either array may be left
+    out if only the other is applied.
+    '''
+    def __init__(self, mortality_rates=None, fertility_rates=None):
+
+        self.mortality_rates = mortality_rates
+        self.fertility_rates = fertility_rates
+
+    def deaths(self, pop):
+        return pop * self.mortality_rates
+
+    def births(self, pop):
+        return births_by_sex(pop, self.fertility_rates)
+
+    def advance(self, pop, births):
+        '''
+        Advance every cohort of POP and add BIRTHS to 0-4, in place
+        '''
+        advance_cohorts(pop)
+        pop[..., 0] += births
+
+
+def deaths_and_immigration(pop, rates, immigrants, validator):
+    '''
+    The components of a projection year that come before domestic
+    migration, applied to the population array POP in place: deaths at the
+    year's RATES (YearRates or LeslieOperator), then net IMMIGRANTS, after
+    which negative cells are clipped to 0. Every component and the clip go
+    through VALIDATOR (see iclus_v3_validation). Returns the deaths.
+
+    Every dense engine (the Projector's 'dense' and 'leslie' engines, the
+    batch, calibration, service and out-of-core projectors) projects a year
+    with this and migration_births_and_aging(), with its own migration in
+    between.
+    '''
+    deaths = rates.deaths(pop)
+    pop -= deaths
+    validator.add('deaths', deaths)
+    validator.scan(pop)
+
+    pop += immigrants
+    validator.add('immigration', immigrants)
+    validator.clip(pop)
+
+    return deaths
+
+
+def migration_births_and_aging(pop, net_migration, rates, validator):
+    '''
+    The components of a projection year from domestic migration on, applied
+    to the population array POP in place: NET_MIGRATION (of the population
+    left by deaths_and_immigration()), after which POP is rounded to whole
+    people and clipped at 0, then the births of the year's RATES, aging of
+    every cohort and rounding again. Every component and adjustment goes
+    through VALIDATOR. Returns the births.
+    '''
+    pop += net_migration
+    validator.add('migration', net_migration)
+    validator.round(pop)
+    validator.clip(pop)
+
+    births = rates.births(pop)
+    rates.advance(pop, births)
+    validator.add('births', births)
+    validator.round(pop)
+
+    return births
@@ -0,0 +1,91 @@
+'''
+Shared registry of the categorical keys of the ICLUS v3 projectors.
+
+Every key the projectors join and group on (counties, races, sexes, age
+groups and BEA10 labor market regions) is coded as a polars Enum when it is
+loaded, so joins, group_bys, sorts and windows work on the integer codes
+underneath instead of on strings. The categories of each Enum are sorted the
+way the labels sort (age groups from youngest to oldest), so sorting by the
+codes orders rows exactly like sorting by the labels did. Labels are only
+decoded back to strings when outputs are written (see decode()). Urban
+classes and the migration model's indicator columns are small integers to
+begin with and are held as UInt8.
+'''
+import polars as pl
+
+
+# axis labels, in the same order polars sorts them
+RACES = ('AIAN', 'ASIAN', 'BLACK', 'NHPI', 'TWO_OR_MORE', 'WHITE')
+SEXES = ('FEMALE', 'MALE')
+AGE_GROUPS = ('0-4', '5-9', '10-14', '15-19', '20-24', '25-29', '30-34',
+              '35-39', '40-44', '45-49', '50-54', '55-59', '60-64', '65-69',
+              '70-74', '75-79', '80-84', '85+')
+
+# columns that hold a county GEOID
+COUNTY_COLUMNS = ('GEOID', 'COFIPS', 'ORIGIN_FIPS', 'DESTINATION_FIPS')
+
+# columns that hold a BEA10 labor market region
+BEA10_COLUMNS = ('BEA10', 'ORIGIN_BEA10', 'DESTINATION_BEA10')
+
+# small integer codes
+FLAG_COLUMNS = ('URBANDESTINATION20', 'SAME_LABOR_MARKET', 'MICRO_DESTINATION20', 'METRO_DESTINATION20')
+
+
+def recode(column, dtype, current, strict=True):
+    '''
+    Expression casting COLUMN, currently of type CURRENT, to DTYPE. Any
+    column coded as an Enum is re-coded through its labels (as strings); with
+    STRICT off, labels that are not categories of DTYPE become null.
+    '''
+    if current == dtype:
+        return pl.col(column)
+
+    expr = pl.col(column)
+    if isinstance(dtype, pl.Enum) and current != pl.String:
+        expr = expr.cast(pl.String)
+
+    return expr.cast(dtype, strict=strict)
+
+
+def decode(df):
+    '''
+    DF with every Enum column decoded back to its labels
+    '''
+    return df.with_columns([pl.col(column).cast(pl.String)
+                            for column, dtype in df.schema.items() if isinstance(dtype, pl.Enum)])
+
+
+class DimensionRegistry():
+    '''
+    The Enum type of every categorical key of a run, for the counties in
+    GEOIDS and the labor market regions in BEA10
+    '''
+    def __init__(self, geoids, bea10=()):
+
+        self.county = pl.Enum(sorted(geoids))
+        self.bea10 = pl.Enum(sorted(str(region) for region in bea10))
+
+        self.dtypes = {'RACE': pl.Enum(RACES),
+                       'SEX': pl.Enum(SEXES),
+                       'AGE_GROUP': pl.Enum(AGE_GROUPS)}
+        self.dtypes.update({column: self.county for column in COUNTY_COLUMNS})
+        if bea10:
+            self.dtypes.update({column: self.bea10 for column in BEA10_COLUMNS})
+        self.dtypes.update({column: pl.UInt8 for column in FLAG_COLUMNS})
+
+    def encode(self, df, strict=True):
+        '''
+        DF with every key column coded; with STRICT off, keys that are not in
+        the registry become null instead of raising an error
+        '''
+        schema = df.schema
+
+        return df.with_columns([recode(column, dtype, schema[column], strict)
+                                for column, dtype in self.dtypes.items() if column in schema])
+
+    def codes(self, df, column):
+        '''
+        Integer codes of one key column of DF, null for keys that are not in
+        the registry
+        '''
+        return self.encode(df.select(column), strict=False).get_column(column).to_physical()
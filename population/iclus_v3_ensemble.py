@@ -0,0 +1,212 @@
+'''
+Monte Carlo ensembles of Census projections, for uncertainty bands around the
+county projections.
+
+An ensemble draws N parameter sets (the Census immigration scenario and the
+CDC fertility and mortality adjustments), and optionally a draw of the
+migration model coefficients for each member, and projects all of the
+members at once with the batched engine (see BatchProjector), which carries
+the members along a leading ensemble axis. Domestic migration is evaluated
+with the NumPy form of the migration model (dense_migration_plum_v3), which
+prepares the county pairs once for the whole ensemble. Rather than N full
+sets of output tables, only quantiles across the ensemble (by default p5,
+p50 and p95) of each county's population and components are written, once
+per county and year.
+
+The coefficient table holds no standard errors, so a member's migration
+coefficients are drawn as COEFF * (1 + COEFFICIENT_SD * a standard normal
+draw), independently for every coefficient; a COEFFICIENT_SD of 0 keeps the
+fitted coefficients.
+'''
+import os
+import time
+
+import numpy as np
+import polars as pl
+
+import iclus_v3_census
+from iclus_v3_config import OUTPUT_FOLDER, TIME_STAMP
+from iclus_v3_migration import dense_migration_plum_v3 as DenseMigrationModel
+from iclus_v3_validation import county_totals
+
+
+OUTPUT_DATABASE = os.path.join(OUTPUT_FOLDER, f'iclus_v3_ensemble_{TIME_STAMP}.sqlite')
+
+# parameters are drawn uniformly from these
+SCENARIOS = ('hi', 'mid', 'low')
+CDC_FERT_ADJ_RANGE = (-0.055, 0.0)
+CDC_MORT_ADJ_RANGE = (-0.15, 0.15)
+
+QUANTILES = (0.05, 0.5, 0.95)
+
+# outputs summarized for every county and year
+OUTPUTS = ('deaths', 'immigration', 'migration', 'births', 'population')
+
+
+def draw_members(n, rng, scenarios=SCENARIOS, cdc_fert_adj_range=CDC_FERT_ADJ_RANGE,
+                 cdc_mort_adj_range=CDC_MORT_ADJ_RANGE):
+    '''
+    N (scenario, cdc_fert_adj, cdc_mort_adj) parameter sets
+    '''
+    return [(str(rng.choice(scenarios)),
+             float(rng.uniform(*cdc_fert_adj_range)),
+             float(rng.uniform(*cdc_mort_adj_range)))
+            for _ in range(n)]
+
+
+def perturb_coefficients(coefs, sd, rng):
+    '''
+    A draw of the migration model coefficients COEFS, each one multiplied by
+    (1 + SD * a standard normal draw)
+    '''
+    coeff = coefs.get_column('COEFF').cast(pl.Float64).to_numpy()
+
+    return coefs.with_columns(pl.Series(name='COEFF', values=coeff * (1 + sd * rng.standard_normal(coeff.shape))))
+
+
+class CountyTotalsProjector(iclus_v3_census.BatchProjector):
+    '''
+    A BatchProjector that keeps only the county totals of every output of
+    every member (member x county arrays) and hands them to save_totals()
+    at the end of each projection year. Migration is evaluated with
+    dense_migration_plum_v3. Results go to the batch's output database,
+    through write().
+    '''
+    def __init__(self, scenarios, census_imm_hist2324, output_database, workers=1, validation='cheap',
+                 validation_sample=None):
+
+        super().__init__(scenarios, census_imm_hist2324, output_database, workers=workers, validation=validation,
+                         validation_sample=validation_sample)
+
+        # county totals of each output for the current projection year;
+        # migration is kept by member label, as members finish migrating
+        self.totals = {}
+        self.migration_totals = {}
+
+        self.migration_model = None
+
+    def start(self):
+        '''
+        Prepare the county pairs for the migration model
+        '''
+        self.migration_model = DenseMigrationModel(self.layout, self.migration_distance)
+
+    def member_migration(self, member, member_pop):
+        inflows, outflows = self.migration_model.migrate(member_pop, member.migration_coefficients)
+        net_migration = inflows - outflows
+        self.migration_totals[member.label] = county_totals(net_migration)
+
+        return net_migration
+
+    def save_migration(self):
+        pass
+
+    def save_component(self, name, value, arr):
+        self.totals[name] = np.stack([county_totals(member_arr) for member_arr in arr])
+
+    def save_births(self, births):
+        self.totals['births'] = np.stack([county_totals(member_births) for member_births in births])
+
+    def save_population(self, pop):
+        self.totals['population'] = np.stack([county_totals(member_pop) for member_pop in pop])
+        self.totals['migration'] = np.stack([self.migration_totals[member.label] for member in self.members])
+
+        self.save_totals(self.totals)
+        self.totals = {}
+
+    def save_totals(self, totals):
+        '''
+        Write the results for the current projection year, given TOTALS,
+        {output: member x county array}
+        '''
+        raise NotImplementedError
+
+    def finish(self):
+        self.scheduler.close()
+
+
+class EnsembleProjector(CountyTotalsProjector):
+    '''
+    Projects N members drawn with the random SEED at once and writes the
+    QUANTILES of each county's outputs across the members to the
+    "ensemble_quantiles" table of OUTPUT_DATABASE. The drawn parameters are
+    written to the "ensemble_members" table.
+    '''
+    def __init__(self, n, census_imm_hist2324, seed=None, coefficient_sd=0.0,
+                 quantiles=QUANTILES, output_database=None, workers=1, validation='cheap',
+                 validation_sample=None, **ranges):
+
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.coefficient_sd = coefficient_sd
+        self.quantiles = quantiles
+
+        super().__init__(draw_members(n, self.rng, **ranges),
+                         census_imm_hist2324,
+                         OUTPUT_DATABASE if output_database is None else output_database,
+                         workers=workers,
+                         validation=validation,
+                         validation_sample=validation_sample)
+
+    def migration_coefficients(self, member, coefs):
+        if self.coefficient_sd == 0:
+            return coefs
+        return perturb_coefficients(coefs, self.coefficient_sd, self.rng)
+
+    def start(self):
+        '''
+        Prepare the migration model and record the drawn parameters
+        '''
+        super().start()
+
+        df = pl.DataFrame({'LABEL': [m.label for m in self.members],
+                           'SCENARIO': [m.scenario for m in self.members],
+                           'CDC_FERT_ADJ': [m.cdc_fert_adj for m in self.members],
+                           'CDC_MORT_ADJ': [m.cdc_mort_adj for m in self.members],
+                           'CENSUS_IMM_HIST2324': [m.census_imm_hist2324 for m in self.members],
+                           'SEED': [self.seed] * len(self.members),
+                           'COEFFICIENT_SD': [self.coefficient_sd] * len(self.members)})
+        self.write('ensemble_members', df, replace=True)
+        self.write('ensemble_quantiles', pl.DataFrame(schema=self.quantile_schema()), replace=True)
+
+    def quantile_schema(self):
+        schema = {'YEAR': pl.Int64, 'GEOID': pl.String, 'OUTPUT': pl.String}
+        schema.update({f'P{round(q * 100)}': pl.Float64 for q in self.quantiles})
+
+        return schema
+
+    def save_totals(self, totals):
+        '''
+        Write the quantiles of every output for the current projection year
+        '''
+        frames = []
+        for name in OUTPUTS:
+            values = np.quantile(totals[name], self.quantiles, axis=0)
+            df = pl.DataFrame({'YEAR': self.current_projection_year,
+                               'GEOID': self.layout.geoids,
+                               'OUTPUT': name})
+            frames.append(df.with_columns([pl.Series(name=f'P{round(q * 100)}', values=v)
+                                           for q, v in zip(self.quantiles, values)]))
+
+        self.write('ensemble_quantiles', pl.concat(frames).cast(self.quantile_schema()))
+
+
+def main(n, census_imm_hist2324, seed=None, coefficient_sd=0.0, workers=1, final_projection_year=2099,
+         validation='cheap', validation_sample=None):
+    '''
+    Run an ensemble of N members
+    '''
+    model = EnsembleProjector(n=n,
+                              census_imm_hist2324=census_imm_hist2324,
+                              seed=seed,
+                              coefficient_sd=coefficient_sd,
+                              workers=workers,
+                              validation=validation,
+                              validation_sample=validation_sample)
+    model.run(final_projection_year)
+
+
+if __name__ == '__main__':
+    print(time.ctime())
+    main(n=100, census_imm_hist2324=False, seed=2025, coefficient_sd=0.05, workers=4)
+    print(time.ctime())
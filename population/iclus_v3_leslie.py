@@ -0,0 +1,98 @@
+'''
+Leslie-style projection operators for the ICLUS v3 projectors.
+
+Within one county and race, the non-migration dynamics of a projection year
+are linear in the (SEX x AGE_GROUP) population vector x:
+
+    survival  x -> S x   S = diag(1 - mortality rate)
+    aging     x -> A x   A keeps 80% of each age group in place and moves 20%
+                         to the next one; 85+ keeps all of its population
+    births    x -> B x   B adds the births of FEMALE 15-44 to 0-4, split by
+                         sex
+
+A is the same small (36 x 36) matrix for every county and race, and B only
+has two non-zero rows, so the operator is applied to every county and race
+at once as one shared matrix product plus a batched dot product for births,
+without any sorting or window passes.
+'''
+import numpy as np
+
+from iclus_v3_dense import AGE_GROUPS, MALE_BIRTH_FRACTION, SEXES
+
+
+# length of the per county and race state vector
+N_COHORTS = len(SEXES) * len(AGE_GROUPS)
+
+
+def aging_matrix():
+    '''
+    The (SEX x AGE_GROUP) square aging matrix A
+    '''
+    n = len(AGE_GROUPS)
+    block = np.diag(np.full(n, 0.8)) + np.diag(np.full(n - 1, 0.2), k=-1)
+    block[-1, -1] = 1.0
+
+    return np.kron(np.eye(len(SEXES)), block)
+
+
+AGING = aging_matrix()
+
+# share of births by SEX, and the position of 0-4 for each SEX in the state
+# vector
+BIRTH_SHARES = np.array([1 - MALE_BIRTH_FRACTION if sex == 'FEMALE' else MALE_BIRTH_FRACTION for sex in SEXES])
+BIRTH_COHORTS = np.arange(len(SEXES)) * len(AGE_GROUPS)
+
+
+class LeslieOperator():
+    '''
+    One projection year of survival, aging and births for every county and
+    race. MORTALITY_RATES and FERTILITY_RATES are population-shaped arrays
+    (any leading axes, then SEX and AGE_GROUP), as returned by RateStore.
+    It has the methods of YearRates, so it can drive the dense year step
+    (see deaths_and_immigration()).
+    '''
+    def __init__(self, mortality_rates, fertility_rates):
+
+        assert mortality_rates.shape == fertility_rates.shape
+
+        self.shape = mortality_rates.shape
+        self.survival = (1 - mortality_rates).reshape(self.shape[:-2] + (N_COHORTS,))
+        self.fertility = fertility_rates.reshape(self.shape[:-2] + (N_COHORTS,))
+
+    def flat(self, pop):
+        return pop.reshape(pop.shape[:-2] + (N_COHORTS,))
+
+    def survive(self, pop):
+        '''
+        S x
+        '''
+        return pop * self.survival.reshape(self.shape)
+
+    def deaths(self, pop):
+        '''
+        x - S x
+        '''
+        return pop - self.survive(pop)
+
+    def births(self, pop):
+        '''
+        B x, as births by SEX (the population shape without AGE_GROUP)
+        '''
+        total_births = (self.flat(pop) * self.fertility).sum(axis=-1)
+
+        return total_births[..., np.newaxis] * BIRTH_SHARES
+
+    def advance(self, pop, births=None):
+        '''
+        (A + B) x: advance every cohort and add births to 0-4, in place.
+        BIRTHS are the births of POP (see births()), if they are already
+        computed.
+        '''
+        if births is None:
+            births = self.births(pop)
+
+        out = self.flat(pop) @ AGING.T
+        out[..., BIRTH_COHORTS] += births
+        pop[...] = out.reshape(pop.shape)
+
+        return pop
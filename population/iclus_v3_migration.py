@@ -6,18 +6,10 @@ import os
 import numpy as np
 import polars as pl
 
+from iclus_v3_config import ANALYSIS_DB, MIGRATION_DB, OUTPUT_FOLDER
+from iclus_v3_dimensions import AGE_GROUPS, DimensionRegistry, recode
+from iclus_v3_trace import Tracer
 
-BASE_FOLDER = 'D:\\OneDrive\\ICLUS_v3\\population'
-if os.path.isdir('D:\\projects\\ICLUS_v3\\population'):
-    BASE_FOLDER = 'D:\\projects\\ICLUS_v3\\population'
-INPUT_FOLDER = os.path.join(BASE_FOLDER, 'inputs')
-OUTPUT_FOLDER = os.path.join(BASE_FOLDER, 'outputs')
-ANALYSIS_DB = os.path.join(INPUT_FOLDER, 'databases', 'analysis.sqlite')
-MIGRATION_DB = os.path.join(INPUT_FOLDER, 'databases', 'migration.sqlite')
-
-AGE_GROUPS = ('0-4', '5-9', '10-14', '15-19', '20-24', '25-29', '30-34',
-              '35-39', '40-44', '45-49', '50-54', '55-59', '60-64', '65-69',
-              '70-74', '75-79', '80-84', '85+')
 
 COLUMN_MAP = {'count_.Intercept.': 'c_int',
               'count_ln_Pi': 'c_ln_Pi',
@@ -45,176 +37,288 @@ COEF_RACE_MAP = {'WHITE': 'WHITE',
                  'NHPI': 'API',
                  'TWO_OR_MORE': 'OTHER'}
 
+def read_distance(path):
+    '''
+    Memory-map a county to county distance table written by
+    migration_plum_v3.write_distance(). The operating system shares the
+    mapped pages between every process that reads the same file.
+    '''
+    return pl.read_ipc(path, memory_map=True)
+
+
+class PopulationView():
+    '''
+    Read-only population of each race by county and age group, summed over
+    sex, that the projectors hand to migration_plum_v3 every year in place of
+    the population DataFrame. POP is a county x race x sex x age group array
+    in the order of LAYOUT; the sex totals are the only thing computed from
+    it.
+    '''
+    def __init__(self, pop, layout):
+
+        assert tuple(layout.age_groups) == AGE_GROUPS
+        self.geoids = tuple(layout.geoids)
+        self.races = tuple(layout.races)
+
+        # county x race x age group, and county x race
+        self.age_pop = pop.sum(axis=-2)
+        self.race_pop = self.age_pop.sum(axis=-1)
+        self.age_pop.flags.writeable = False
+        self.race_pop.flags.writeable = False
+
+    def race(self, race):
+        '''
+        County x age group and county population of one RACE, as read-only
+        views
+        '''
+        r = self.races.index(race)
+
+        return self.age_pop[:, r, :], self.race_pop[:, r]
+
+
+def read_coefficients():
+    '''
+    The coefficients of the model (and the significance of each) from the
+    regression outputs, with one row per race, age group and variable
+    '''
+    # set up the regression coefficients
+    uri = f"sqlite:{os.path.join(OUTPUT_FOLDER, 'zinb_regression_outputs.sqlite')}"
+    query = 'SELECT * FROM coefficients_Census_1990'
+    coefs = pl.read_database_uri(query=query, uri=uri)
+
+    coefs = pl.read_database_uri(query=query, uri=uri)
+    coefs = (coefs.with_columns(pl.col('AGE_GROUP').str.replace('_TO_', '-')
+                  .alias('AGE_GROUP')))
+    coefs.rename(COLUMN_MAP)
+    coefs = coefs.melt(id_vars=['RACE', 'AGE_GROUP'],
+                       variable_name='VARIABLE',
+                       value_name='COEFF')
+
+    # set up the signifcance terms, which vary somewhat from race to race
+    query = 'SELECT * FROM significance_Census_1990'
+    sigs = pl.read_database_uri(query=query, uri=uri)
+    sigs = (sigs.with_columns(pl.col('AGE_GROUP').str.replace('_TO_', '-')
+               .alias('AGE_GROUP')))
+    sigs = sigs.drop(['CONVERGED'])
+    sigs.rename(COLUMN_MAP)
+    sigs = sigs.melt(id_vars=['RACE', 'AGE_GROUP'],
+                     variable_name='VARIABLE',
+                     value_name='P_VALUE')
+
+    df = coefs.join(other=sigs,
+                    on=['RACE', 'AGE_GROUP', 'VARIABLE'],
+                    how='left')
+
+    # for now keep all of the intercepts regardless of statistical significance;
+    # otherwise set the coefficient to 0 when P_VALUE >- ALPHA
+    # df.loc[(df.P_VALUE >= self.ALPHA) & (df.AGE_GROUP != '85+') & (~df.index.get_level_values('VARIABLE').isin(['c_int', 'z_int'])), 'COEFF'] = 0.0
+    return df
+
+
+def read_urban_counties():
+    # Destination counties are identified as rural, micropolitan, or
+    # metropolitan using values 1, 2, and 3, respectively.
+    uri = f'sqlite:{MIGRATION_DB}'
+    query = 'SELECT COFIPS, URBANDESTINATION20 \
+             FROM fips_to_urb20_bea10_hhs'
+    df = pl.read_database_uri(query=query, uri=uri)
+
+    df = df.with_columns(pl.lit(0).alias('MICRO_DESTINATION20'))
+    df = df.with_columns(pl.lit(0).alias('METRO_DESTINATION20'))
+
+    df = df.with_columns(pl.when(pl.col('URBANDESTINATION20') == 2)
+                           .then(pl.lit(1))
+                           .alias('MICRO_DESTINATION20'))
+    df = df.with_columns(pl.col("MICRO_DESTINATION20").fill_null(strategy="zero"))
+
+    df = df.with_columns(pl.when(pl.col('URBANDESTINATION20') == 3)
+                           .then(pl.lit(1))
+                           .alias('METRO_DESTINATION20'))
+    df = df.with_columns(pl.col("METRO_DESTINATION20").fill_null(strategy="zero"))
+    df = df.drop('URBANDESTINATION20')
+
+    return df
+
+
+def read_labor_markets():
+    '''
+    The BEA10 labor market region of every county
+    '''
+    uri = f'sqlite:{MIGRATION_DB}'
+    query = 'SELECT COFIPS, BEA10 \
+            FROM fips_to_urb20_bea10_hhs'
+    df = pl.read_database_uri(query=query, uri=uri)
+
+    return df
+
+
 class migration_plum_v3():
     '''
     Pull the coefficients of a zeroinflated negative bionomical regression model
     fit to 1990 Census data.
+
+    DISTANCE is an optional, already prepared county to county distance table
+    (see write_distance() and read_distance()); it is built from the input
+    databases when it is not supplied. COEFS are optional coefficients (in
+    the format of self.coefs) to use instead of the fitted ones.
     '''
-    def __init__(self):
+    def __init__(self, distance=None, coefs=None):
 
         self.model_name = 'PLUMv0'
 
-        self.current_pop = None
+        self.population = None
         self.coefs = None
 
+        # position of the origin and destination of every county pair in the
+        # counties of the population view, matched once per set of counties
+        self.positions = None
+
+        # timing trace; the projector replaces this with its own Tracer
+        self.tracer = Tracer()
 
         self.alpha = 0.05
 
-        self.retrieve_coefficients()
-        self.intra_labor_market = self.get_intra_labor_market_moves()
-        self.urban_counties = self.get_urban_counties()
-        self.distance = self.get_euclidean_distance()
+        if coefs is None:
+            self.retrieve_coefficients()
+        else:
+            self.coefs = coefs
+        if distance is None:
+            self.intra_labor_market = self.get_intra_labor_market_moves()
+            self.urban_counties = self.get_urban_counties()
+            self.distance = self.get_euclidean_distance()
+        else:
+            self.distance = distance
+
+    def write_distance(self, path):
+        '''
+        Write the prepared distance table to an uncompressed Arrow IPC file so
+        that it can be memory-mapped with read_distance()
+        '''
+        self.distance.write_ipc(path, compression='uncompressed')
 
     def retrieve_coefficients(self):
         '''
         Query a SQLite database for the correct coefficients, format them and
         then set the result as self.coefficients
         '''
-        # set up the regression coefficients
-        uri = f"sqlite:{os.path.join(OUTPUT_FOLDER, 'zinb_regression_outputs.sqlite')}"
-        query = 'SELECT * FROM coefficients_Census_1990'
-        coefs = pl.read_database_uri(query=query, uri=uri)
-
-        coefs = pl.read_database_uri(query=query, uri=uri)
-        coefs = (coefs.with_columns(pl.col('AGE_GROUP').str.replace('_TO_', '-')
-                      .alias('AGE_GROUP')))
-        coefs.rename(COLUMN_MAP)
-        coefs = coefs.melt(id_vars=['RACE', 'AGE_GROUP'],
-                           variable_name='VARIABLE',
-                           value_name='COEFF')
-
-        # set up the signifcance terms, which vary somewhat from race to race
-        query = 'SELECT * FROM significance_Census_1990'
-        sigs = pl.read_database_uri(query=query, uri=uri)
-        sigs = (sigs.with_columns(pl.col('AGE_GROUP').str.replace('_TO_', '-')
-                   .alias('AGE_GROUP')))
-        sigs = sigs.drop(['CONVERGED'])
-        sigs.rename(COLUMN_MAP)
-        sigs = sigs.melt(id_vars=['RACE', 'AGE_GROUP'],
-                         variable_name='VARIABLE',
-                         value_name='P_VALUE')
-
-        df = coefs.join(other=sigs,
-                        on=['RACE', 'AGE_GROUP', 'VARIABLE'],
-                        how='left')
-
-        # for now keep all of the intercepts regardless of statistical significance;
-        # otherwise set the coefficient to 0 when P_VALUE >- ALPHA
-        # df.loc[(df.P_VALUE >= self.ALPHA) & (df.AGE_GROUP != '85+') & (~df.index.get_level_values('VARIABLE').isin(['c_int', 'z_int'])), 'COEFF'] = 0.0
-        self.coefs = df.clone()
+        self.coefs = read_coefficients()
+
+    def set_population(self, population):
+        '''
+        Hand the model the PopulationView of the current projection year. The
+        county pairs are matched to the view's counties the first time the
+        model sees them; with the pair table coded like the view (as the
+        projectors code it), the positions are just the codes.
+        '''
+        if self.positions is None or self.positions[0] != population.geoids:
+            counties = pl.Enum(population.geoids)
+            schema = self.distance.schema
+            codes = self.distance.select([recode(column, counties, schema[column], strict=False).to_physical()
+                                          for column in ('ORIGIN_FIPS', 'DESTINATION_FIPS')])
+            assert codes.null_count().sum_horizontal().item() == 0
+            self.positions = (population.geoids,
+                              codes.get_column('ORIGIN_FIPS').to_numpy(),
+                              codes.get_column('DESTINATION_FIPS').to_numpy())
+
+        self.population = population
 
     def compute_migrants(self, race):
         '''
         Placeholder
         '''
-        race_pop = (self.current_pop
-                    .filter(pl.col('RACE') == race)
-                    .select(['GEOID', 'POPULATION'])
-                    .group_by('GEOID')
-                    .sum())
+        # the populations of the origin and destination of every pair are
+        # read from the population view by position
+        _, origin, destination = self.positions
+        age_pops, race_pop = self.population.race(race)
+        pj = race_pop[destination]
 
         gross_migration_flows = None
 
         # for age_group in ('50-54',):
-        for age_group in AGE_GROUPS:
-            print(f"\t\t{age_group}")
-
-            age_pop = (self.current_pop
-                       .filter((pl.col('RACE') == race) & (pl.col('AGE_GROUP') == age_group))
-                       .select(['GEOID', 'POPULATION'])
-                       .group_by('GEOID')
-                       .sum())
-
-            df = self.compute_spatial_variables(age_pop=age_pop, race_pop=race_pop)
-
-            age_group_label = age_group
-            if age_group == '0-4':
-                age_group_label = '5-9'
-
-            if age_group == '85+':
-                age_group_label = '85-115'
-
-            coefs = self.coefs.filter((pl.col('RACE') == COEF_RACE_MAP[race]) & (pl.col('AGE_GROUP') == age_group_label))
-            assert coefs.shape == (18, 5)
-
-            # calculate the zero model first
-            z_int = coefs.filter(pl.col('VARIABLE') == 'zero_.Intercept.')['COEFF'][0]
-            z_pi = coefs.filter(pl.col('VARIABLE') == 'zero_ln_Pi')['COEFF'][0]
-            z_pj = coefs.filter(pl.col('VARIABLE') == 'zero_ln_Pj')['COEFF'][0]
-            z_cij = coefs.filter(pl.col('VARIABLE') == 'zero_ln_Cij')['COEFF'][0]
-            z_tij = coefs.filter(pl.col('VARIABLE') == 'zero_ln_Tij')['COEFF'][0]
-            z_pj_star = coefs.filter(pl.col('VARIABLE') == 'zero_ln_Pj_star')['COEFF'][0]
-
-            z_labor = coefs.filter(pl.col('VARIABLE') == 'zero_factor.SAME_LABOR_MARKET.1')['COEFF'][0]
-            z_micro = coefs.filter(pl.col('VARIABLE') == 'zero_factor.MICRODEST20.1')['COEFF'][0]
-            z_metro = coefs.filter(pl.col('VARIABLE') == 'zero_factor.METRODEST20.1')['COEFF'][0]
-
-            df = df.with_columns(1 - np.exp(-np.exp(z_int +
-                                                   (z_pi * np.log(pl.col('Pi') + 1)) +
-                                                   (z_pj * np.log(pl.col('Pj') + 1)) +
-                                                   (z_cij * np.log(pl.col('Cij') + pl.col('Pj') + 1)) +
-                                                   (z_tij * np.log(pl.col('Tij') + 1)) +
-                                                   (z_pj_star * np.log(pl.col('Pj_star') + 1)) +
-                                                   (z_labor * pl.col('SAME_LABOR_MARKET')) +
-                                                   (z_micro * pl.col('MICRO_DESTINATION20')) +
-                                                   (z_metro * pl.col('METRO_DESTINATION20')))))
-            df = df.rename({'literal': 'ZERO_RESULT'})
-
-            # calculate the count model
-            c_int = coefs.filter(pl.col('VARIABLE') == 'count_.Intercept.')['COEFF'][0]
-            c_pi = coefs.filter(pl.col('VARIABLE') == 'count_ln_Pi')['COEFF'][0]
-            c_pj = coefs.filter(pl.col('VARIABLE') == 'count_ln_Pj')['COEFF'][0]
-            c_cij = coefs.filter(pl.col('VARIABLE') == 'count_ln_Cij')['COEFF'][0]
-            c_tij = coefs.filter(pl.col('VARIABLE') == 'count_ln_Tij')['COEFF'][0]
-            c_pj_star = coefs.filter(pl.col('VARIABLE') == 'count_ln_Pj_star')['COEFF'][0]
-            c_labor = coefs.filter(pl.col('VARIABLE') == 'count_factor.SAME_LABOR_MARKET.1')['COEFF'][0]
-            c_micro = coefs.filter(pl.col('VARIABLE') == 'count_factor.MICRODEST20.1')['COEFF'][0]
-            c_metro = coefs.filter(pl.col('VARIABLE') == 'count_factor.METRODEST20.1')['COEFF'][0]
-
-            df = df.with_columns(np.exp(c_int +
-                                       (c_pi * np.log(pl.col('Pi') + 1)) +
-                                       (c_pj * np.log(pl.col('Pj') + 1)) +
-                                       (c_cij * np.log(pl.col('Cij') + pl.col('Pj') + 1)) +
-                                       (c_tij * np.log(pl.col('Tij') + 1)) +
-                                       (c_pj_star * np.log(pl.col('Pj_star') + 1)) +
-                                       (c_labor * pl.col('SAME_LABOR_MARKET')) +
-                                       (c_micro * pl.col('MICRO_DESTINATION20')) +
-                                       (c_metro * pl.col('METRO_DESTINATION20'))))
-            df = df.rename({'literal': 'COUNT_RESULT'})  #TODO: polars bug?
-
-            # this rounding step preserves >99% of the total migration just calculated
-            # df = df.with_columns(((1 - pl.col('ZERO_RESULT')) * pl.col('COUNT_RESULT')).round(0).cast(pl.Int32).alias('MIGRATION'))
-            df = df.with_columns(((1 - pl.col('ZERO_RESULT')) * pl.col('COUNT_RESULT')).alias('MIGRATION'))
-            df = df.select(['ORIGIN_FIPS', 'DESTINATION_FIPS', 'MIGRATION'])
-            df = df.with_columns(pl.lit(age_group).cast(pl.Enum(AGE_GROUPS)).alias('AGE_GROUP'))
-
-            df = df.collect()
-            assert df.shape[0] == 9781256
-
-            if gross_migration_flows is None:
-                gross_migration_flows = df.clone()
-            else:
-                gross_migration_flows = pl.concat(items=[gross_migration_flows, df])
+        for a, age_group in enumerate(AGE_GROUPS):
+            with self.tracer.phase('age_group', age_group=age_group, rows=self.distance.shape[0]):
+                print(f"\t\t{age_group}")
+
+                df = self.compute_spatial_variables(pi=age_pops[:, a][origin], pj=pj)
+
+                age_group_label = age_group
+                if age_group == '0-4':
+                    age_group_label = '5-9'
+
+                if age_group == '85+':
+                    age_group_label = '85-115'
+
+                coefs = self.coefs.filter((pl.col('RACE') == COEF_RACE_MAP[race]) & (pl.col('AGE_GROUP') == age_group_label))
+                assert coefs.shape == (18, 5)
+
+                # calculate the zero model first
+                z_int = coefs.filter(pl.col('VARIABLE') == 'zero_.Intercept.')['COEFF'][0]
+                z_pi = coefs.filter(pl.col('VARIABLE') == 'zero_ln_Pi')['COEFF'][0]
+                z_pj = coefs.filter(pl.col('VARIABLE') == 'zero_ln_Pj')['COEFF'][0]
+                z_cij = coefs.filter(pl.col('VARIABLE') == 'zero_ln_Cij')['COEFF'][0]
+                z_tij = coefs.filter(pl.col('VARIABLE') == 'zero_ln_Tij')['COEFF'][0]
+                z_pj_star = coefs.filter(pl.col('VARIABLE') == 'zero_ln_Pj_star')['COEFF'][0]
+
+                z_labor = coefs.filter(pl.col('VARIABLE') == 'zero_factor.SAME_LABOR_MARKET.1')['COEFF'][0]
+                z_micro = coefs.filter(pl.col('VARIABLE') == 'zero_factor.MICRODEST20.1')['COEFF'][0]
+                z_metro = coefs.filter(pl.col('VARIABLE') == 'zero_factor.METRODEST20.1')['COEFF'][0]
+
+                df = df.with_columns(1 - np.exp(-np.exp(z_int +
+                                                       (z_pi * np.log(pl.col('Pi') + 1)) +
+                                                       (z_pj * np.log(pl.col('Pj') + 1)) +
+                                                       (z_cij * np.log(pl.col('Cij') + pl.col('Pj') + 1)) +
+                                                       (z_tij * np.log(pl.col('Tij') + 1)) +
+                                                       (z_pj_star * np.log(pl.col('Pj_star') + 1)) +
+                                                       (z_labor * pl.col('SAME_LABOR_MARKET')) +
+                                                       (z_micro * pl.col('MICRO_DESTINATION20')) +
+                                                       (z_metro * pl.col('METRO_DESTINATION20')))))
+                df = df.rename({'literal': 'ZERO_RESULT'})
+
+                # calculate the count model
+                c_int = coefs.filter(pl.col('VARIABLE') == 'count_.Intercept.')['COEFF'][0]
+                c_pi = coefs.filter(pl.col('VARIABLE') == 'count_ln_Pi')['COEFF'][0]
+                c_pj = coefs.filter(pl.col('VARIABLE') == 'count_ln_Pj')['COEFF'][0]
+                c_cij = coefs.filter(pl.col('VARIABLE') == 'count_ln_Cij')['COEFF'][0]
+                c_tij = coefs.filter(pl.col('VARIABLE') == 'count_ln_Tij')['COEFF'][0]
+                c_pj_star = coefs.filter(pl.col('VARIABLE') == 'count_ln_Pj_star')['COEFF'][0]
+                c_labor = coefs.filter(pl.col('VARIABLE') == 'count_factor.SAME_LABOR_MARKET.1')['COEFF'][0]
+                c_micro = coefs.filter(pl.col('VARIABLE') == 'count_factor.MICRODEST20.1')['COEFF'][0]
+                c_metro = coefs.filter(pl.col('VARIABLE') == 'count_factor.METRODEST20.1')['COEFF'][0]
+
+                df = df.with_columns(np.exp(c_int +
+                                           (c_pi * np.log(pl.col('Pi') + 1)) +
+                                           (c_pj * np.log(pl.col('Pj') + 1)) +
+                                           (c_cij * np.log(pl.col('Cij') + pl.col('Pj') + 1)) +
+                                           (c_tij * np.log(pl.col('Tij') + 1)) +
+                                           (c_pj_star * np.log(pl.col('Pj_star') + 1)) +
+                                           (c_labor * pl.col('SAME_LABOR_MARKET')) +
+                                           (c_micro * pl.col('MICRO_DESTINATION20')) +
+                                           (c_metro * pl.col('METRO_DESTINATION20'))))
+                df = df.rename({'literal': 'COUNT_RESULT'})  #TODO: polars bug?
+
+                # this rounding step preserves >99% of the total migration just calculated
+                # df = df.with_columns(((1 - pl.col('ZERO_RESULT')) * pl.col('COUNT_RESULT')).round(0).cast(pl.Int32).alias('MIGRATION'))
+                df = df.with_columns(((1 - pl.col('ZERO_RESULT')) * pl.col('COUNT_RESULT')).alias('MIGRATION'))
+                df = df.select(['ORIGIN_FIPS', 'DESTINATION_FIPS', 'MIGRATION'])
+                df = df.with_columns(pl.lit(age_group).cast(pl.Enum(AGE_GROUPS)).alias('AGE_GROUP'))
+
+                df = df.collect()
+                assert df.shape[0] == self.distance.shape[0]
+
+                if gross_migration_flows is None:
+                    gross_migration_flows = df.clone()
+                else:
+                    gross_migration_flows = pl.concat(items=[gross_migration_flows, df])
 
         return gross_migration_flows
 
-    def compute_spatial_variables(self, age_pop, race_pop):
+    def compute_spatial_variables(self, pi, pj):
         '''
         Placeholder
         '''
-        # origin population
-        df = self.distance.join(other=age_pop,
-                                how='left',
-                                left_on='ORIGIN_FIPS',
-                                right_on='GEOID').lazy()
-        df = df.rename({'POPULATION': 'Pi'})
-
-        # destination population (i.e., same race population, all age groups)
-        df = df.join(other=race_pop.lazy(),
-                     how='left',
-                     left_on='DESTINATION_FIPS',
-                     right_on='GEOID').lazy()
-        df = df.rename({'POPULATION': 'Pj'})
+        # origin population (PI) and destination population (PJ, i.e., same
+        # race population, all age groups) of every pair
+        df = self.distance.with_columns(pl.Series('Pi', pi), pl.Series('Pj', pj)).lazy()
 
         # calculate total BEA population minus destination
         df = df.with_columns(pl.when(pl.col('SAME_LABOR_MARKET') == 1)
@@ -262,6 +366,14 @@ class migration_plum_v3():
                  FROM county_to_county_distance_2010'
         df = pl.read_database_uri(query=query, uri=uri)
 
+        # counties and labor market regions are coded before anything is
+        # joined (see iclus_v3_dimensions)
+        dimensions = DimensionRegistry(df.get_column('ORIGIN_FIPS').unique().to_list(),
+                                       self.intra_labor_market.get_column('BEA10').unique().to_list())
+        df = dimensions.encode(df)
+        self.intra_labor_market = dimensions.encode(self.intra_labor_market, strict=False).drop_nulls('COFIPS')
+        self.urban_counties = dimensions.encode(self.urban_counties, strict=False).drop_nulls('COFIPS')
+
         # label intra-labor market moves
         df = df.join(other=self.intra_labor_market,
                      how='left',
@@ -281,6 +393,7 @@ class migration_plum_v3():
                                .then(1)
                                .otherwise(0)
                                .alias('SAME_LABOR_MARKET'))
+        df = dimensions.encode(df)
         assert sum(df.null_count()).item() == 0
 
         # label destinations that overlap Census Urban Areas (not including
@@ -294,33 +407,162 @@ class migration_plum_v3():
         return df
 
     def get_urban_counties(self):
-        # Destination counties are identified as rural, micropolitan, or
-        # metropolitan using values 1, 2, and 3, respectively.
-        uri = f'sqlite:{MIGRATION_DB}'
-        query = 'SELECT COFIPS, URBANDESTINATION20 \
-                 FROM fips_to_urb20_bea10_hhs'
-        df = pl.read_database_uri(query=query, uri=uri)
+        return read_urban_counties()
 
-        df = df.with_columns(pl.lit(0).alias('MICRO_DESTINATION20'))
-        df = df.with_columns(pl.lit(0).alias('METRO_DESTINATION20'))
+    def get_intra_labor_market_moves(self):
+        return read_labor_markets()
 
-        df = df.with_columns(pl.when(pl.col('URBANDESTINATION20') == 2)
-                               .then(pl.lit(1))
-                               .alias('MICRO_DESTINATION20'))
-        df = df.with_columns(pl.col("MICRO_DESTINATION20").fill_null(strategy="zero"))
 
-        df = df.with_columns(pl.when(pl.col('URBANDESTINATION20') == 3)
-                               .then(pl.lit(1))
-                               .alias('METRO_DESTINATION20'))
-        df = df.with_columns(pl.col("METRO_DESTINATION20").fill_null(strategy="zero"))
-        df = df.drop('URBANDESTINATION20')
+def exclusive_cumsum(values, groups):
+    '''
+    Running totals of VALUES (one per county pair, on the last axis) within
+    each row of GROUPS (pair positions in sort order), not counting the pair
+    itself; returned in pair order
+    '''
+    grouped = values[..., groups]
+    shifted = np.zeros(grouped.shape)
+    shifted[..., 1:] = grouped[..., :-1]
 
-        return df
+    totals = np.empty(values.shape)
+    totals[..., groups] = np.cumsum(shifted, axis=-1)
 
-    def get_intra_labor_market_moves(self):
-        uri = f'sqlite:{MIGRATION_DB}'
-        query = 'SELECT COFIPS, BEA10 \
-                FROM fips_to_urb20_bea10_hhs'
-        df = pl.read_database_uri(query=query, uri=uri)
+    return totals
 
-        return df
+
+def coefficient_lookup(coefs):
+    '''
+    The model coefficients COEFS (in the format of migration_plum_v3.coefs)
+    as {(race, age group): {variable: coefficient}}, for the races and age
+    groups of the projections
+    '''
+    fitted = {}
+    for race, age_group, variable, coeff in coefs.select(['RACE', 'AGE_GROUP', 'VARIABLE', 'COEFF']).rows():
+        fitted.setdefault((race, age_group), {})[variable] = coeff
+
+    lookup = {}
+    for race, coef_race in COEF_RACE_MAP.items():
+        for age_group in AGE_GROUPS:
+            c = fitted[(coef_race, {'0-4': '5-9', '85+': '85-115'}.get(age_group, age_group))]
+            assert len(c) == 18
+            lookup[(race, age_group)] = c
+
+    return lookup
+
+
+def zinb_flows(c, ln_pi, ln_pj, ln_cij, ln_tij, ln_pj_star, same_labor_market, micro_destination, metro_destination):
+    '''
+    Expected migration of county pairs under the zero-inflated negative
+    binomial model with coefficients C ({variable: coefficient}), given the
+    logged spatial variables and the indicator variables of each pair
+    '''
+    zero = 1 - np.exp(-np.exp(c['zero_.Intercept.'] +
+                              (c['zero_ln_Pi'] * ln_pi) +
+                              (c['zero_ln_Pj'] * ln_pj) +
+                              (c['zero_ln_Cij'] * ln_cij) +
+                              (c['zero_ln_Tij'] * ln_tij) +
+                              (c['zero_ln_Pj_star'] * ln_pj_star) +
+                              (c['zero_factor.SAME_LABOR_MARKET.1'] * same_labor_market) +
+                              (c['zero_factor.MICRODEST20.1'] * micro_destination) +
+                              (c['zero_factor.METRODEST20.1'] * metro_destination)))
+
+    count = np.exp(c['count_.Intercept.'] +
+                   (c['count_ln_Pi'] * ln_pi) +
+                   (c['count_ln_Pj'] * ln_pj) +
+                   (c['count_ln_Cij'] * ln_cij) +
+                   (c['count_ln_Tij'] * ln_tij) +
+                   (c['count_ln_Pj_star'] * ln_pj_star) +
+                   (c['count_factor.SAME_LABOR_MARKET.1'] * same_labor_market) +
+                   (c['count_factor.MICRODEST20.1'] * micro_destination) +
+                   (c['count_factor.METRODEST20.1'] * metro_destination))
+
+    return (1 - zero) * count
+
+
+class dense_migration_plum_v3():
+    '''
+    migration_plum_v3 evaluated with NumPy on population arrays in the cell
+    order of LAYOUT (see iclus_v3_dense), with any number of leading axes
+    (e.g. ensemble members).
+
+    DISTANCE is a prepared distance table holding every ordered pair of the
+    layout's counties. Everything about the pairs that does not depend on the
+    population, including the nearest-first order of each county's
+    destinations and origins that the intervening opportunities and competing
+    migrants are summed in, is worked out once here, so a projection year
+    only gathers and sums arrays instead of joining and sorting the pair
+    table.
+    '''
+    def __init__(self, layout, distance):
+
+        self.layout = layout
+        n = len(layout.geoids)
+        assert distance.shape[0] == n * (n - 1)
+
+        self.origin = layout.dimensions.codes(distance, 'ORIGIN_FIPS').to_numpy()
+        self.destination = layout.dimensions.codes(distance, 'DESTINATION_FIPS').to_numpy()
+
+        self.dij = distance.get_column('Dij').cast(pl.Float64).to_numpy()
+        self.same_labor_market = distance.get_column('SAME_LABOR_MARKET').cast(pl.Float64).to_numpy()
+        self.micro_destination = distance.get_column('MICRO_DESTINATION20').cast(pl.Float64).to_numpy()
+        self.metro_destination = distance.get_column('METRO_DESTINATION20').cast(pl.Float64).to_numpy()
+
+        # row g holds the pairs leaving (arriving at) county g, nearest first
+        self.by_origin = np.lexsort((self.dij, self.origin)).reshape(n, n - 1)
+        self.by_destination = np.lexsort((self.dij, self.destination)).reshape(n, n - 1)
+        assert (self.origin[self.by_origin] == np.arange(n)[:, None]).all()
+        assert (self.destination[self.by_destination] == np.arange(n)[:, None]).all()
+
+    def flows(self, age_pop, race_pop, c):
+        '''
+        Gross migration of every county pair, given the population of one
+        age group (AGE_POP) and of every age group (RACE_POP) of a race by
+        county, and the model coefficients C ({variable: coefficient})
+        '''
+        ln_pi = np.log(age_pop + 1)[..., self.origin]
+        ln_pj = np.log(race_pop + 1)[..., self.destination]
+
+        pi = age_pop[..., self.origin]
+        pj = race_pop[..., self.destination]
+
+        # total same labor market population around each destination
+        pj_star = (pj * self.same_labor_market)[..., self.by_origin].sum(axis=-1)
+        ln_pj_star = np.log(pj_star + 1)[..., self.destination]
+
+        # distance-weighted intervening opportunities and competing migrants
+        ln_tij = np.log(exclusive_cumsum(pj / self.dij, self.by_origin) + 1)
+        ln_cij = np.log(exclusive_cumsum(pi, self.by_destination) + pj + 1)
+
+        return zinb_flows(c, ln_pi, ln_pj, ln_cij, ln_tij, ln_pj_star,
+                          self.same_labor_market, self.micro_destination, self.metro_destination)
+
+    def migrate(self, pop, coefs):
+        '''
+        Inflows and outflows of every cell of the population array POP, with
+        the model coefficients COEFS (in the format of migration_plum_v3.coefs).
+        Each county's gross flows are split between the sexes in proportion
+        to its population, as the projectors do.
+        '''
+        lookup = coefficient_lookup(coefs)
+
+        inflows = np.zeros(pop.shape)
+        outflows = np.zeros(pop.shape)
+        for r, race in enumerate(self.layout.races):
+            race_pop = pop[..., r, :, :].sum(axis=(-2, -1))
+
+            county_inflows = np.zeros(pop.shape[:-4] + (pop.shape[-4], pop.shape[-1]))
+            county_outflows = np.zeros(county_inflows.shape)
+            for a, age_group in enumerate(self.layout.age_groups):
+                c = lookup[(race, age_group)]
+
+                migration = self.flows(pop[..., r, :, a].sum(axis=-1), race_pop, c)
+                county_inflows[..., a] = migration[..., self.by_destination].sum(axis=-1)
+                county_outflows[..., a] = migration[..., self.by_origin].sum(axis=-1)
+
+            with np.errstate(invalid='ignore', divide='ignore'):
+                sex_fraction = pop[..., r, :, :] / pop[..., r, :, :].sum(axis=-2, keepdims=True)
+            sex_fraction[np.isnan(sex_fraction)] = 0
+
+            inflows[..., r, :, :] = sex_fraction * county_inflows[..., None, :]
+            outflows[..., r, :, :] = sex_fraction * county_outflows[..., None, :]
+
+        return inflows, outflows
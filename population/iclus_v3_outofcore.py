@@ -0,0 +1,643 @@
+'''
+Out-of-core Census projection, for geographies with more units than the
+population and its components can be held for in memory.
+
+The state of a run lives in a BlockStore: a directory of memory-mapped NumPy
+(.npy) column files. Everything with one row per geographic unit (the
+population, the unit rates and every component output) is partitioned into
+blocks of BLOCK_SIZE units, one folder per block; the county pair table of
+the migration model and the few columns with one value per unit and age
+group are in a shared folder. A projection year walks the blocks one at a
+time for everything that only involves a unit's own cohorts (deaths,
+immigration, the sex split of migration, births and aging), so only one
+block of cohorts is in memory at a time.
+
+Domestic migration couples every unit to every other one, but only through
+the population of each unit by race and age group. The model is evaluated
+from the pair columns at most PAIR_CHUNK pairs at a time, however many
+units there are; the intervening opportunities, competing migrants and
+flows of each race and age group go to scratch pair columns. The running
+totals along each unit's pairs are carried from one chunk to the next, so
+they add up in the same order as in dense_migration_plum_v3, and a run
+reproduces the dense engine (exactly, as long as a unit's pairs fit in one
+chunk). Besides one block and one chunk, a run holds one value per unit for
+a race or an age group at a time. The pair table grows with the square of
+the number of units, so at tract scale it is by far the largest part of
+the store.
+
+The store is prepared once from the inputs of a run (build_store()), which
+are read a block of units (or, for the pair table, a block of origins or
+destinations) at a time, so preparing a store is bounded by the block size
+as well. The inputs are the county inputs of the projectors; there is no
+sub-county input path yet, so a store for a finer geography needs its own
+tables in the same formats. Outputs are written to an output database,
+block by block, with OutOfCoreProjector.export().
+'''
+import json
+import os
+import time
+
+import numpy as np
+import polars as pl
+
+from numpy.lib.format import open_memmap
+
+from iclus_v3_census import OUTPUT_TABLES
+from iclus_v3_config import ANALYSIS_DB, OUTPUT_FOLDER, TIME_STAMP
+from iclus_v3_dense import (AGE_GROUPS, RACES, SEXES, CohortLayout, YearRates, deaths_and_immigration,
+                            migration_births_and_aging)
+from iclus_v3_dimensions import DimensionRegistry
+from iclus_v3_migration import (coefficient_lookup, read_coefficients, read_labor_markets,
+                                read_urban_counties, zinb_flows)
+from iclus_v3_output import OutputWriter
+from iclus_v3_projector import launch_geoids, set_launch_population
+from iclus_v3_rates import (CountyRates, YearCohortArray, acs_immigration_fractions, cdc_county_fertility,
+                            cdc_county_mortality, census_fertility_multipliers, census_mortality_multipliers,
+                            census_national_immigration)
+from iclus_v3_validation import Validator, county_totals
+
+
+OUTPUT_DATABASE = os.path.join(OUTPUT_FOLDER, f'iclus_v3_outofcore_{TIME_STAMP}.sqlite')
+STORE_FOLDER = os.path.join(OUTPUT_FOLDER, f'iclus_v3_outofcore_{TIME_STAMP}')
+
+BLOCK_SIZE = 256
+
+# most county pairs the migration model works on at once
+PAIR_CHUNK = 2 ** 20
+
+# component outputs kept for every projection year, by block
+OUTPUTS = ('deaths', 'immigration', 'inflows', 'outflows', 'births', 'population')
+
+# year x cohort tables shared by every block
+YEAR_TABLES = ('mortality_multipliers', 'fertility_multipliers', 'national_immigrants')
+
+
+def pair_pieces(n_rows, row_length, chunk):
+    '''
+    Pieces (first row, last row + 1, first column, last column + 1) of a
+    pair table with N_ROWS rows of ROW_LENGTH pairs, in order, with at most
+    CHUNK pairs each: whole rows where a row fits in a chunk, and parts of
+    one row where it does not. Either way a piece is a contiguous range of
+    the stored pairs.
+    '''
+    if row_length <= chunk:
+        rows = chunk // row_length
+        for start in range(0, n_rows, rows):
+            yield start, min(start + rows, n_rows), 0, row_length
+    else:
+        for row in range(n_rows):
+            for start in range(0, row_length, chunk):
+                yield row, row + 1, start, min(start + chunk, row_length)
+
+
+def carried_exclusive_cumsum(rows, carry):
+    '''
+    Running totals along each row of ROWS, not counting the value itself,
+    continuing from the totals CARRY of the earlier parts of the rows; the
+    sums run in the same order as exclusive_cumsum() over the whole rows
+    '''
+    shifted = np.empty(rows.shape)
+    shifted[:, 0] = carry
+    shifted[:, 1:] = rows[:, :-1]
+
+    return np.cumsum(shifted, axis=-1)
+
+
+class Units():
+    '''
+    The labels and cohort shape of every unit of a store; stands in for a
+    CohortLayout where only those are needed, without its key frame
+    '''
+    def __init__(self, geoids):
+
+        self.geoids = tuple(geoids)
+        self.shape = (len(self.geoids), len(RACES), len(SEXES), len(AGE_GROUPS))
+        self.size = int(np.prod(self.shape))
+
+
+class BlockStore():
+    '''
+    The memory-mapped column files of an out-of-core run in DIRECTORY. The
+    store's description (its units, blocks and scenario, and the years
+    projected so far) is read from store.json, or written there if META is
+    given.
+    '''
+    def __init__(self, directory, meta=None):
+
+        self.directory = directory
+        if meta is not None:
+            os.makedirs(directory, exist_ok=True)
+            self.meta = meta
+            self.save_meta()
+        with open(os.path.join(directory, 'store.json')) as f:
+            self.meta = json.load(f)
+
+        self.geoids = tuple(self.meta['geoids'])
+        self.blocks = [tuple(block) for block in self.meta['blocks']]
+        self.scenario = self.meta['scenario']
+        self.census_imm_hist2324 = self.meta['census_imm_hist2324']
+        self.first_years = self.meta['first_years']
+
+    def save_meta(self):
+        # replaced whole, so an interrupted write never leaves a partial file
+        path = os.path.join(self.directory, 'store.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(path + '.tmp', path)
+
+    @property
+    def projected_years(self):
+        '''
+        The first and last year whose outputs are in the store, or None if
+        nothing has been projected yet
+        '''
+        years = self.meta.get('projected_years')
+        return None if years is None else tuple(years)
+
+    @projected_years.setter
+    def projected_years(self, years):
+        self.meta['projected_years'] = None if years is None else list(years)
+        self.save_meta()
+
+    def path(self, name, block=None):
+        folder = 'shared' if block is None else f'block_{block:04d}'
+
+        return os.path.join(self.directory, folder, f'{name}.npy')
+
+    def column(self, name, block=None, mode='r+'):
+        '''
+        Memory-map an existing column of one block (or a shared column)
+        '''
+        return np.load(self.path(name, block), mmap_mode=mode)
+
+    def create(self, name, shape, block=None, dtype=np.float64):
+        '''
+        Create (or overwrite) a memory-mapped column of SHAPE
+        '''
+        path = self.path(name, block)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        return open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+    def write(self, name, values, block=None):
+        column = self.create(name, values.shape, block, values.dtype)
+        column[...] = values
+        column.flush()
+
+    def year_table(self, name):
+        return YearCohortArray.from_values(self.first_years[name], self.column(name, mode='r'))
+
+    def block_layout(self, block):
+        start, stop = self.blocks[block]
+
+        return CohortLayout(self.geoids[start:stop])
+
+
+def build_store(directory, scenario='hi', census_imm_hist2324=False, block_size=BLOCK_SIZE):
+    '''
+    Prepare a BlockStore in DIRECTORY for Census runs of SCENARIO: the launch
+    population and unit rates of every block, the shared year tables, and
+    the county pair table and coefficients of the migration model. The
+    inputs are read one block of units at a time, so preparing a store holds
+    no more than a block of cohorts, a block of pairs and one value per unit
+    in memory.
+    '''
+    geoids = launch_geoids()
+    n = len(geoids)
+    year_tables = dict(zip(YEAR_TABLES, (census_mortality_multipliers(),
+                                         census_fertility_multipliers(),
+                                         census_national_immigration(scenario, census_imm_hist2324))))
+
+    blocks = [(start, min(start + block_size, n)) for start in range(0, n, block_size)]
+    store = BlockStore(directory, {'geoids': list(geoids),
+                                   'blocks': blocks,
+                                   'scenario': scenario,
+                                   'census_imm_hist2324': census_imm_hist2324,
+                                   'first_years': {name: int(table.first_year) for name, table in year_tables.items()}})
+
+    print("Writing the blocks...", end='')
+    for b, (start, stop) in enumerate(blocks):
+        layout = store.block_layout(b)
+        launch_pop = set_launch_population((geoids[start], geoids[stop - 1]))
+        store.write('launch_population', layout.to_array(launch_pop, 'POPULATION', complete=True), b)
+        store.write('mortality', cdc_county_mortality(layout), b)
+        store.write('fertility', cdc_county_fertility(layout), b)
+        store.write('immigration_fractions', acs_immigration_fractions(layout), b)
+    for name, table in year_tables.items():
+        store.write(name, table.values)
+    print("finished!")
+
+    print("Writing the county pair table...", end='')
+    write_pairs(store)
+    read_coefficients().write_ipc(os.path.join(directory, 'shared', 'coefficients.arrow'))
+    print("finished!")
+
+    return store
+
+
+def unit_attributes(geoids):
+    '''
+    The labor market region (as an integer code) and the micropolitan and
+    metropolitan destination flags of every unit of GEOIDS, in order
+    '''
+    units = pl.DataFrame({'COFIPS': list(geoids)})
+    df = (units.join(read_labor_markets(), on='COFIPS', how='left')
+               .join(read_urban_counties(), on='COFIPS', how='left'))
+    assert df.shape[0] == len(geoids)
+    assert sum(df.null_count()).item() == 0
+
+    _, labor_market = np.unique(df.get_column('BEA10').to_numpy(), return_inverse=True)
+
+    return (labor_market,
+            df.get_column('MICRO_DESTINATION20').cast(pl.Float64).to_numpy(),
+            df.get_column('METRO_DESTINATION20').cast(pl.Float64).to_numpy())
+
+
+def block_pairs(store, block, by):
+    '''
+    The county pairs whose origin (BY='ORIGIN_FIPS') or destination (BY=
+    'DESTINATION_FIPS') is in one block of STORE, as unit codes and
+    distances, nearest first for each unit. Ties keep the order of the
+    distance table, as in dense_migration_plum_v3.
+    '''
+    start, stop = store.blocks[block]
+    n = len(store.geoids)
+
+    uri = f'sqlite:{ANALYSIS_DB}'
+    query = f"SELECT ORIGIN_FIPS, DESTINATION_FIPS, Dij \
+              FROM county_to_county_distance_2010 \
+              WHERE {by} BETWEEN '{store.geoids[start]}' AND '{store.geoids[stop - 1]}' \
+              ORDER BY {by}, Dij, rowid"
+    df = pl.read_database_uri(query=query, uri=uri)
+    assert df.shape[0] == (stop - start) * (n - 1)
+
+    dimensions = DimensionRegistry(store.geoids)
+    origin = dimensions.codes(df, 'ORIGIN_FIPS')
+    destination = dimensions.codes(df, 'DESTINATION_FIPS')
+    assert origin.null_count() == 0 and destination.null_count() == 0
+
+    return (origin.cast(pl.Int64).to_numpy(),
+            destination.cast(pl.Int64).to_numpy(),
+            df.get_column('Dij').cast(pl.Float64).to_numpy())
+
+
+def write_pairs(store):
+    '''
+    Write the county pair columns of the migration model to STORE, one
+    block of units at a time. The pairs are stored by origin, nearest
+    destination first; for each destination, PAIR_BY_DESTINATION lists the
+    stored positions of its pairs, nearest origin first. The position of
+    every (origin, destination) goes to a scratch column on the way.
+    '''
+    n = len(store.geoids)
+    pairs = n * (n - 1)
+    labor_market, micro_destination, metro_destination = unit_attributes(store.geoids)
+
+    destinations = store.create('pair_destination', (pairs,), dtype=np.int64)
+    dij = store.create('pair_dij', (pairs,))
+    same_labor_market = store.create('pair_same_labor_market', (pairs,))
+    micro = store.create('pair_micro_destination', (pairs,))
+    metro = store.create('pair_metro_destination', (pairs,))
+    position = store.create('pair_position', (n * n,), dtype=np.int64)
+
+    for b, (start, stop) in enumerate(store.blocks):
+        origin, destination, distance = block_pairs(store, b, 'ORIGIN_FIPS')
+        assert (origin == np.repeat(np.arange(start, stop), n - 1)).all()
+
+        span = slice(start * (n - 1), stop * (n - 1))
+        destinations[span] = destination
+        dij[span] = distance
+        same_labor_market[span] = labor_market[origin] == labor_market[destination]
+        micro[span] = micro_destination[destination]
+        metro[span] = metro_destination[destination]
+        position[origin * n + destination] = np.arange(span.start, span.stop)
+
+    by_destination = store.create('pair_by_destination', (pairs,), dtype=np.int64)
+    for b, (start, stop) in enumerate(store.blocks):
+        origin, destination, _ = block_pairs(store, b, 'DESTINATION_FIPS')
+        assert (destination == np.repeat(np.arange(start, stop), n - 1)).all()
+
+        by_destination[start * (n - 1):stop * (n - 1)] = position[origin * n + destination]
+
+    for column in (destinations, dij, same_labor_market, micro, metro, by_destination):
+        column.flush()
+    del position
+    os.remove(store.path('pair_position'))
+
+
+class BlockRates(CountyRates):
+    '''
+    The unit rates of one block of STORE, memory-mapped, with the year x
+    cohort MULTIPLIERS (mortality, fertility) that every block shares
+    '''
+    def __init__(self, store, block, multipliers):
+
+        super().__init__(store.column('mortality', block, mode='r'),
+                         store.column('fertility', block, mode='r'),
+                         store.column('immigration_fractions', block, mode='r'),
+                         *multipliers)
+
+
+class BlockedMigrationModel():
+    '''
+    dense_migration_plum_v3 evaluated from the pair columns of STORE, at
+    most PAIR_CHUNK pairs at a time (see pair_pieces()), with the model
+    coefficients COEFS. The origin of a stored pair is its position // (n - 1).
+    '''
+    def __init__(self, store, coefs):
+
+        self.store = store
+        self.n = len(store.geoids)
+        self.lookup = coefficient_lookup(coefs)
+
+        # the pieces of the pair table (by origin, or by destination) that
+        # are worked on at once
+        self.pieces = list(pair_pieces(self.n, self.n - 1, PAIR_CHUNK))
+
+        self.destination = store.column('pair_destination', mode='r')
+        self.dij = store.column('pair_dij', mode='r')
+        self.same_labor_market = store.column('pair_same_labor_market', mode='r')
+        self.micro_destination = store.column('pair_micro_destination', mode='r')
+        self.metro_destination = store.column('pair_metro_destination', mode='r')
+        self.by_destination = store.column('pair_by_destination', mode='r')
+
+        # scratch pair columns, rewritten for every race and age group
+        pairs = self.n * (self.n - 1)
+        self.tij = store.create('pair_tij', (pairs,))
+        self.cij = store.create('pair_cij', (pairs,))
+        self.flows = store.create('pair_flows', (pairs,))
+
+        # unit x race x age group gross flows
+        self.inflows = store.create('unit_inflows', (self.n, len(RACES), len(AGE_GROUPS)))
+        self.outflows = store.create('unit_outflows', (self.n, len(RACES), len(AGE_GROUPS)))
+
+    def piece(self, column, piece):
+        '''
+        One piece of a pair column, with a row per unit of the piece
+        '''
+        first_row, stop_row, first, stop = piece
+        n = self.n
+
+        return np.asarray(column[first_row * (n - 1) + first:(stop_row - 1) * (n - 1) + stop]).reshape(stop_row - first_row, stop - first)
+
+    def span(self, piece):
+        '''
+        The positions of a piece in the stored pairs
+        '''
+        first_row, stop_row, first, stop = piece
+
+        return slice(first_row * (self.n - 1) + first, (stop_row - 1) * (self.n - 1) + stop)
+
+    def migrate(self, age_pop, race_pop):
+        '''
+        Gross inflows and outflows of every unit by race and age group, given
+        the population of every unit by race and age group (AGE_POP) and by
+        race (RACE_POP)
+        '''
+        n = self.n
+        for r, race in enumerate(RACES):
+            pj = np.array(race_pop[:, r])
+            ln_pj = np.log(pj + 1)
+
+            # total same labor market population around each destination,
+            # and the distance-weighted intervening opportunities
+            pj_star = np.zeros(n)
+            carry = np.zeros(n)
+            for piece in self.pieces:
+                first_row, stop_row, _, _ = piece
+                pj_destination = pj[self.piece(self.destination, piece)]
+                pj_star[first_row:stop_row] += (pj_destination * self.piece(self.same_labor_market, piece)).sum(axis=-1)
+
+                opportunities = pj_destination / self.piece(self.dij, piece)
+                tij = carried_exclusive_cumsum(opportunities, carry[first_row:stop_row])
+                self.tij[self.span(piece)] = tij.ravel()
+                carry[first_row:stop_row] = tij[:, -1] + opportunities[:, -1]
+            ln_pj_star = np.log(pj_star + 1)
+
+            for a, age_group in enumerate(AGE_GROUPS):
+                print(f"\t\t{race} {age_group}")
+                pi = np.array(age_pop[:, r, a])
+                c = self.lookup[(race, age_group)]
+
+                # competing migrants, by destination
+                carry[:] = 0
+                for piece in self.pieces:
+                    first_row, stop_row, _, _ = piece
+                    pairs = self.piece(self.by_destination, piece)
+                    competing = pi[pairs // (n - 1)]
+                    cij = carried_exclusive_cumsum(competing, carry[first_row:stop_row])
+                    self.cij[pairs] = cij
+                    carry[first_row:stop_row] = cij[:, -1] + competing[:, -1]
+
+                # flows, by origin
+                outflows = np.zeros(n)
+                for piece in self.pieces:
+                    first_row, stop_row, _, _ = piece
+                    destination = self.piece(self.destination, piece)
+                    migration = zinb_flows(c,
+                                           np.log(pi[first_row:stop_row] + 1)[:, None],
+                                           ln_pj[destination],
+                                           np.log(self.piece(self.cij, piece) + pj[destination] + 1),
+                                           np.log(self.piece(self.tij, piece) + 1),
+                                           ln_pj_star[destination],
+                                           self.piece(self.same_labor_market, piece),
+                                           self.piece(self.micro_destination, piece),
+                                           self.piece(self.metro_destination, piece))
+                    self.flows[self.span(piece)] = migration.ravel()
+                    outflows[first_row:stop_row] += migration.sum(axis=-1)
+                self.outflows[:, r, a] = outflows
+
+                # inflows, by destination
+                inflows = np.zeros(n)
+                for piece in self.pieces:
+                    first_row, stop_row, _, _ = piece
+                    inflows[first_row:stop_row] += self.flows[self.piece(self.by_destination, piece)].sum(axis=-1)
+                self.inflows[:, r, a] = inflows
+
+        return self.inflows, self.outflows
+
+
+class OutOfCoreProjector():
+    '''
+    Projects the Census run prepared in the BlockStore in STORE_DIRECTORY
+    (see build_store()), adjusting the CDC fertility and mortality rates by
+    CDC_FERT_ADJ and CDC_MORT_ADJ, with the component order of the 'dense'
+    engine. VALIDATION and VALIDATION_SAMPLE are as for the Projector.
+    '''
+    def __init__(self, store_directory, cdc_fert_adj=0.0, cdc_mort_adj=0.0, validation='cheap', validation_sample=None):
+
+        self.launch_year = 2020
+        self.current_projection_year = self.launch_year + 1
+
+        self.store = BlockStore(store_directory)
+        self.scenario = self.store.scenario
+        self.cdc_fert_adj = cdc_fert_adj
+        self.cdc_mort_adj = cdc_mort_adj
+
+        self.units = Units(self.store.geoids)
+        self.validator = Validator(self.units, validation, validation_sample)
+
+    def run(self, final_projection_year=2099):
+        '''
+        Project every year through FINAL_PROJECTION_YEAR from the launch
+        population in the store
+        '''
+        store = self.store
+        n = len(self.units.geoids)
+        _, n_races, n_sexes, n_ages = self.units.shape
+
+        multipliers = (store.year_table('mortality_multipliers'), store.year_table('fertility_multipliers'))
+        national_immigrants = store.year_table('national_immigrants')
+        rates = [BlockRates(store, b, multipliers) for b in range(len(store.blocks))]
+
+        # the outputs of an earlier run are overwritten below; the county
+        # totals of the population at the start of each year are kept for
+        # the validator
+        store.projected_years = None
+        years = final_projection_year - self.launch_year
+        population_totals = np.zeros(n)
+        for b, (start, stop) in enumerate(store.blocks):
+            for name in OUTPUTS:
+                shape = (years, stop - start, n_races, n_sexes) + (() if name == 'births' else (n_ages,))
+                store.create(name, shape, b)
+            launch_population = store.column('launch_population', b, mode='r')
+            store.write('current_population', launch_population, b)
+            population_totals[start:stop] = county_totals(launch_population)
+
+        # population of every unit by race and age group, and by race, that
+        # migration is computed from
+        age_pop = store.create('migration_age_population', (n, n_races, n_ages))
+        race_pop = store.create('migration_race_population', (n, n_races))
+        migration_model = BlockedMigrationModel(store, pl.read_ipc(os.path.join(store.directory, 'shared', 'coefficients.arrow')))
+
+        while self.current_projection_year <= final_projection_year:
+            year = self.current_projection_year
+            t = year - self.launch_year - 1
+            print(f"###  {year}  ###")
+            print(f"{time.ctime()}")
+
+            # each block is balanced in its rows of the year's balance
+            self.validator.start(year, population_totals)
+
+            ############################
+            ## DEATHS AND IMMIGRATION ##
+            ############################
+
+            print("Calculating mortality and net immigration...", end='')
+            for b, (start, stop) in enumerate(store.blocks):
+                population = store.column('current_population', b)
+                pop = np.array(population)
+
+                block_rates = YearRates(mortality_rates=rates[b].mortality_rates(year - 1, self.cdc_mort_adj))
+                immigrants = rates[b].county_immigration(national_immigrants[year])
+                deaths = deaths_and_immigration(pop, block_rates, immigrants, self.validator.block(start, stop))
+
+                store.column('deaths', b)[t] = deaths
+                store.column('immigration', b)[t] = immigrants
+
+                population[...] = pop
+                age_pop[start:stop] = pop.sum(axis=-2)
+                race_pop[start:stop] = pop.sum(axis=(-2, -1))
+            print("finished!")
+
+            ###############
+            ## MIGRATION ##
+            ###############
+
+            print("Calculating domestic migration...")
+            inflows, outflows = migration_model.migrate(age_pop, race_pop)
+
+            ######################
+            ## BIRTHS AND AGING ##
+            ######################
+
+            print("Calculating fertility...", end='')
+            for b, (start, stop) in enumerate(store.blocks):
+                population = store.column('current_population', b)
+                pop = np.array(population)
+
+                # each unit's gross flows are split between the sexes in
+                # proportion to its population
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    sex_fraction = pop / pop.sum(axis=-2, keepdims=True)
+                sex_fraction[np.isnan(sex_fraction)] = 0
+                block_inflows = sex_fraction * np.asarray(inflows[start:stop])[:, :, None, :]
+                block_outflows = sex_fraction * np.asarray(outflows[start:stop])[:, :, None, :]
+
+                block_rates = YearRates(fertility_rates=rates[b].fertility_rates(year - 1, self.cdc_fert_adj))
+                births = migration_births_and_aging(pop, block_inflows - block_outflows, block_rates,
+                                                    self.validator.block(start, stop))
+
+                store.column('inflows', b)[t] = block_inflows
+                store.column('outflows', b)[t] = block_outflows
+                store.column('births', b)[t] = births
+                store.column('population', b)[t] = pop
+                population_totals[start:stop] = county_totals(pop)
+
+                population[...] = pop
+            print("finished!")
+
+            self.validator.balance(population_totals)
+
+            print(f"Total population (end): {round(population_totals.sum()):,}\n")
+            store.projected_years = (self.launch_year + 1, year)
+            self.current_projection_year += 1
+
+    def export(self, output_database):
+        '''
+        Write the outputs of every projected year to the long and wide
+        tables of OUTPUT_DATABASE, one block at a time. The projected years
+        are read from the store, so a store projected by an earlier process
+        can be exported.
+        '''
+        assert self.store.projected_years is not None, 'Nothing has been projected in this store'
+        first_year, last_year = self.store.projected_years
+        writer = OutputWriter(output_database, self.scenario, OUTPUT_TABLES)
+
+        for b in range(len(self.store.blocks)):
+            print(f"Exporting block {b + 1} of {len(self.store.blocks)}...", end='')
+            layout = self.store.block_layout(b)
+            outputs = {name: self.store.column(name, b, mode='r') for name in OUTPUTS}
+
+            for t, year in enumerate(range(first_year, last_year + 1)):
+                writer.append('deaths', layout.to_frame(outputs['deaths'][t], 'DEATHS'), year)
+                writer.append('immigration', layout.to_frame(outputs['immigration'][t], 'NET_IMMIGRATION'), year)
+
+                inflows, outflows = outputs['inflows'][t], outputs['outflows'][t]
+                migration = layout.to_frame(inflows, 'INFLOWS').with_columns(pl.Series(name='OUTFLOWS', values=outflows.flatten()),
+                                                                            pl.Series(name='NET_MIGRATION', values=(inflows - outflows).flatten()))
+                writer.append('migration', migration, year)
+
+                full_births = np.zeros(layout.shape)
+                full_births[..., 0] = outputs['births'][t]
+                writer.append('births', (layout.to_frame(full_births, 'BIRTHS')
+                                         .filter(pl.col('AGE_GROUP') == '0-4')
+                                         .select(['GEOID', 'RACE', 'SEX', 'BIRTHS', 'AGE_GROUP'])), year)
+
+                writer.append('population', (layout.to_frame(outputs['population'][t], 'POPULATION')
+                                             .with_columns(pl.col('POPULATION').cast(pl.UInt64))), year)
+            print("finished!")
+
+        writer.finalize()
+
+
+def main(scenario, cdc_fert_adj, cdc_mort_adj, census_imm_hist2324, block_size=BLOCK_SIZE,
+         final_projection_year=2099, store_directory=None, output_database=None):
+    '''
+    Prepare a store, project it and export the outputs
+    '''
+    store_directory = STORE_FOLDER if store_directory is None else store_directory
+    build_store(store_directory, scenario, census_imm_hist2324, block_size)
+
+    model = OutOfCoreProjector(store_directory, cdc_fert_adj, cdc_mort_adj)
+    model.run(final_projection_year)
+    model.export(OUTPUT_DATABASE if output_database is None else output_database)
+
+
+if __name__ == '__main__':
+    print(time.ctime())
+    main(scenario='hi',
+         cdc_fert_adj=-0.055,
+         cdc_mort_adj=-0.15,
+         census_imm_hist2324=False)
+    print(time.ctime())
@@ -0,0 +1,230 @@
+'''
+Append-only output writer for the ICLUS v3 projectors.
+
+Each projection year appends only that year's rows to a long-format table
+(one row per cohort and YEAR). The wide tables with one column per year,
+which is the layout the rest of the ICLUS scripts read, are built once at the
+end of the run inside SQLite. A BackgroundWriter moves the writes onto their
+own thread, so that one year is written while the next one is projected.
+'''
+import os
+import queue
+import sqlite3
+import threading
+
+import polars as pl
+
+from iclus_v3_dense import AGE_GROUPS
+from iclus_v3_dimensions import decode
+from iclus_v3_trace import Tracer
+
+
+KEYS = ('GEOID', 'RACE', 'SEX', 'AGE_GROUP')
+
+
+class OutputWriter():
+    '''
+    TABLES maps an output name (e.g. 'deaths') to the value columns that are
+    written each year and the wide-table column name template for each one,
+    e.g. {'deaths': {'DEATHS': '{year}'}}. Writes are timed by TRACER, if
+    one is given.
+    '''
+    def __init__(self, database, scenario, tables, tracer=None):
+
+        self.database = database
+        self.uri = f'sqlite:{database}'
+        self.scenario = scenario
+        self.tables = tables
+        self.tracer = Tracer() if tracer is None else tracer
+
+        # outputs that already have a long table in this run
+        self.started = set()
+
+    def long_table(self, name):
+        return f'{name}_by_race_sex_age_{self.scenario}_long'
+
+    def wide_table(self, name):
+        return f'{name}_by_race_sex_age_{self.scenario}'
+
+    def append(self, name, df, year):
+        '''
+        Append one projection year of an output to its long table
+        '''
+        with self.tracer.phase('write', year, rows=df.shape[0], output=name):
+            assert sum(df.null_count()).item() == 0
+
+            df = decode(df.select([pl.lit(year).alias('YEAR')] + list(KEYS) + list(self.tables[name])))
+
+            # the first write of a run replaces anything left over in the database
+            if_table_exists = 'append' if name in self.started else 'replace'
+            df.write_database(table_name=self.long_table(name),
+                              connection=self.uri,
+                              if_table_exists=if_table_exists,
+                              engine='adbc')
+
+            self.started.add(name)
+
+    def resume(self, year):
+        '''
+        Continue a run that was checkpointed at the end of YEAR: rows for
+        later years (from an interrupted year) are removed, and the existing
+        long tables are appended to rather than replaced
+        '''
+        con = sqlite3.connect(self.database)
+        existing = {row[0] for row in con.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for name in self.tables:
+            if self.long_table(name) in existing:
+                con.execute(f'DELETE FROM {self.long_table(name)} WHERE YEAR > {year}')
+                self.started.add(name)
+        con.commit()
+        con.close()
+
+    def fork(self, database, scenario):
+        '''
+        Copy everything written so far into the long tables of SCENARIO in
+        another output DATABASE, for a run that branches off of this one and
+        continues from there
+        '''
+        con = sqlite3.connect(database)
+        con.execute('ATTACH DATABASE ? AS parent', (self.database,))
+        for name in self.started:
+            table = f'{name}_by_race_sex_age_{scenario}_long'
+            con.execute(f'DROP TABLE IF EXISTS main.{table}')
+            con.execute(f'CREATE TABLE main.{table} AS SELECT * FROM parent.{self.long_table(name)}')
+        con.commit()
+        con.close()
+
+    def read(self, name):
+        '''
+        Read back everything written so far for one output, in long format
+        '''
+        query = f'SELECT * FROM {self.long_table(name)}'
+        df = pl.read_database_uri(query=query, uri=self.uri)
+        df = df.with_columns(pl.col('AGE_GROUP').cast(pl.Enum(AGE_GROUPS)))
+
+        return df
+
+    def finalize(self):
+        '''
+        Build the wide (one column per year) tables from the long tables
+        '''
+        print("Building wide output tables...", end='')
+
+        age_group_order = ' '.join(f"WHEN '{age_group}' THEN {i}" for i, age_group in enumerate(AGE_GROUPS))
+        keys = ', '.join(KEYS)
+
+        con = sqlite3.connect(self.database)
+        for name in self.started:
+            long_table = self.long_table(name)
+            wide_table = self.wide_table(name)
+
+            years = [row[0] for row in con.execute(f'SELECT DISTINCT YEAR FROM {long_table} ORDER BY YEAR')]
+
+            columns = []
+            for year in years:
+                for value, template in self.tables[name].items():
+                    columns.append(f'MAX(CASE WHEN YEAR = {year} THEN {value} END) AS "{template.format(year=year)}"')
+            columns = ', '.join(columns)
+
+            con.execute(f'DROP TABLE IF EXISTS {wide_table}')
+            con.execute(f'CREATE TABLE {wide_table} AS \
+                          SELECT {keys}, {columns} \
+                          FROM {long_table} \
+                          GROUP BY {keys} \
+                          ORDER BY GEOID, RACE, SEX, CASE AGE_GROUP {age_group_order} END')
+            con.commit()
+        con.close()
+
+        print("finished!")
+
+
+class BackgroundWriter():
+    '''
+    Runs the writes of an OutputWriter, in order, on a dedicated thread. At
+    most MAX_PENDING writes wait in the queue; past that, a new write blocks
+    until the writer thread has caught up. An error in the writer thread is
+    raised in the projection loop by the next write or flush(), and the
+    writes queued after it are dropped.
+    '''
+    def __init__(self, writer, max_pending=8):
+
+        self.writer = writer
+        self.tracer = writer.tracer
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+
+        self.thread = threading.Thread(target=self.work, name='iclus_v3_output', daemon=True)
+        self.thread.start()
+
+    def work(self):
+        while True:
+            task = self.queue.get()
+            try:
+                if task is None:
+                    return
+                if self.error is None:
+                    func, args = task
+                    func(*args)
+            except BaseException as error:
+                self.error = error
+            finally:
+                self.queue.task_done()
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    def call(self, func, *args):
+        '''
+        Run FUNC(*ARGS) on the writer thread once every write queued before
+        it is done, e.g. to write a checkpoint only after its year's outputs
+        '''
+        self.check()
+        if self.queue.full():
+            with self.tracer.phase('write_wait', pending=self.queue.qsize()):
+                self.queue.put((func, args))
+        else:
+            self.queue.put((func, args))
+
+    def append(self, name, df, year):
+        '''
+        Queue one projection year of an output for its long table
+        '''
+        self.call(self.writer.append, name, df, year)
+
+    def flush(self):
+        '''
+        Wait for every queued write
+        '''
+        self.queue.join()
+        self.check()
+
+    def resume(self, year):
+        self.flush()
+        self.writer.resume(year)
+
+    def read(self, name):
+        self.flush()
+        return self.writer.read(name)
+
+    def fork(self, database, scenario):
+        self.flush()
+        self.writer.fork(database, scenario)
+
+    def finalize(self):
+        '''
+        Finish the queued writes, build the wide tables and make sure the
+        database has reached the disk; the writer thread is then stopped
+        '''
+        self.flush()
+        self.writer.finalize()
+
+        with open(self.writer.database, 'rb+') as f:
+            os.fsync(f.fileno())
+
+        self.close()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
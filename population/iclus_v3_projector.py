@@ -0,0 +1,1134 @@
+"""
+Author:  Phil Morefield
+Purpose: Projection core shared by the ICLUS v3 county-level population
+         projections (Census NP2023, Wittgenstein v3); the product lines only
+         differ in the RateProvider they run with
+Created: April 26th, 2025
+"""
+import os
+import time
+
+import numpy as np
+import polars as pl
+
+from iclus_v3_checkpoint import clear_checkpoints, latest_checkpoint, write_checkpoint
+from iclus_v3_config import POP_DB
+from iclus_v3_dense import (AGE_GROUP_YEARS, CohortLayout, CohortSeries, FERTILITY_AGE_GROUPS, YearRates,
+                            advance_cohorts_by, births_by_sex, deaths_and_immigration, migration_births_and_aging,
+                            step_survival)
+from iclus_v3_dimensions import AGE_GROUPS
+from iclus_v3_leslie import LeslieOperator
+from iclus_v3_migration import (PopulationView, dense_migration_plum_v3 as DenseMigrationModel,
+                                migration_plum_v3 as MigrationModel, read_distance)
+from iclus_v3_output import BackgroundWriter, OutputWriter
+from iclus_v3_region import boundary_flows, read_boundary_flows, region_geoids, restrict_distance, with_boundary_flows
+from iclus_v3_schedule import Scheduler
+from iclus_v3_trace import Tracer
+from iclus_v3_validation import Validator
+
+
+# the order the races are migrated in, and their flows combined in
+MIGRATION_RACES = ('WHITE', 'BLACK', 'ASIAN', 'AIAN', 'NHPI', 'TWO_OR_MORE')
+
+
+def launch_geoids():
+    '''
+    Every GEOID of the launch population, in order
+    '''
+    uri = f'sqlite:{POP_DB}'
+    query = 'SELECT DISTINCT GEOID FROM county_population_ageracesex_2020 ORDER BY GEOID'
+
+    return tuple(pl.read_database_uri(query=query, uri=uri).get_column('GEOID').to_list())
+
+
+def set_launch_population(geoids=None):
+    '''
+    2020 launch population is taken from Census 2020-2023 Intercensal Population
+    Estimates. GEOIDS optionally limits it to the range (first GEOID, last
+    GEOID).
+    '''
+    uri = f'sqlite:{POP_DB}'
+    query = 'SELECT * FROM county_population_ageracesex_2020'
+    if geoids is not None:
+        query += f" WHERE GEOID BETWEEN '{geoids[0]}' AND '{geoids[1]}'"
+    df = pl.read_database_uri(query=query, uri=uri)
+
+    df = df.with_columns(pl.col('AGE_GROUP').cast(pl.Enum(AGE_GROUPS)))
+    df = df.sort(['GEOID', 'RACE', 'AGE_GROUP', 'SEX'])
+
+    #assert df.shape[0] == 675648
+    return df
+
+
+class Projector():
+    '''
+    Projects the county population from the 2020 launch population with the
+    rates of RATE_PROVIDER (an iclus_v3_rates.RateProvider, e.g. the Census
+    NP2023 or Wittgenstein v3 projections), adjusting the CDC fertility and
+    mortality rates by CDC_FERT_ADJ and CDC_MORT_ADJ. Results go to
+    OUTPUT_DATABASE.
+    '''
+    def __init__(self, rate_provider, output_database, cdc_fert_adj=0.0, cdc_mort_adj=0.0, engine='frame',
+                 migration_inputs=None, resume_from=None, workers=1, validation='cheap',
+                 validation_sample=None, region=None, boundary_inputs=None):
+
+        # time-related attributes
+        self.launch_year = 2020
+        self.current_projection_year = self.launch_year + 1
+
+        # scenario-related attributes; the rate provider is asked for its
+        # input rate tables once the population layout is known
+        self.rate_provider = rate_provider
+        self.scenario = rate_provider.scenario
+
+        # engine-related attributes; 'frame' keeps the population in a polars
+        # DataFrame, 'dense' keeps it in a county x race x sex x age array and
+        # 'leslie' also applies survival, aging and births to that array with
+        # one Leslie-style operator a year (see iclus_v3_leslie). 'lazy'
+        # builds each projection year as polars query plans that are
+        # collected once, and 'streaming' collects the same plans with the
+        # streaming engine
+        assert engine in ('frame', 'dense', 'leslie', 'lazy', 'streaming')
+        self.engine = engine
+        self.layout = None
+
+        # optimized query plans of the 'lazy' and 'streaming' engines, by
+        # projection year (see explain())
+        self.plans = {}
+
+        # input rate tables, loaded once per run
+        self.rates = None
+
+        # per-phase timing trace, written next to the output database
+        self.tracer = Tracer()
+
+        # work within a projection year that does not depend on other work
+        # still running (the year's input rates, migration for each race) runs
+        # on a pool of WORKERS threads; with one worker everything runs in
+        # order, as it is submitted
+        self.scheduler = Scheduler(workers)
+        self.year_inputs = {}
+
+        # 'off', 'cheap' or 'full' checks of each projection year (see
+        # iclus_v3_validation); with 'cheap', the full checks also run in
+        # every year that is a multiple of VALIDATION_SAMPLE
+        self.validation = validation
+        self.validation_sample = validation_sample
+        self.validator = None
+
+        # output database writer, which writes on its own thread; RESUME_FROM is the output database of an
+        # interrupted run, which is continued from its latest checkpoint
+        self.output_database = output_database
+        self.resume_from = resume_from
+        if resume_from is not None:
+            self.output_database = resume_from
+        self.writer = None
+
+        # runs that branch off of this one, by the projection year they
+        # branch in (see iclus_v3_tree)
+        self.children = {}
+
+        # population-related attributes
+        self.current_pop = None
+        self.population_time_series = None
+
+        # immigration-related attributes
+        self.immigrants = None
+
+        # mortality-related attributes
+        self.deaths = None
+        self.cdc_mort_adj = cdc_mort_adj
+
+        # migration-related attributes; MIGRATION_INPUTS is an optional Arrow
+        # IPC file with the prepared county to county distance table (see
+        # iclus_v3_sweep), which is memory-mapped instead of rebuilt
+        self.net_migration = None
+        self.migration_inputs = migration_inputs
+        self.migration_distance = None
+        self.migration_model = None
+
+        # migration model coefficients to use instead of the fitted ones
+        # (e.g. a draw for an ensemble member; see iclus_v3_ensemble)
+        self.migration_coefficients = None
+
+        # subset run of the counties in REGION, a list of state FIPS codes
+        # and/or county GEOIDs (see iclus_v3_region); migration across the
+        # region's boundary comes from BOUNDARY_INPUTS, an optional Arrow IPC
+        # file of boundary flows, which are otherwise computed at the start of
+        # the run
+        self.region = region
+        self.boundary_inputs = boundary_inputs
+        self.boundary_flows = None
+
+        # fertility-related attributes
+        self.births = None
+        self.cdc_fert_adj = cdc_fert_adj
+
+    def run(self, final_projection_year=2099, step=1):
+        '''
+        Project every year through FINAL_PROJECTION_YEAR. STEP is the number
+        of years each projection step covers: 1 projects every year with the
+        ENGINE of the run, 5 projects whole 5-year steps on the population
+        array and interpolates the years in between (see run_steps())
+        '''
+        assert step in (1, AGE_GROUP_YEARS)
+        # checked before anything is read or written, since resume() trims
+        # the output tables of the run being resumed
+        if step > 1:
+            assert self.region is None, 'Regional runs need annual steps'
+            assert self.resume_from is None and not self.children, 'Resumed and branching runs need annual steps'
+
+        self.current_pop = set_launch_population()
+        if self.migration_inputs is not None:
+            self.migration_distance = read_distance(self.migration_inputs)
+        if self.region is not None:
+            self.restrict_to_region()
+        self.layout = CohortLayout.from_frame(self.current_pop)
+
+        # keys are joined on as integer codes from here on; the county to
+        # county table is prepared (and coded) once for the whole run
+        self.current_pop = self.layout.dimensions.encode(self.current_pop)
+        if self.migration_distance is None:
+            self.migration_distance = MigrationModel().distance
+        self.migration_distance = self.layout.dimensions.encode(self.migration_distance)
+
+        self.population_time_series = CohortSeries(self.layout, self.launch_year + 1, final_projection_year)
+        self.validator = Validator(self.layout, self.validation, self.validation_sample)
+        self.tracer = Tracer(f'{os.path.splitext(self.output_database)[0]}_trace.jsonl')
+        self.writer = BackgroundWriter(OutputWriter(self.output_database, self.scenario, self.rate_provider.output_tables,
+                                                    tracer=self.tracer))
+        with self.tracer.phase('load_rates'):
+            self.rates = self.rate_provider.rate_store(self.layout)
+        if self.resume_from is not None:
+            self.resume()
+
+        self.print_parameters()
+
+        if step > 1:
+            self.run_steps(final_projection_year, step)
+            self.finish()
+            return
+        if self.engine in ('dense', 'leslie'):
+            self.run_dense(final_projection_year)
+            self.finish()
+            return
+        if self.engine in ('lazy', 'streaming'):
+            self.run_lazy(final_projection_year)
+            self.finish()
+            return
+
+        while self.current_projection_year <= final_projection_year:
+            self.print_year_header(self.current_pop.select('POPULATION').sum()[0, 0])
+            self.branch()
+            self.schedule_year_inputs()
+            self.validator.start(self.current_projection_year, self.current_pop, 'POPULATION')
+
+            ############
+            ## DEATHS ##
+            ############
+
+            with self.tracer.phase('mortality', self.current_projection_year, rows=self.layout.size):
+                self.mortality()  # creates self.death
+            with self.tracer.phase('apply_deaths', self.current_projection_year, rows=self.layout.size):
+                self.current_pop = (self.current_pop.join(self.deaths,
+                                                          on=['GEOID', 'AGE_GROUP', 'RACE', 'SEX'],
+                                                          how='left',
+                                                          coalesce=True)
+                                    .with_columns(pl.col('POPULATION') - pl.col('DEATHS')
+                                    .alias('POPULATION'))
+                                    .drop('DEATHS'))
+                self.validator.add('deaths', self.deaths, 'DEATHS')
+
+                # assert self.current_pop.shape == (675648, 5)
+                # self.current_pop = self.current_pop.with_columns(pl.col('POPULATION').clip(lower_bound=0))
+                if self.validator.full(self.current_projection_year):
+                    assert sum(self.current_pop.null_count()).item() == 0
+                    assert self.current_pop.filter(pl.col('POPULATION') < 0).shape[0] == 0
+                self.deaths = None
+
+            #################
+            ## IMMIGRATION ##
+            #################
+
+            # calculate net international immigration
+            with self.tracer.phase('immigration', self.current_projection_year, rows=self.layout.size):
+                self.immigration()  # creates self.immigrants
+            with self.tracer.phase('apply_immigration', self.current_projection_year, rows=self.layout.size):
+                self.current_pop = (self.current_pop.join(self.immigrants,
+                                                          on=['GEOID', 'AGE_GROUP', 'RACE', 'SEX'],
+                                                          how='left',
+                                                          coalesce=True)
+                                    .with_columns(pl.when(pl.col('NET_IMMIGRATION').is_not_null()).then(pl.col('POPULATION') + pl.col('NET_IMMIGRATION'))
+                                    .otherwise(pl.col('POPULATION'))
+                                    .alias('POPULATION'))
+                                    .drop('NET_IMMIGRATION'))
+                self.validator.add('immigration', self.immigrants, 'NET_IMMIGRATION')
+
+                # assert self.current_pop.shape == (675648, 5)
+                self.current_pop = self.validator.clip_frame(self.current_pop)
+                if self.validator.full(self.current_projection_year):
+                    assert sum(self.current_pop.null_count()).item() == 0
+                    assert self.current_pop.filter(pl.col('POPULATION') < 0).shape[0] == 0
+                self.immigrants = None
+
+            ###############
+            ## MIGRATION ##
+            ###############
+
+            # calculate domestic migration
+            with self.tracer.phase('migration', self.current_projection_year, rows=self.layout.size):
+                self.migration()  # creates self.net_migration
+            with self.tracer.phase('apply_migration', self.current_projection_year, rows=self.layout.size):
+                self.current_pop = (self.current_pop.join(other=self.net_migration,
+                                                          on=['GEOID', 'AGE_GROUP', 'RACE', 'SEX'],
+                                                          how='left',
+                                                          coalesce=True)
+                                    .fill_null(0)
+                                    .with_columns((pl.col('POPULATION') + pl.col('NET_MIGRATION'))
+                                    .alias('POPULATION')))
+                self.validator.add('migration', self.net_migration, 'NET_MIGRATION')
+                self.current_pop = self.validator.round_frame(self.current_pop.drop('NET_MIGRATION'), pl.UInt64)
+
+                # assert self.current_pop.shape == (675648, 5)
+                self.current_pop = self.validator.clip_frame(self.current_pop)
+                if self.validator.full(self.current_projection_year):
+                    assert sum(self.current_pop.null_count()).item() == 0
+                    assert self.current_pop.filter(pl.col('POPULATION') < 0).shape[0] == 0
+                self.net_migration = None
+
+            ############
+            ## BIRTHS ##
+            ############
+
+            # calculate births
+            with self.tracer.phase('fertility', self.current_projection_year, rows=self.layout.size):
+                self.fertility()  # create self.births
+
+            # age everyone by one year
+            with self.tracer.phase('advance_age_groups', self.current_projection_year, rows=self.layout.size):
+                self.advance_age_groups()
+            assert self.current_pop.shape == (self.layout.size, 5)
+
+            with self.tracer.phase('apply_births', self.current_projection_year, rows=self.layout.size):
+                # add births
+                self.current_pop = (self.current_pop.join(other=self.births,
+                                                         on=['GEOID', 'RACE', 'AGE_GROUP', 'SEX'],
+                                                         how='left',
+                                                         coalesce=True)
+                                    .with_columns(pl.when(pl.col('BIRTHS').is_not_null())
+                                                  .then(pl.col('POPULATION') + pl.col('BIRTHS'))
+                                                  .otherwise(pl.col('POPULATION'))
+                                    .alias('POPULATION'))
+                                    .drop('BIRTHS'))
+                self.validator.add('births', self.births, 'BIRTHS')
+
+                assert self.current_pop.shape == (self.layout.size, 5)
+                self.births = None
+
+                self.current_pop = self.current_pop.sort(['GEOID', 'RACE', 'SEX', 'AGE_GROUP'])
+                self.current_pop = self.validator.round_frame(self.current_pop, pl.UInt64)
+
+            with self.tracer.phase('validate', self.current_projection_year, rows=self.layout.size):
+                self.validator.balance(self.current_pop, 'POPULATION')
+
+            with self.tracer.phase('save_population', self.current_projection_year, rows=self.layout.size):
+                self.save_population()
+
+        self.finish()
+
+    def run_dense(self, final_projection_year):
+        '''
+        Same projection as the 'frame' engine, but the population is held in a
+        county x race x sex x age group array and each component is applied in
+        place by position instead of through key joins. Migration still runs
+        on a DataFrame view of the array. The 'leslie' engine differs only in
+        applying survival, births and aging with the year's LeslieOperator.
+        '''
+        pop = self.layout.to_array(self.current_pop, 'POPULATION', complete=True)
+
+        while self.current_projection_year <= final_projection_year:
+            self.print_year_header(round(pop.sum()))
+            self.branch()
+            self.schedule_year_inputs()
+            self.validator.start(self.current_projection_year, pop)
+
+            # the 'leslie' engine applies survival, births and aging of the
+            # year through one operator
+            if self.engine == 'leslie':
+                rates = LeslieOperator(self.mortality_rates(), self.fertility_rates())
+            else:
+                rates = YearRates(self.mortality_rates(), self.fertility_rates())
+
+            ############################
+            ## DEATHS AND IMMIGRATION ##
+            ############################
+
+            with self.tracer.phase('deaths_immigration', self.current_projection_year, rows=self.layout.size):
+                immigrants = self.immigration()
+                deaths = deaths_and_immigration(pop, rates, immigrants, self.validator)
+            self.save_deaths_dense(deaths)
+            self.immigrants = None
+
+            ###############
+            ## MIGRATION ##
+            ###############
+
+            self.current_pop = self.layout.to_frame(pop, 'POPULATION')
+            with self.tracer.phase('migration', self.current_projection_year, rows=self.layout.size):
+                self.migration(pop)  # creates self.net_migration
+            net_migration = self.layout.to_array(self.net_migration, 'NET_MIGRATION', complete=True)
+            self.net_migration = None
+
+            ######################
+            ## BIRTHS AND AGING ##
+            ######################
+
+            with self.tracer.phase('births_aging', self.current_projection_year, rows=self.layout.size):
+                births = migration_births_and_aging(pop, net_migration, rates, self.validator)
+            self.save_births_dense(births)
+
+            with self.tracer.phase('validate', self.current_projection_year, rows=self.layout.size):
+                self.validator.balance(pop)
+            self.current_pop = (self.layout.to_frame(pop, 'POPULATION')
+                                .with_columns(pl.col('POPULATION').cast(pl.UInt64)))
+
+            with self.tracer.phase('save_population', self.current_projection_year, rows=self.layout.size):
+                self.save_population(pop)
+
+    def run_steps(self, final_projection_year, step):
+        '''
+        Project STEP years at a time on the population array. Over a step,
+        every cohort advances STEP / 5 of an age group (a whole age group for
+        a 5-year step; a last step cut short by FINAL_PROJECTION_YEAR
+        advances its share of one), and each component covers the whole step:
+
+            deaths       survival over the step (see step_survival())
+            immigration  the step's net immigrants; half arrive at the start
+                         of the step, are exposed to its mortality and age
+                         with their cohorts, and half arrive at the end
+            migration    the annual flows of the migration model
+                         (dense_migration_plum_v3) for the population after
+                         deaths, times the years of the step
+            births       the step's fertility rates applied to the women
+                         after migration; newborns are exposed to half of
+                         the step's 0-4 mortality
+
+        so the migration model is evaluated once per step. The outputs of
+        the years within a step are interpolated: population linearly
+        between the ends of the step, and deaths, migration and births
+        spread evenly over its years; immigration is known for every year.
+        Each step is balanced by the Validator. Regional runs, resuming and
+        branching need annual steps (checked in run()).
+        '''
+        pop = self.layout.to_array(self.current_pop, 'POPULATION', complete=True)
+        coefs = MigrationModel(distance=self.migration_distance, coefs=self.migration_coefficients).coefs
+        with self.tracer.phase('prepare_migration'):
+            migration_model = DenseMigrationModel(self.layout, self.migration_distance)
+
+        while self.current_projection_year <= final_projection_year:
+            years = range(self.current_projection_year, min(self.current_projection_year + step, final_projection_year + 1))
+            fraction = len(years) / AGE_GROUP_YEARS
+            start_pop = pop.copy()
+
+            self.print_year_header(round(pop.sum()))
+            print(f"Projecting {years[0]}-{years[-1]} in one step")
+            self.validator.start(years[0], pop)
+
+            #################
+            ## IMMIGRATION ##
+            #################
+
+            with self.tracer.phase('immigration', years[0], rows=self.layout.size):
+                annual_immigrants = [self.rates.county_immigrants[year] for year in years]
+                immigrants = np.sum(annual_immigrants, axis=0)
+                pop += immigrants / 2
+            self.validator.add('immigration', immigrants / 2)
+            self.validator.clip(pop)
+
+            ############
+            ## DEATHS ##
+            ############
+
+            with self.tracer.phase('mortality', years[0], rows=self.layout.size):
+                mortality_rates = [self.rates.mortality_rates(year - 1, self.cdc_mort_adj) for year in years]
+                deaths = pop * (1 - step_survival(mortality_rates, fraction))
+                pop -= deaths
+            if self.validator.full(years[0]):
+                assert (pop >= 0).all()
+
+            ###############
+            ## MIGRATION ##
+            ###############
+
+            with self.tracer.phase('migration', years[0], rows=self.layout.size):
+                print("Calculating domestic migration...")
+                inflows, outflows = migration_model.migrate(pop, coefs)
+                inflows *= len(years)
+                outflows *= len(years)
+                net_migration = inflows - outflows
+                pop += net_migration
+            self.validator.add('migration', net_migration)
+            self.validator.round(pop)
+            self.validator.clip(pop)
+
+            ############
+            ## BIRTHS ##
+            ############
+
+            with self.tracer.phase('fertility', years[0], rows=self.layout.size):
+                births = births_by_sex(pop, np.sum([self.rates.fertility_rates(year - 1, self.cdc_fert_adj) for year in years], axis=0))
+                newborn_deaths = births * (1 - step_survival(mortality_rates, 0, exposure=0.5)[..., 0])
+                deaths[..., 0] += newborn_deaths
+            with self.tracer.phase('advance_age_groups', years[0], rows=self.layout.size):
+                advance_cohorts_by(pop, fraction)
+                pop[..., 0] += births - newborn_deaths
+                pop += immigrants / 2
+            self.validator.add('deaths', deaths)
+            self.validator.add('births', births)
+            self.validator.add('immigration', immigrants / 2)
+            self.validator.clip(pop)
+
+            self.validator.round(pop)
+            with self.tracer.phase('validate', years[0], rows=self.layout.size):
+                self.validator.balance(pop)
+            print(f"Total population (end of {years[-1]}): {round(pop.sum()):,}\n")
+
+            ####################
+            ## ANNUAL OUTPUTS ##
+            ####################
+
+            with self.tracer.phase('save_population', years[0], rows=self.layout.size):
+                for i, year in enumerate(years):
+                    share = (i + 1) / len(years)
+                    year_pop = np.round(start_pop + share * (pop - start_pop))
+                    self.save_year(year_pop, deaths / len(years), annual_immigrants[i],
+                                   inflows / len(years), outflows / len(years), births / len(years))
+
+    def save_year(self, pop, deaths, immigrants, inflows, outflows, births):
+        '''
+        Write one (interpolated) year of a multi-year step to the output
+        database and the population time series, and move on to the next
+        projection year
+        '''
+        self.deaths = self.layout.to_frame(deaths, 'DEATHS')
+        self.save_deaths()
+        self.deaths = None
+
+        self.writer.append('immigration', self.layout.to_frame(immigrants, 'NET_IMMIGRATION'), self.current_projection_year)
+        self.writer.append('migration',
+                           (self.layout.to_frame(inflows, 'INFLOWS')
+                            .with_columns(pl.Series(name='OUTFLOWS', values=outflows.flatten()),
+                                          pl.Series(name='NET_MIGRATION', values=(inflows - outflows).flatten()))),
+                           self.current_projection_year)
+
+        self.births = self.births_frame(births)
+        self.save_births()
+        self.births = None
+
+        self.population_time_series[self.current_projection_year] = pop
+        self.current_pop = (self.layout.to_frame(pop, 'POPULATION')
+                            .with_columns(pl.col('POPULATION').cast(pl.UInt64)))
+        self.writer.append('population', self.current_pop, self.current_projection_year)
+        self.current_projection_year += 1
+
+    def run_lazy(self, final_projection_year):
+        '''
+        Same projection as the 'frame' engine, but the components of each
+        projection year are chained into one LazyFrame plan that is collected
+        once, so polars can fuse them, drop the columns nothing reads and run
+        them on the streaming engine. The migration model needs the
+        population after immigration in memory, so each year has two plans:
+        deaths and immigration, then migration, births and aging. Their
+        optimized plans are kept for explain().
+        '''
+        while self.current_projection_year <= final_projection_year:
+            self.print_year_header(self.current_pop.select('POPULATION').sum().item())
+            self.branch()
+            self.schedule_year_inputs()
+            self.validator.start(self.current_projection_year, self.current_pop, 'POPULATION')
+            self.plans[self.current_projection_year] = {}
+
+            ############################
+            ## DEATHS AND IMMIGRATION ##
+            ############################
+
+            with self.tracer.phase('immigration', self.current_projection_year, rows=self.layout.size):
+                self.immigration()  # creates self.immigrants
+            with self.tracer.phase('deaths_immigration', self.current_projection_year, rows=self.layout.size):
+                df = self.collect_plan('deaths_immigration', self.deaths_immigration_plan())
+
+                self.deaths = df.select(['GEOID', 'AGE_GROUP', 'RACE', 'SEX', 'DEATHS'])
+                print(f"Deaths: {round(self.deaths.select('DEATHS').sum().item()):,} this year")
+                self.save_deaths()
+                self.validator.add('deaths', df, 'DEATHS')
+                self.validator.add('immigration', df, 'NET_IMMIGRATION')
+                self.validator.adjust('clip', df, 'UNCLIPPED', 'POPULATION')
+
+                self.current_pop = df.select(['GEOID', 'RACE', 'SEX', 'AGE_GROUP', 'POPULATION'])
+                if self.validator.full(self.current_projection_year):
+                    assert sum(self.current_pop.null_count()).item() == 0
+                    assert self.current_pop.filter(pl.col('POPULATION') < 0).shape[0] == 0
+                self.deaths = None
+                self.immigrants = None
+
+            ###############
+            ## MIGRATION ##
+            ###############
+
+            with self.tracer.phase('migration', self.current_projection_year, rows=self.layout.size):
+                self.migration()  # creates self.net_migration
+            self.validator.add('migration', self.net_migration, 'NET_MIGRATION')
+
+            ######################
+            ## BIRTHS AND AGING ##
+            ######################
+
+            with self.tracer.phase('migration_births_aging', self.current_projection_year, rows=self.layout.size):
+                df = self.collect_plan('migration_births_aging', self.births_aging_plan())
+                self.net_migration = None
+
+                self.births = (df.filter(pl.col('AGE_GROUP') == '0-4')
+                               .select(['GEOID', 'RACE', 'SEX', 'BIRTHS', 'AGE_GROUP']))
+                print(f"Births: {round(self.births.select('BIRTHS').sum().item()):,} this year")
+                self.save_births()
+                self.validator.adjust('round', df, 'MIGRATED', 'ROUNDED')
+                self.validator.adjust('clip', df, 'ROUNDED', 'SETTLED')
+                self.validator.add('births', self.births, 'BIRTHS')
+                self.validator.adjust('round', df, 'UNROUNDED', 'POPULATION')
+                self.births = None
+
+                self.current_pop = df.select(['GEOID', 'RACE', 'SEX', 'AGE_GROUP', 'POPULATION'])
+                if self.validator.full(self.current_projection_year):
+                    assert sum(df.null_count()).item() == 0
+                assert self.current_pop.shape == (self.layout.size, 5)
+
+            with self.tracer.phase('validate', self.current_projection_year, rows=self.layout.size):
+                self.validator.balance(self.current_pop, 'POPULATION')
+
+            with self.tracer.phase('save_population', self.current_projection_year, rows=self.layout.size):
+                self.save_population()
+
+    def deaths_immigration_plan(self):
+        '''
+        Plan of the first part of the projection year for the 'lazy' engine:
+        deaths, then net immigration, clipped at 0. Keeps the components and
+        the population before clipping (UNCLIPPED) for the validator.
+        '''
+        keys = ['GEOID', 'AGE_GROUP', 'RACE', 'SEX']
+
+        lf = (self.current_pop.lazy()
+              .join(self.layout.to_frame(self.mortality_rates(), 'MORT_PROJ').lazy(), on=keys, how='left', coalesce=True)
+              .with_columns((pl.col('MORT_PROJ') * pl.col('POPULATION')).alias('DEATHS'))
+              .with_columns((pl.col('POPULATION') - pl.col('DEATHS')).alias('POPULATION'))
+              .join(self.immigrants.lazy(), on=keys, how='left', coalesce=True)
+              .with_columns(pl.col('NET_IMMIGRATION').fill_null(0))
+              .with_columns((pl.col('POPULATION') + pl.col('NET_IMMIGRATION')).alias('UNCLIPPED'))
+              .with_columns(pl.col('UNCLIPPED').clip(lower_bound=0).alias('POPULATION')))
+
+        return lf.select(['GEOID', 'RACE', 'SEX', 'AGE_GROUP', 'POPULATION', 'DEATHS', 'NET_IMMIGRATION', 'UNCLIPPED'])
+
+    def births_aging_plan(self):
+        '''
+        Plan of the rest of the projection year for the 'lazy' engine: net
+        migration (rounded and clipped at 0), births, aging and the births
+        added to the 0-4 age group, rounded. Keeps the population before each
+        rounding and clipping for the validator.
+        '''
+        keys = ['GEOID', 'AGE_GROUP', 'RACE', 'SEX']
+        mothers = (pl.col('SEX') == 'FEMALE') & pl.col('AGE_GROUP').is_in(FERTILITY_AGE_GROUPS)
+        total_births = pl.when(mothers).then(pl.col('FERT_PROJ') * pl.col('SETTLED')).otherwise(0)
+        male_births = total_births * 0.512195122  # from Mathews, et al. (2005)
+
+        lf = (self.current_pop.lazy()
+              .join(self.net_migration.lazy(), on=keys, how='left', coalesce=True)
+              .with_columns((pl.col('POPULATION') + pl.col('NET_MIGRATION').fill_null(0)).alias('MIGRATED'))
+              .with_columns(pl.col('MIGRATED').round(0).alias('ROUNDED'))
+              .with_columns(pl.col('ROUNDED').clip(lower_bound=0).alias('SETTLED'))
+
+              # births of each sex by county and race, on the newborn rows
+              .join(self.layout.to_frame(self.fertility_rates(), 'FERT_PROJ').lazy(), on=keys, how='left', coalesce=True)
+              .with_columns(pl.when(pl.col('AGE_GROUP') != '0-4')
+                              .then(0.0)
+                              .when(pl.col('SEX') == 'MALE')
+                              .then(male_births.sum().over(['GEOID', 'RACE']))
+                              .otherwise((total_births - male_births).sum().over(['GEOID', 'RACE']))
+                              .alias('BIRTHS'))
+
+              # advance 20 percent of each cohort to the next age group, then
+              # add the births
+              .sort(['GEOID', 'RACE', 'SEX', 'AGE_GROUP'])
+              .with_columns((pl.col('SETTLED') * 0.2)
+                            .shift(fill_value=0)
+                            .over('GEOID', 'RACE', 'SEX')
+                            .alias('AGE_ADVANCING'))
+              .with_columns((pl.when(pl.col('AGE_GROUP') != pl.lit('85+'))
+                               .then(pl.col('SETTLED') * 0.8)
+                               .otherwise(pl.col('SETTLED'))
+                             + pl.col('AGE_ADVANCING')
+                             + pl.col('BIRTHS')).alias('UNROUNDED'))
+              .with_columns(pl.col('UNROUNDED').round(0).cast(pl.UInt64).alias('POPULATION')))
+
+        return lf.select(['GEOID', 'RACE', 'SEX', 'AGE_GROUP', 'POPULATION',
+                          'BIRTHS', 'MIGRATED', 'ROUNDED', 'SETTLED', 'UNROUNDED'])
+
+    def collect_plan(self, name, lf):
+        '''
+        Collect the plan LF of the current projection year once, with the
+        engine of the run, and keep its optimized plan under NAME
+        '''
+        engine = 'streaming' if self.engine == 'streaming' else 'auto'
+        self.plans[self.current_projection_year][name] = lf.explain(engine=engine)
+
+        return lf.collect(engine=engine)
+
+    def explain(self, year=None):
+        '''
+        The optimized query plans of one projection YEAR of the 'lazy' and
+        'streaming' engines (by default the latest), as polars explains them
+        '''
+        if year is None:
+            year = max(self.plans)
+
+        return '\n\n'.join(f'{name}:\n{plan}' for name, plan in self.plans[year].items())
+
+    def print_parameters(self, output_database=False):
+        '''
+        Print the parameters of this run
+        '''
+        print("\n")
+        print("***************** PARAMETERS ******************")
+        print("Scenario: ", self.scenario)
+        print("CDC fertility adjustment:", f'{self.cdc_fert_adj * 100}%')
+        print("CDC mortality adjustment:", f'{self.cdc_mort_adj * 100}%')
+        self.rate_provider.print_parameters()
+        if self.region is not None:
+            print("Region:", ', '.join(self.region), f'({len(self.layout.geoids)} counties)')
+        if output_database:
+            print("Output database:", os.path.basename(self.output_database))
+        print("***********************************************")
+
+    def restrict_to_region(self):
+        '''
+        Limit the run to the counties of the region: the launch population
+        and the county to county table are cut down to the region, and the
+        boundary flows are read (or computed from the national launch
+        population)
+        '''
+        print("Restricting the run to the region...", end='')
+
+        geoids = region_geoids(self.current_pop.get_column('GEOID').unique().to_list(), self.region)
+        if self.migration_distance is None:
+            self.migration_distance = MigrationModel().distance
+
+        if self.boundary_inputs is None:
+            self.boundary_flows = boundary_flows(self.current_pop, self.region, self.migration_distance)
+        else:
+            self.boundary_flows = read_boundary_flows(self.boundary_inputs)
+        assert set(self.boundary_flows.get_column('GEOID').unique().to_list()) <= set(geoids)
+
+        self.migration_distance = restrict_distance(self.migration_distance, geoids)
+        self.current_pop = self.current_pop.filter(pl.col('GEOID').is_in(geoids))
+
+        print(f"finished! ({len(geoids)} counties)")
+
+    def schedule_year_inputs(self):
+        '''
+        Start computing the inputs of the current projection year that do not
+        depend on the population: the mortality and fertility rates and the
+        county immigration table
+        '''
+        year = self.current_projection_year
+        immigrants = self.rates.county_immigrants[year]
+
+        self.year_inputs = {'mortality_rates': self.scheduler.submit(self.rates.mortality_rates, year - 1, self.cdc_mort_adj),
+                            'fertility_rates': self.scheduler.submit(self.rates.fertility_rates, year - 1, self.cdc_fert_adj),
+                            'immigration': self.scheduler.submit(self.layout.to_frame, immigrants, 'NET_IMMIGRATION')}
+
+    def year_input(self, name):
+        '''
+        Wait for one of the inputs started by schedule_year_inputs()
+        '''
+        return self.year_inputs[name].result()
+
+    def print_year_header(self, total_population):
+        '''
+        Print a banner at the start of each projection year
+        '''
+        print("##############")
+        print("###        ###")
+        print(f"###  {self.current_projection_year}  ###")
+        print("###        ###")
+        print("##############")
+        print(f"{time.ctime()}")
+        print(f"Total population (start): {total_population:,}\n")
+
+    def finish(self):
+        '''
+        Build the wide output tables; the checkpoints are no longer needed
+        once the run is complete
+        '''
+        with self.tracer.phase('finalize'):
+            self.writer.finalize()
+        self.scheduler.close()
+        clear_checkpoints(self.output_database)
+        self.tracer.close()
+
+    def checkpoint_parameters(self):
+        '''
+        Run parameters that a checkpoint has to match to be resumed
+        '''
+        parameters = self.rate_provider.parameters()
+        parameters.update({'cdc_fert_adj': self.cdc_fert_adj,
+                           'cdc_mort_adj': self.cdc_mort_adj})
+
+        return parameters
+
+    def resume(self):
+        '''
+        Restore the population and the output tables from the latest valid
+        checkpoint of the output database being resumed
+        '''
+        checkpoint = latest_checkpoint(self.output_database, self.checkpoint_parameters())
+        assert checkpoint is not None, f'No valid checkpoint found for {self.output_database}'
+        year, arrays = checkpoint
+        assert tuple(arrays['GEOID']) == self.layout.geoids
+
+        self.current_pop = self.layout.to_frame(arrays['POPULATION'], 'POPULATION')
+        self.current_pop = self.current_pop.with_columns(pl.col('POPULATION').cast(pl.UInt64))
+        self.writer.resume(year)
+        for (written_year,), df in self.writer.read('population').group_by('YEAR'):
+            self.population_time_series[written_year] = self.layout.to_array(df, 'POPULATION', complete=True)
+        self.current_projection_year = year + 1
+
+        print(f"Resuming from the checkpoint for {year}")
+
+    def branch(self):
+        '''
+        Hand the state at the end of the previous projection year to every
+        child run that branches off of this one in the current year; each
+        child later resumes from it
+        '''
+        year = self.current_projection_year - 1
+        for child in self.children.get(self.current_projection_year, []):
+            self.writer.fork(child.output_database, child.scenario)
+            write_checkpoint(child.output_database,
+                             year,
+                             child.checkpoint_parameters(),
+                             {'POPULATION': self.population_time_series[year],
+                              'GEOID': np.array(self.layout.geoids)})
+
+    def save_population(self, pop=None):
+        '''
+        Add the current population to the population time series and the
+        output database, checkpoint the run and move on to the next projection
+        year. POP is the current population as an array, if it is already
+        held as one
+        '''
+        if pop is None:
+            pop = self.layout.to_array(self.current_pop, 'POPULATION', complete=True)
+        self.population_time_series[self.current_projection_year] = pop
+
+        # save results to sqlite3 database
+        self.writer.append('population', self.current_pop, self.current_projection_year)
+
+        # the checkpoint is written by the output writer, after this year's
+        # outputs, so that it never runs ahead of the output database
+        self.writer.call(write_checkpoint,
+                         self.output_database,
+                         self.current_projection_year,
+                         self.checkpoint_parameters(),
+                         {'POPULATION': self.population_time_series[self.current_projection_year],
+                          'GEOID': np.array(self.layout.geoids)})
+        self.current_projection_year += 1
+
+        print(f"Total population (end): {self.current_pop.select('POPULATION').sum().item():,}\n")
+
+        self.print_parameters(output_database=True)
+
+    def advance_age_groups(self):
+        '''
+        Since cohorts are aggregated into 5-year age groups, advance 20 percent
+        of the population in each cohorts to the next AGE_GROUP
+        '''
+        print("Advancing the age of the population by one year...", end='')
+        starting_pop = self.current_pop.select('POPULATION').sum().item()
+
+        # VERY IMPORTANT that the dataframe is sorted exactly like this
+        self.current_pop = self.current_pop.sort(['GEOID', 'RACE', 'SEX', 'AGE_GROUP'])
+
+        # shift 20 percent of the population in each cohort
+
+        self.current_pop = self.current_pop.with_columns((pl.col('POPULATION') * 0.2)
+                                           .shift(fill_value=0)
+                                           .over('GEOID', 'RACE', 'SEX')
+                                           .alias('AGE_ADVANCING'))
+
+        # reduce the population in each age cohort by 20%, except for 85+
+        self.current_pop = self.current_pop.with_columns(pl.when(pl.col('AGE_GROUP') != pl.lit('85+'))
+                                                         .then(pl.col('POPULATION') * 0.8)
+                                                         .otherwise(pl.col('POPULATION'))
+                                                         .alias('POPULATION'))
+
+        self.current_pop = self.current_pop.with_columns((pl.col('POPULATION') + pl.col('AGE_ADVANCING')).alias('POPULATION'))
+        self.current_pop = self.current_pop.drop('AGE_ADVANCING')
+
+        # a rounding difference of << 1 is possible
+        assert starting_pop - self.current_pop.select('POPULATION').sum().item() < 1
+
+        print("finished!")
+
+    def mortality_rates(self):
+        '''
+        Projected mortality rates (deaths per person) for the current
+        projection year, as a population-shaped array
+        '''
+        return self.year_input('mortality_rates')
+
+    def mortality(self):
+        '''
+        Calculate deaths
+        '''
+
+        print("Calculating mortality...", end='')
+
+        df = self.current_pop.clone()
+        df = df.join(other=self.layout.to_frame(self.mortality_rates(), 'MORT_PROJ'),
+                     on=['RACE', 'AGE_GROUP', 'SEX', 'GEOID'],
+                     how='left',
+                     coalesce=True)
+
+        # calculate deaths
+        df = df.with_columns((pl.col('MORT_PROJ') * pl.col('POPULATION')).alias('DEATHS'))
+        df = df.select(['GEOID', 'AGE_GROUP', 'RACE', 'SEX', 'DEATHS'])
+        if self.validator.full(self.current_projection_year):
+            assert sum(df.null_count()).item() == 0
+
+        # store deaths
+        self.deaths = df.clone()
+        total_deaths_this_year = round(self.deaths.select(pl.col('DEATHS').sum()).item())
+        self.save_deaths()
+
+        print(f"finished! ({total_deaths_this_year:,} deaths this year)")
+
+    def save_deaths_dense(self, deaths):
+        '''
+        Store the population-shaped array of DEATHS of the 'dense' engine
+        '''
+        self.deaths = self.layout.to_frame(deaths, 'DEATHS')
+        self.save_deaths()
+        self.deaths = None
+
+        print(f"Mortality: {round(deaths.sum()):,} deaths this year")
+
+    def save_deaths(self):
+        '''
+        Store time series of mortality in sqlite3
+        '''
+        # assert self.deaths.shape[0] == 675648
+        self.writer.append('deaths', self.deaths, self.current_projection_year)
+
+    def immigration(self):
+        '''
+        Net immigration for the current projection year, looked up from the
+        county immigration time series that the rate store computes up front;
+        returns a population-shaped array of immigrants
+        '''
+        print("Calculating net immigration...", end='')
+
+        immigrants = self.rates.county_immigrants[self.current_projection_year]
+
+        # every national immigrant is allocated to a county
+        if self.region is None and self.validator.full(self.current_projection_year):
+            value1 = self.rates.national_immigrants[self.current_projection_year].sum()
+            value2 = immigrants.sum()
+            assert abs(value1 - value2) < 1
+
+        self.immigrants = self.year_input('immigration')
+
+        # store time series of immigration in sqlite3
+        self.writer.append('immigration', self.immigrants, self.current_projection_year)
+
+        print(f"finished! ({round(immigrants.sum()):,} net immigrants this year)")
+
+        return immigrants
+
+    def migration(self, pop=None):
+        '''
+        Calculate domestic migration. POP is the current population as an
+        array, if it is already held as one
+        '''
+        print("Calculating domestic migration...")
+
+        # the model is built once per run and reads a read-only view of the
+        # population instead of a copy of the DataFrame
+        if self.migration_model is None:
+            self.migration_model = MigrationModel(distance=self.migration_distance, coefs=self.migration_coefficients)
+            self.migration_model.tracer = self.tracer
+        migration_model = self.migration_model
+        if pop is None:
+            pop = self.layout.to_array(self.current_pop, 'POPULATION', complete=True)
+        migration_model.set_population(PopulationView(pop, self.layout))
+
+        # every race is migrated on the scheduler; the results are combined in
+        # the order of MIGRATION_RACES, as they would be one race at a time
+        # for race in ('WHITE',):
+        parent = self.tracer.current()
+        race_flows = [self.scheduler.submit(self.race_migration, migration_model, race, parent) for race in MIGRATION_RACES]
+        for flows in race_flows:
+            lf = flows.result()
+            if self.net_migration is None:
+                self.net_migration = lf.clone()
+            else:
+                self.net_migration = pl.concat(items=[self.net_migration, lf], how='vertical')
+
+        total_migrants_this_year = round(self.net_migration.select('INFLOWS').sum().item())
+        self.net_migration = self.net_migration.select(['GEOID', 'RACE', 'SEX', 'AGE_GROUP', 'INFLOWS', 'OUTFLOWS', 'NET_MIGRATION'])
+        self.net_migration = self.net_migration.sort(['GEOID', 'RACE', 'SEX', 'AGE_GROUP'])
+
+        assert self.net_migration.shape[0] == self.layout.size
+        if self.validator.full(self.current_projection_year):
+            assert self.net_migration.null_count().sum_horizontal().item() == 0
+            assert self.net_migration.filter(pl.col('NET_MIGRATION').is_nan()).shape[0] == 0
+
+        self.save_migration()
+
+        self.net_migration = self.net_migration.select(['GEOID', 'RACE', 'SEX', 'AGE_GROUP', 'NET_MIGRATION'])
+        assert self.net_migration.shape[0] == self.layout.size
+
+        pct_migration = round(((total_migrants_this_year / pop.sum())) * 100.0, 1)
+        print(f"...finished! ({total_migrants_this_year:,} total migrants this year; {pct_migration}% of the current population)")
+
+    def save_migration(self):
+        '''
+        Store time series of migration in sqlite3
+        '''
+        self.writer.append('migration', self.net_migration, self.current_projection_year)
+
+    def race_migration(self, migration_model, race, parent=None):
+        '''
+        Net domestic migration of one race by county, sex and age group.
+        PARENT is the trace record of the migration phase this runs in
+        '''
+        with self.tracer.phase('race', race=race, parent=parent):
+            print(f"\t{race}...")
+
+            # compute all county to county migration flows
+            # 'compute migrants' iterates over all age groups
+            gross_flows = migration_model.compute_migrants(race)
+            gross_flows = gross_flows.with_columns(pl.lit(race).alias('RACE'))
+
+            # calculate a sex fraction for each county/race/age cohort
+            ratios = self.current_pop.filter(pl.col('RACE') == race)
+            ratios = ratios.with_columns(pl.col('POPULATION')
+                                         .sum()
+                                         .over(['GEOID', 'AGE_GROUP'])
+                                         .alias('GEOID_AGE_POP'))
+
+            ratios = ratios.with_columns((pl.col('POPULATION') / pl.col('GEOID_AGE_POP'))
+                                         .fill_null(value=0)
+                                         .alias('SEX_FRACTION'))
+            ratios = ratios.drop(['POPULATION', 'GEOID_AGE_POP', 'RACE'])
+
+            inflows = gross_flows.group_by(pl.col(['DESTINATION_FIPS', 'AGE_GROUP'])).agg(pl.col('MIGRATION').sum())
+            if self.boundary_flows is not None:
+                inflows = with_boundary_flows(inflows, self.boundary_flows.filter(pl.col('RACE') == race), 'DESTINATION_FIPS', 'INFLOWS')
+            lf = (ratios.join(other=inflows,
+                              how='left',
+                              left_on=['GEOID', 'AGE_GROUP'],
+                              right_on=['DESTINATION_FIPS', 'AGE_GROUP'],
+                              coalesce=True)
+                  .fill_null(value=0)
+                  .fill_nan(value=0)
+                  .with_columns((pl.col('SEX_FRACTION') * pl.col('MIGRATION'))
+                  .alias('INFLOWS')))
+            lf = lf.select(['GEOID', 'AGE_GROUP', 'SEX', 'SEX_FRACTION', 'INFLOWS'])
+
+            outflows = gross_flows.group_by(pl.col(['ORIGIN_FIPS', 'AGE_GROUP'])).agg(pl.col('MIGRATION').sum())
+            if self.boundary_flows is not None:
+                outflows = with_boundary_flows(outflows, self.boundary_flows.filter(pl.col('RACE') == race), 'ORIGIN_FIPS', 'OUTFLOWS')
+            lf = (lf.join(other=outflows,
+                          how='left',
+                          left_on=['GEOID', 'AGE_GROUP'],
+                          right_on=['ORIGIN_FIPS', 'AGE_GROUP'],
+                          coalesce=True)
+                  .fill_null(value=0)
+                  .fill_nan(value=0)
+                  .with_columns((pl.col('SEX_FRACTION') * pl.col('MIGRATION'))
+                  .alias('OUTFLOWS')))
+            lf = lf.with_columns((pl.col('INFLOWS') - pl.col('OUTFLOWS'))
+                                 .alias('NET_MIGRATION'))
+            lf = lf.select(['GEOID', 'AGE_GROUP', 'SEX', 'INFLOWS', 'OUTFLOWS', 'NET_MIGRATION'])
+            lf = lf.with_columns(pl.lit(race).cast(self.layout.dimensions.dtypes['RACE']).alias('RACE'))
+
+            # assert lf.shape == (111960, 5)
+
+        return lf
+
+    def fertility_rates(self):
+        '''
+        Projected fertility rates (births per woman) for the current projection
+        year, as a population-shaped array that is 0 outside of FEMALE 15-44
+        '''
+        return self.year_input('fertility_rates')
+
+    def fertility(self):
+        '''
+        Calculate births
+        '''
+        print("Calculating fertility...", end='')
+
+        df = self.current_pop.filter(pl.col('SEX').is_in(('FEMALE',)) & pl.col('AGE_GROUP').is_in(FERTILITY_AGE_GROUPS))
+
+        # calculate births
+        df = df.join(other=self.layout.to_frame(self.fertility_rates(), 'FERT_PROJ'),
+                     on=['GEOID', 'AGE_GROUP', 'RACE', 'SEX'],
+                     how='left',
+                     coalesce=True)
+
+        df = df.with_columns((pl.col('FERT_PROJ') * pl.col('POPULATION')).alias('TOTAL_BIRTHS'))
+        df = df.with_columns((pl.col('TOTAL_BIRTHS') * 0.512195122).alias('MALE'))  # from Mathews, et al. (2005)
+        df = df.with_columns((pl.col('TOTAL_BIRTHS') - pl.col('MALE')).alias('FEMALE'))
+        df = (df.select(['GEOID', 'RACE', 'MALE', 'FEMALE'])
+                .unpivot(index=['GEOID', 'RACE'], variable_name='SEX', value_name='BIRTHS')
+                .group_by(['GEOID', 'RACE', 'SEX']).agg(pl.col('BIRTHS').sum()))
+        df = df.with_columns(pl.lit('0-4').alias('AGE_GROUP'))
+        df = self.layout.dimensions.encode(df)
+        if self.validator.full(self.current_projection_year):
+            assert sum(df.null_count()).item() == 0
+
+        # store births
+        self.births = df.clone()
+        total_births_this_year = round(self.births.select('BIRTHS').sum().item())
+        self.save_births()
+
+        print(f"finished! ({total_births_this_year:,} births this year)")
+
+    def save_births_dense(self, births):
+        '''
+        Store the county x race x sex array of BIRTHS of the 'dense' engine
+        '''
+        self.births = self.births_frame(births)
+        self.save_births()
+        self.births = None
+
+        print(f"Fertility: {round(births.sum()):,} births this year")
+
+    def births_frame(self, births):
+        '''
+        A county x race x sex array of BIRTHS as a births DataFrame, in the
+        0-4 AGE_GROUP
+        '''
+        full_births = np.zeros(self.layout.shape)
+        full_births[..., 0] = births
+
+        return (self.layout.to_frame(full_births, 'BIRTHS')
+                .filter(pl.col('AGE_GROUP') == '0-4')
+                .select(['GEOID', 'RACE', 'SEX', 'BIRTHS', 'AGE_GROUP']))
+
+    def save_births(self):
+        '''
+        Store time series of fertility in sqlite3
+        '''
+        assert self.births.shape[0] == self.layout.size // len(AGE_GROUPS)
+        self.writer.append('births', self.births, self.current_projection_year)
+
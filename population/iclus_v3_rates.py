@@ -0,0 +1,401 @@
+'''
+Run-scoped store for the input rate tables used by the ICLUS v3 projectors.
+
+Every table is read from SQLite exactly once, when the store is created.
+County rates are scattered into arrays that line up with a CohortLayout, and
+the year-indexed multipliers are held as year x cohort arrays, so a
+projection year only has to index into memory. County net immigration does
+not depend on the projected population, so the whole time series of it is
+computed up front.
+
+A RateProvider names the store a product line runs with, so that one
+projection core serves every product line.
+'''
+import numpy as np
+import polars as pl
+
+from iclus_v3_config import ACS_DB, CDC_DB, CENSUS_DB, WITT_DB
+from iclus_v3_dense import AGE_GROUPS, FERTILITY_AGE_GROUPS, RACES, SEXES
+
+
+# race/ethnicity categories used by the Census and ACS immigration tables
+IMMIGRATION_RACES = ('AIAN', 'ASIAN', 'BLACK', 'HISP_WHITE', 'NHPI', 'NH_WHITE', 'TWO_OR_MORE')
+
+# (immigration race x projection race) matrix; white immigrants of either
+# ethnicity are added to the WHITE population
+IMMIGRATION_RACE_MATRIX = np.array([[1.0 if race == {'HISP_WHITE': 'WHITE', 'NH_WHITE': 'WHITE'}.get(immigration_race, immigration_race) else 0.0
+                                     for race in RACES]
+                                    for immigration_race in IMMIGRATION_RACES])
+
+
+def flat_index(df, dims):
+    '''
+    Position of each row of DF in a dense array with one axis per (column,
+    labels) pair in DIMS; null where a column holds a label that is not in
+    its axis
+    '''
+    index = pl.lit(0, dtype=pl.Int64)
+    for column, labels in dims:
+        code = pl.col(column).cast(pl.String).replace_strict(labels, range(len(labels)), default=None, return_dtype=pl.Int64)
+        index = index * len(labels) + code
+
+    return df.select(index.alias('INDEX')).get_column('INDEX')
+
+
+def census_national_immigration(scenario, census_imm_hist2324):
+    '''
+    Census national net immigrants for each year, race, sex, and age group
+    '''
+    # this is the net migrants for each age-sex combination
+    if census_imm_hist2324 is True:
+        table_name = f'census_np2023_asmig_{scenario}_with_historical2324'
+    else:
+        table_name = f'census_np2023_asmig_{scenario}'
+    uri = f'sqlite:{CENSUS_DB}'
+    query = f'SELECT * FROM {table_name}'
+    df = pl.read_database_uri(query=query, uri=uri)
+    df = df.unpivot(index=['YEAR', 'AGE_GROUP', 'SEX'], variable_name='RACE', value_name='NET_IMMIGRATION')
+
+    return YearCohortArray(df, 'NET_IMMIGRATION', dims=(('RACE', IMMIGRATION_RACES), ('SEX', SEXES), ('AGE_GROUP', AGE_GROUPS)))
+
+
+def geoid_range(column, layout):
+    '''
+    SQL condition on COLUMN that keeps the rows in the GEOID range of
+    LAYOUT, so a layout of one block of counties only reads that block
+    '''
+    return f"{column} BETWEEN '{layout.geoids[0]}' AND '{layout.geoids[-1]}'"
+
+
+def cdc_county_mortality(layout):
+    '''
+    CDC mortality rates (per 100,000) by COUNTY, RACE, SEX, and AGE_GROUP,
+    as a LAYOUT-shaped array
+    '''
+    uri = f'sqlite:{CDC_DB}'
+    query = f'SELECT RACE, AGE_GROUP, SEX, COFIPS AS GEOID, MORTALITY AS MORTALITY_RATE_100K \
+              FROM mortality_2018_2022_county \
+              WHERE {geoid_range("COFIPS", layout)}'
+    df = pl.read_database_uri(query=query, uri=uri)
+
+    return layout.to_array(df, 'MORTALITY_RATE_100K', complete=True)
+
+
+def cdc_county_fertility(layout):
+    '''
+    CDC fertility rates (per 1,000 women) by COUNTY, RACE, and AGE_GROUP
+    (15-44), as a LAYOUT-shaped array; every other cell is 0
+    '''
+    uri = f'sqlite:{CDC_DB}'
+    query = f'SELECT COFIPS AS GEOID, RACE, AGE_GROUP, FERTILITY \
+              FROM fertility_2018_2022_county \
+              WHERE {geoid_range("COFIPS", layout)}'
+    df = pl.read_database_uri(query=query, uri=uri)
+    df = df.with_columns(pl.when(pl.col('RACE') == 'MULTI')
+                           .then(pl.lit('TWO_OR_MORE'))
+                           .otherwise(pl.col('RACE'))
+                           .alias('RACE'))
+    df = df.filter(pl.col('AGE_GROUP').is_in(FERTILITY_AGE_GROUPS))
+    df = df.with_columns(pl.lit('FEMALE').alias('SEX'))
+
+    return layout.to_array(df, 'FERTILITY')
+
+
+def acs_immigration_fractions(layout):
+    '''
+    County level age-race-ethnicity-sex proportions of national
+    immigration, as a county x immigration race x sex x age group array.
+    Counties outside of LAYOUT are dropped.
+    '''
+    uri = f'sqlite:{ACS_DB}'
+    query = f'SELECT * FROM acs_immigration_cohort_fractions_by_age_group_2006_2015 \
+              WHERE {geoid_range("GEOID", layout)}'
+    df = pl.read_database_uri(query=query, uri=uri)
+
+    dims = (('GEOID', layout.geoids), ('RACE', IMMIGRATION_RACES), ('SEX', SEXES), ('AGE_GROUP', AGE_GROUPS))
+    shape = tuple(len(labels) for _, labels in dims)
+
+    index = flat_index(df, dims)
+    keep = index.is_not_null()
+    fractions = np.bincount(index.filter(keep).to_numpy(),
+                            weights=df.get_column('COUNTY_FRACTION').filter(keep).cast(pl.Float64).to_numpy(),
+                            minlength=int(np.prod(shape)))
+
+    return fractions.reshape(shape)
+
+
+def census_mortality_multipliers():
+    '''
+    Census NP2023 mortality multipliers by YEAR, SEX and AGE_GROUP
+    '''
+    uri = f'sqlite:{CENSUS_DB}'
+    query = 'SELECT YEAR, AGE_GROUP, SEX, MORT_MULTIPLIER AS MORT_MULTIPLY \
+             FROM census_np2023_asmr'
+    df = pl.read_database_uri(query=query, uri=uri)
+
+    return YearCohortArray(df, 'MORT_MULTIPLY', dims=(('SEX', SEXES), ('AGE_GROUP', AGE_GROUPS)))
+
+
+def census_fertility_multipliers():
+    '''
+    Census NP2023 fertility multipliers by YEAR and AGE_GROUP
+    '''
+    uri = f'sqlite:{CENSUS_DB}'
+    query = 'SELECT YEAR, AGE_GROUP, TFR_MULTIPLIER AS FERT_MULT \
+             FROM census_np2023_asfr'
+    df = pl.read_database_uri(query=query, uri=uri)
+
+    return YearCohortArray(df, 'FERT_MULT', dims=(('AGE_GROUP', AGE_GROUPS),))
+
+class YearCohortArray():
+    '''
+    A multiplier (or count) table indexed by YEAR and one or more cohort
+    dimensions, held as a dense (years x cohort) array
+    '''
+    def __init__(self, df, value, dims):
+
+        self.dims = dims
+        self.first_year = df.get_column('YEAR').cast(pl.Int64).min()
+        self.last_year = df.get_column('YEAR').cast(pl.Int64).max()
+
+        shape = (self.last_year - self.first_year + 1,) + tuple(len(labels) for _, labels in dims)
+
+        index = (df.get_column('YEAR').cast(pl.Int64) - self.first_year) * int(np.prod(shape[1:])) + flat_index(df, dims)
+        assert index.null_count() == 0
+
+        index = index.to_numpy()
+        assert np.unique(index).shape[0] == index.shape[0] == np.prod(shape)
+
+        self.values = np.empty(int(np.prod(shape)))
+        self.values[index] = df.get_column(value).cast(pl.Float64).to_numpy()
+        self.values = self.values.reshape(shape)
+
+    @classmethod
+    def from_values(cls, first_year, values, dims=None):
+        '''
+        Wrap an existing (years x cohort) array
+        '''
+        arr = cls.__new__(cls)
+        arr.dims = dims
+        arr.first_year = first_year
+        arr.last_year = first_year + values.shape[0] - 1
+        arr.values = values
+
+        return arr
+
+    def __getitem__(self, year):
+        assert self.first_year <= year <= self.last_year, f'{year} is outside of {self.first_year}-{self.last_year}'
+
+        return self.values[year - self.first_year]
+
+
+class RateProvider():
+    '''
+    The source of the input rates of one product line, e.g. the Census NP2023
+    or Wittgenstein v3 projections. A Projector (see iclus_v3_projector) asks
+    its provider for a RateStore once the population layout is known, and
+    writes the value columns in OUTPUT_TABLES each year (see
+    iclus_v3_output). SCENARIO labels the output tables. A custom product
+    line subclasses RateProvider and RateStore.
+    '''
+    output_tables = None
+
+    def __init__(self, scenario):
+
+        self.scenario = scenario
+
+    def parameters(self):
+        '''
+        Parameters that identify a run of this provider, as a new dict
+        '''
+        return {'scenario': self.scenario}
+
+    def print_parameters(self):
+        '''
+        Print the parameters other than the scenario
+        '''
+        pass
+
+    def rate_store(self, layout):
+        '''
+        The RateStore of this provider for LAYOUT
+        '''
+        raise NotImplementedError
+
+
+class CountyRates():
+    '''
+    The rates of a set of counties: the CDC COUNTY_MORTALITY and
+    COUNTY_FERTILITY rates and the ACS IMMIGRATION_FRACTIONS, aligned to a
+    population layout, with the year x cohort MORT_MULTIPLIERS and
+    FERT_MULTIPLIERS that project them
+    '''
+    def __init__(self, county_mortality, county_fertility, immigration_fractions, mort_multipliers, fert_multipliers):
+
+        self.county_mortality = county_mortality
+        self.county_fertility = county_fertility
+        self.immigration_fractions = immigration_fractions
+        self.mort_multipliers = mort_multipliers
+        self.fert_multipliers = fert_multipliers
+
+    def county_immigration(self, national_immigrants):
+        '''
+        Allocate national net immigrants (immigration race x sex x age group,
+        with any leading axes, e.g. YEAR) to counties with the ACS fractions;
+        the result has the same leading axes followed by the population layout
+        '''
+        return np.einsum('...nsa,gnsa,nr->...grsa',
+                         national_immigrants,
+                         self.immigration_fractions,
+                         IMMIGRATION_RACE_MATRIX)
+
+    def get_county_immigrants(self, national_immigrants):
+        '''
+        County net immigrants for every year of a national immigration table,
+        computed in one pass
+        '''
+        values = self.county_immigration(national_immigrants.values)
+
+        return YearCohortArray.from_values(national_immigrants.first_year, values)
+
+    def mortality_rates(self, year, adjustment=0.0, scale=1.0):
+        '''
+        Projected mortality rates (deaths per person), using the multipliers
+        for YEAR. ADJUSTMENT may be an array with leading (scenario) axes, in
+        which case the rates get the same leading axes. SCALE multiplies
+        the adjusted rates (e.g. by county). Rates are capped at 1, so no
+        cohort loses more than all of its people.
+        '''
+        rates = (self.county_mortality * (1 + adjustment) * self.mort_multipliers[year]) / 100000.0
+
+        return np.minimum(rates * scale, 1)
+
+    def fertility_rates(self, year, adjustment=0.0):
+        '''
+        Projected fertility rates (births per woman), using the multipliers
+        for YEAR. ADJUSTMENT works just like it does for mortality_rates.
+        '''
+        return self.county_fertility * (1 + adjustment) * self.fert_multipliers[year] / 1000
+
+
+class RateStore(CountyRates):
+    '''
+    Loads the CDC county mortality and fertility rates and the ACS immigration
+    cohort fractions once. Subclasses add the projection-specific mortality
+    and fertility multipliers and national net immigration.
+    '''
+    def __init__(self, layout):
+
+        self.layout = layout
+
+        print("Loading input rate tables...", end='')
+
+        # county-level rates, aligned to the population layout, and year x
+        # cohort multipliers
+        super().__init__(cdc_county_mortality(layout),
+                         cdc_county_fertility(layout),
+                         acs_immigration_fractions(layout),
+                         self.get_mortality_multipliers(),
+                         self.get_fertility_multipliers())
+
+        # year x cohort national immigration, and year x county x race x sex
+        # x age group net immigration
+        self.national_immigrants = self.get_national_immigration()
+        self.county_immigrants = self.get_county_immigrants(self.national_immigrants)
+
+        print("finished!")
+
+    def get_mortality_multipliers(self):
+        raise NotImplementedError
+
+    def get_fertility_multipliers(self):
+        raise NotImplementedError
+
+    def get_national_immigration(self):
+        raise NotImplementedError
+
+
+class CensusRateStore(RateStore):
+    '''
+    Multipliers and immigration from the 2023 vintage Census projections
+    '''
+    def __init__(self, layout, scenario, census_imm_hist2324):
+
+        self.scenario = scenario
+        self.census_imm_hist2324 = census_imm_hist2324
+
+        super().__init__(layout)
+
+    def get_mortality_multipliers(self):
+        return census_mortality_multipliers()
+
+    def get_fertility_multipliers(self):
+        return census_fertility_multipliers()
+
+    def get_national_immigration(self):
+        return census_national_immigration(self.scenario, self.census_imm_hist2324)
+
+
+class WittgensteinRateStore(RateStore):
+    '''
+    Multipliers and immigration from the Wittgenstein v3 projections
+    '''
+    def __init__(self, layout, scenario):
+
+        self.scenario = scenario
+
+        super().__init__(layout)
+
+    def get_mortality_multipliers(self):
+        uri = f'sqlite:{WITT_DB}'
+        query = f'SELECT YEAR, AGE_GROUP, SEX, MORT_CHANGE_MULT AS MORT_MULTIPLY \
+                  FROM age_specific_mortality_v3 \
+                  WHERE SCENARIO = "{self.scenario}"'
+        df = pl.read_database_uri(query=query, uri=uri)
+
+        return YearCohortArray(df, 'MORT_MULTIPLY', dims=(('SEX', SEXES), ('AGE_GROUP', AGE_GROUPS)))
+
+    def get_fertility_multipliers(self):
+        uri = f'sqlite:{WITT_DB}'
+        query = f'SELECT YEAR, AGE_GROUP, FERT_CHANGE_MULT AS FERT_MULT \
+                  FROM age_specific_fertility_v3 \
+                  WHERE SCENARIO = "{self.scenario}"'
+        df = pl.read_database_uri(query=query, uri=uri)
+
+        return YearCohortArray(df, 'FERT_MULT', dims=(('AGE_GROUP', AGE_GROUPS),))
+
+    def get_national_immigration(self):
+        # Wittgenstein net immigrants for each age-sex combination
+        uri = f'sqlite:{WITT_DB}'
+        query = f'SELECT YEAR, AGE_GROUP, SEX, NETMIG_INTERP_COHORT AS NET \
+                  FROM age_specific_net_migration_v3 \
+                  WHERE SCENARIO = "{self.scenario}"'
+        witt = pl.read_database_uri(query=query, uri=uri)
+
+        # the projected annual Census age-race-sex proportions are used to
+        # allocate one year of total net immigration across all age-race-sex
+        # combinations
+        if self.scenario == 'SSP5':
+            ratio = 'high'
+        elif self.scenario in ('SSP1', 'SSP2', 'SSP4'):
+            ratio = 'mid'
+        elif self.scenario == 'SSP3':
+            ratio = 'low'
+        else:
+            raise Exception
+        uri = f'sqlite:{CENSUS_DB}'
+        query = f'SELECT * FROM annual_immigration_fraction_{ratio}'
+        df = pl.read_database_uri(query=query, uri=uri)
+
+        # only keep the years covered by both tables
+        df = df.with_columns(pl.col('YEAR').cast(pl.Int64))
+        witt = witt.with_columns(pl.col('YEAR').cast(pl.Int64))
+        df = df.join(other=witt,
+                     on=['YEAR', 'SEX', 'AGE_GROUP'],
+                     how='inner',
+                     coalesce=True)
+        df = df.with_columns([(pl.col(race) * pl.col('NET')).alias(race) for race in IMMIGRATION_RACES])
+        df = df.drop('NET')
+        df = df.unpivot(index=['YEAR', 'AGE_GROUP', 'SEX'], variable_name='RACE', value_name='NET_IMMIGRATION')
+
+        return YearCohortArray(df, 'NET_IMMIGRATION', dims=(('RACE', IMMIGRATION_RACES), ('SEX', SEXES), ('AGE_GROUP', AGE_GROUPS)))
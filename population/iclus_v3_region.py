@@ -0,0 +1,120 @@
+'''
+Regional subset runs of the ICLUS v3 Census projector.
+
+A subset run projects only the counties of a REGION, a list of state FIPS
+codes and/or county GEOIDs, e.g. ['06'] or ['06', '41', '53001']. Domestic
+migration is modeled between the region's own counties only, so the county to
+county table shrinks from every pair of counties in the country to the
+region's pairs. Migration to and from the rest of the country comes from a
+boundary flow table instead: the gross flows across the region's boundary, by
+county, race and age group, from one year of the national migration model on
+the launch population. The boundary flows are held fixed for every projection
+year.
+
+The boundary flows only depend on the region, so they can be computed once,
+together with the region's county to county table, and passed to every later
+run of the same region (see write_region_inputs()); those runs then never
+touch the national table.
+
+Subset runs are meant for development and testing. The gravity model's
+intervening opportunities and competing migrants only see the region's
+counties, so a subset run does not reproduce the national run's numbers for
+the same counties.
+'''
+import polars as pl
+
+from iclus_v3_dense import CohortLayout
+from iclus_v3_dimensions import RACES, recode
+from iclus_v3_migration import PopulationView, migration_plum_v3 as MigrationModel
+
+
+def region_geoids(geoids, region):
+    '''
+    The GEOIDs in GEOIDS that are in REGION, either because their state
+    (the first two digits) or the county itself is listed
+    '''
+    region = set(region)
+    selected = sorted(geoid for geoid in geoids if geoid in region or geoid[:2] in region)
+    assert selected, f'No counties found for the region {sorted(region)}'
+
+    return selected
+
+
+def restrict_distance(distance, geoids):
+    '''
+    Only the county to county pairs with both counties in GEOIDS
+    '''
+    return distance.filter(pl.col('ORIGIN_FIPS').is_in(geoids) & pl.col('DESTINATION_FIPS').is_in(geoids))
+
+
+def boundary_flows(population, region, distance=None):
+    '''
+    Gross migration into (INFLOWS) and out of (OUTFLOWS) each county of
+    REGION from and to the rest of the country, by GEOID, RACE and
+    AGE_GROUP, for one year of the national migration model on POPULATION
+    (a national population DataFrame). DISTANCE is an optional, already
+    prepared national distance table (see iclus_v3_migration).
+    '''
+    geoids = region_geoids(population.get_column('GEOID').unique().to_list(), region)
+
+    layout = CohortLayout.from_frame(population)
+    migration_model = MigrationModel(distance=distance)
+    migration_model.set_population(PopulationView(layout.to_array(population, 'POPULATION', complete=True), layout))
+
+    flows = []
+    for race in RACES:
+        print(f"Calculating boundary flows for {race}...")
+        gross_flows = migration_model.compute_migrants(race)
+
+        origin_in = pl.col('ORIGIN_FIPS').is_in(geoids)
+        destination_in = pl.col('DESTINATION_FIPS').is_in(geoids)
+
+        inflows = (gross_flows.filter(~origin_in & destination_in)
+                   .group_by(['DESTINATION_FIPS', 'AGE_GROUP'])
+                   .agg(pl.col('MIGRATION').sum().alias('INFLOWS'))
+                   .rename({'DESTINATION_FIPS': 'GEOID'}))
+        outflows = (gross_flows.filter(origin_in & ~destination_in)
+                    .group_by(['ORIGIN_FIPS', 'AGE_GROUP'])
+                    .agg(pl.col('MIGRATION').sum().alias('OUTFLOWS'))
+                    .rename({'ORIGIN_FIPS': 'GEOID'}))
+
+        df = (inflows.join(outflows, on=['GEOID', 'AGE_GROUP'], how='full', coalesce=True)
+              .fill_null(0)
+              .with_columns(pl.lit(race).alias('RACE')))
+        flows.append(df.select(['GEOID', 'RACE', 'AGE_GROUP', 'INFLOWS', 'OUTFLOWS']))
+
+    return pl.concat(flows).sort(['GEOID', 'RACE', 'AGE_GROUP'])
+
+
+def write_region_inputs(region, population, boundary_inputs, migration_inputs, distance=None):
+    '''
+    Compute the boundary flows of REGION (see boundary_flows()) and the
+    county to county table of its pairs once, and write them to the Arrow IPC
+    files BOUNDARY_INPUTS and MIGRATION_INPUTS that later runs of the region
+    are given, e.g.
+
+    write_region_inputs(['06'], set_launch_population(), 'boundary_06.arrow', 'distance_06.arrow')
+    '''
+    if distance is None:
+        distance = MigrationModel().distance
+    geoids = region_geoids(population.get_column('GEOID').unique().to_list(), region)
+
+    boundary_flows(population, region, distance).write_ipc(boundary_inputs, compression='uncompressed')
+    restrict_distance(distance, geoids).write_ipc(migration_inputs, compression='uncompressed')
+
+
+def read_boundary_flows(path):
+    return pl.read_ipc(path, memory_map=True)
+
+
+def with_boundary_flows(flows, boundary, fips, column):
+    '''
+    Add one side (COLUMN, INFLOWS or OUTFLOWS) of the boundary flows of one
+    race to gross migration FLOWS that are aggregated by FIPS and AGE_GROUP
+    '''
+    boundary = boundary.select(recode('GEOID', flows.schema[fips], boundary.schema['GEOID']).alias(fips),
+                               pl.col('AGE_GROUP').cast(flows.schema['AGE_GROUP']),
+                               pl.col(column).cast(pl.Float64).alias('MIGRATION'))
+    flows = flows.with_columns(pl.col('MIGRATION').cast(pl.Float64))
+
+    return pl.concat([flows, boundary]).group_by([fips, 'AGE_GROUP']).agg(pl.col('MIGRATION').sum())
@@ -0,0 +1,54 @@
+'''
+A small task scheduler for the ICLUS v3 projectors.
+
+Within a projection year several pieces of work do not depend on each other,
+e.g. the year's mortality and fertility rates, the county immigration
+allocation and domestic migration for each race (or for each member of a
+batch). Each of these is submitted as a task, which starts on a thread pool
+right away. Polars and NumPy release the GIL for the heavy lifting, so the
+tasks genuinely overlap. Output writes are not tasks; they are queued to the
+BackgroundWriter (see iclus_v3_output), which writes them on its own thread.
+
+The projectors still apply every result to the population in the same order
+as before, by waiting on the task that produces it, so outputs do not change.
+With one worker every task runs immediately, in the calling thread.
+'''
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class Scheduler():
+    '''
+    Runs tasks on a pool of WORKERS threads
+    '''
+    def __init__(self, workers=1):
+
+        assert workers >= 1
+        self.workers = workers
+        self.executor = None
+        if workers > 1:
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='iclus')
+
+    def submit(self, func, *args, **kwargs):
+        '''
+        Run FUNC(*ARGS, **KWARGS); returns a future for its result
+        '''
+        if self.executor is not None:
+            return self.executor.submit(func, *args, **kwargs)
+
+        future = Future()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as error:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+        return future
+
+    def close(self):
+        '''
+        Wait for every running task and stop the worker threads
+        '''
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
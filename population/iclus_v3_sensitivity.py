@@ -0,0 +1,146 @@
+'''
+Sensitivity of the Census county projections to their parameters.
+
+A base run and one perturbed run per parameter are projected together, in a
+single batch (see CountyTotalsProjector), so they share the input rate
+tables and the prepared migration model and the cost of each extra parameter
+is that of one more member of the batch rather than of a full run. Each
+perturbed run raises one set of rates by STEP (1% by default):
+
+    fertility    fertility rates, through the CDC fertility adjustment
+    mortality    mortality rates, through the CDC mortality adjustment
+    immigration  county net immigration
+
+The elasticity of each county's population to a parameter is
+
+    ((P_perturbed - P_base) / P_base) / STEP
+
+written for every county and year to the "sensitivity_elasticities" table,
+next to the base population. Populations are rounded to whole people every
+year, so the elasticities of very small counties are noisy.
+'''
+import os
+import time
+
+import numpy as np
+import polars as pl
+
+from iclus_v3_config import OUTPUT_FOLDER, TIME_STAMP
+from iclus_v3_ensemble import CountyTotalsProjector
+
+
+OUTPUT_DATABASE = os.path.join(OUTPUT_FOLDER, f'iclus_v3_sensitivity_{TIME_STAMP}.sqlite')
+
+PARAMETERS = ('fertility', 'mortality', 'immigration')
+
+STEP = 0.01
+
+
+def perturbed(scenario, cdc_fert_adj, cdc_mort_adj, parameter, step):
+    '''
+    The (scenario, cdc_fert_adj, cdc_mort_adj) of the run with PARAMETER
+    raised by STEP; immigration is scaled separately
+    '''
+    if parameter == 'fertility':
+        cdc_fert_adj = (1 + cdc_fert_adj) * (1 + step) - 1
+    elif parameter == 'mortality':
+        cdc_mort_adj = (1 + cdc_mort_adj) * (1 + step) - 1
+    else:
+        assert parameter == 'immigration'
+
+    return (scenario, cdc_fert_adj, cdc_mort_adj)
+
+
+class SensitivityProjector(CountyTotalsProjector):
+    '''
+    Projects the base run (SCENARIO, CDC_FERT_ADJ, CDC_MORT_ADJ) and one run
+    per parameter in PARAMETERS raised by STEP, and writes the elasticities
+    of every county's population to OUTPUT_DATABASE
+    '''
+    def __init__(self, scenario, cdc_fert_adj, cdc_mort_adj, census_imm_hist2324,
+                 parameters=PARAMETERS, step=STEP, output_database=None, workers=1, validation='cheap',
+                 validation_sample=None):
+
+        self.parameters = parameters
+        self.step = step
+
+        scenarios = [(scenario, cdc_fert_adj, cdc_mort_adj)]
+        scenarios += [perturbed(scenario, cdc_fert_adj, cdc_mort_adj, parameter, step) for parameter in parameters]
+
+        super().__init__(scenarios,
+                         census_imm_hist2324,
+                         OUTPUT_DATABASE if output_database is None else output_database,
+                         workers=workers,
+                         validation=validation,
+                         validation_sample=validation_sample)
+
+        for member, label in zip(self.members, ('base',) + tuple(parameters)):
+            member.label = label
+        if 'immigration' in parameters:
+            self.immigration_scale[1 + parameters.index('immigration')] = 1 + step
+
+    def start(self):
+        '''
+        Prepare the migration model and record the runs
+        '''
+        super().start()
+
+        df = pl.DataFrame({'LABEL': [m.label for m in self.members],
+                           'SCENARIO': [m.scenario for m in self.members],
+                           'CDC_FERT_ADJ': [m.cdc_fert_adj for m in self.members],
+                           'CDC_MORT_ADJ': [m.cdc_mort_adj for m in self.members],
+                           'CENSUS_IMM_HIST2324': [m.census_imm_hist2324 for m in self.members],
+                           'IMMIGRATION_SCALE': self.immigration_scale.ravel(),
+                           'STEP': [self.step] * len(self.members)})
+        self.write('sensitivity_runs', df, replace=True)
+        self.write('sensitivity_elasticities', pl.DataFrame(schema=self.elasticity_schema()), replace=True)
+
+    def elasticity_schema(self):
+        schema = {'YEAR': pl.Int64, 'GEOID': pl.String, 'POPULATION': pl.Float64}
+        schema.update({parameter.upper(): pl.Float64 for parameter in self.parameters})
+
+        return schema
+
+    def save_totals(self, totals):
+        '''
+        Write the elasticities of every county's population for the current
+        projection year
+        '''
+        population = totals['population']
+        base = population[0]
+
+        df = pl.DataFrame({'YEAR': self.current_projection_year,
+                           'GEOID': self.layout.geoids,
+                           'POPULATION': base})
+        # counties without population have no elasticity
+        with np.errstate(invalid='ignore', divide='ignore'):
+            elasticities = np.where(base > 0, ((population[1:] - base) / base) / self.step, np.nan)
+        df = df.with_columns([pl.Series(name=parameter.upper(), values=elasticity).fill_nan(None)
+                              for parameter, elasticity in zip(self.parameters, elasticities)])
+
+        self.write('sensitivity_elasticities', df.cast(self.elasticity_schema()))
+
+
+def main(scenario, cdc_fert_adj, cdc_mort_adj, census_imm_hist2324, step=STEP, workers=1,
+         final_projection_year=2099, validation='cheap', validation_sample=None):
+    '''
+    Elasticities of every county's population around one Census run
+    '''
+    model = SensitivityProjector(scenario=scenario,
+                                 cdc_fert_adj=cdc_fert_adj,
+                                 cdc_mort_adj=cdc_mort_adj,
+                                 census_imm_hist2324=census_imm_hist2324,
+                                 step=step,
+                                 workers=workers,
+                                 validation=validation,
+                                 validation_sample=validation_sample)
+    model.run(final_projection_year)
+
+
+if __name__ == '__main__':
+    print(time.ctime())
+    main(scenario='hi',
+         cdc_fert_adj=-0.055,
+         cdc_mort_adj=-0.15,
+         census_imm_hist2324=False)
+    print(time.ctime())
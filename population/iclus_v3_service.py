@@ -0,0 +1,304 @@
+'''
+Warm projection service for interactive what-if runs of the Census
+projection.
+
+Most of the time of a short projection goes into starting it: the launch
+population, the rate tables, the county to county table and the migration
+model's county pairs. The service prepares all of them once and keeps them
+in memory, then answers runs over HTTP on localhost. A run is requested by
+POSTing a parameter document (JSON) to /project, e.g.
+
+    {"scenario": "hi",
+     "cdc_fert_adj": -0.055,
+     "cdc_mort_adj": -0.15,
+     "final_projection_year": 2040,
+     "fertility": {"06": 0.97},
+     "level": "state"}
+
+for fertility 3% lower in California. FERTILITY, MORTALITY and IMMIGRATION
+scale the rates (or county net immigration) of the states (two digit FIPS
+codes) and counties (GEOIDs) they list; a county listed itself takes
+precedence over its state. Scaled mortality rates are capped at 1. LEVEL
+is 'county' (the default), 'state' or 'national'.
+
+The response is streamed as JSON lines: first the labels of the rows of
+every array ({"labels": [...]}), then one line per projection year, as soon
+as the year is projected, with the totals of the population and of each
+component ({"year": 2021, "population": [...], "deaths": [...], ...}). An
+invalid document gets a 400 response with {"error": ...}.
+
+Runs use the year step of the 'dense' engine (deaths_and_immigration() and
+migration_births_and_aging()) and the NumPy form of the migration model
+(dense_migration_plum_v3); nothing is written to disk. Requests are
+answered on their own threads and only read the resident inputs. request()
+is a small client for the service.
+'''
+import json
+import threading
+import time
+import urllib.request
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from iclus_v3_dense import CohortLayout, YearRates, deaths_and_immigration, migration_births_and_aging
+from iclus_v3_migration import dense_migration_plum_v3 as DenseMigrationModel, migration_plum_v3 as MigrationModel
+from iclus_v3_projector import set_launch_population
+from iclus_v3_rates import CensusRateStore, census_national_immigration
+from iclus_v3_validation import Validator, county_totals
+
+
+HOST = '127.0.0.1'
+PORT = 8764
+
+SCENARIOS = ('hi', 'mid', 'low')
+LEVELS = ('county', 'state', 'national')
+SCALES = ('fertility', 'mortality', 'immigration')
+
+LAUNCH_YEAR = 2020
+LAST_YEAR = 2099
+
+# parameter document defaults
+DEFAULTS = {'scenario': 'hi',
+            'cdc_fert_adj': 0.0,
+            'cdc_mort_adj': 0.0,
+            'census_imm_hist2324': False,
+            'final_projection_year': LAST_YEAR,
+            'level': 'county',
+            'fertility': {},
+            'mortality': {},
+            'immigration': {}}
+
+
+class WarmInputs():
+    '''
+    Everything a Census projection reads that does not depend on its
+    parameters, prepared once: the launch population, the rate tables and
+    the migration model. County net immigration is computed the first time
+    each (scenario, census_imm_hist2324) is asked for and kept.
+    '''
+    def __init__(self):
+
+        launch_pop = set_launch_population()
+        self.layout = CohortLayout.from_frame(launch_pop)
+        self.launch = self.layout.to_array(launch_pop, 'POPULATION', complete=True)
+
+        self.rates = CensusRateStore(self.layout, 'hi', False)
+        self.county_immigrants = {('hi', False): self.rates.county_immigrants}
+        self.lock = threading.Lock()
+
+        print("Preparing the migration model...", end='')
+        migration_model = MigrationModel()
+        self.coefs = migration_model.coefs
+        self.migration_model = DenseMigrationModel(self.layout, self.layout.dimensions.encode(migration_model.distance))
+        print("finished!")
+
+        self.states, self.state_index = np.unique([geoid[:2] for geoid in self.layout.geoids], return_inverse=True)
+
+        # runs are not balanced; the validator only clips and rounds, and
+        # is shared by every request
+        self.validator = Validator(self.layout, 'off')
+
+    def immigrants(self, scenario, census_imm_hist2324):
+        '''
+        County net immigrants of every year for SCENARIO
+        '''
+        key = (scenario, census_imm_hist2324)
+        with self.lock:
+            if key not in self.county_immigrants:
+                national = census_national_immigration(scenario, census_imm_hist2324)
+                self.county_immigrants[key] = self.rates.get_county_immigrants(national)
+
+            return self.county_immigrants[key]
+
+    def county_scale(self, factors):
+        '''
+        Multiplier of every county, broadcastable to the population layout,
+        given FACTORS, {state FIPS or GEOID: multiplier}; raises ValueError
+        for an unknown state or county or a negative multiplier
+        '''
+        scale = np.ones(len(self.layout.geoids))
+        geoids = np.array(self.layout.geoids)
+        states = np.array([geoid[:2] for geoid in self.layout.geoids])
+        for key in sorted(factors, key=len):
+            selected = (geoids == key) if len(key) == 5 else (states == key)
+            if len(key) not in (2, 5) or not selected.any():
+                raise ValueError(f'Unknown state or county {key!r}')
+            multiplier = factors[key]
+            if not isinstance(multiplier, (int, float)) or isinstance(multiplier, bool) or multiplier < 0:
+                raise ValueError(f'The multiplier of {key} must be a number that is not negative')
+            scale[selected] = float(multiplier)
+
+        return scale.reshape(-1, 1, 1, 1)
+
+    def labels(self, level):
+        if level == 'county':
+            return list(self.layout.geoids)
+        if level == 'state':
+            return self.states.tolist()
+        return ['US']
+
+    def totals(self, arr, level):
+        '''
+        Totals of a population-shaped (or births-shaped) array at LEVEL
+        '''
+        totals = county_totals(arr)
+        if level == 'state':
+            totals = np.bincount(self.state_index, weights=totals)
+        elif level == 'national':
+            totals = np.array([totals.sum()])
+
+        return totals.tolist()
+
+
+def parse_document(document, inputs):
+    '''
+    The parameters of a run, from a parameter DOCUMENT with defaults filled
+    in and the multipliers turned into county multipliers of the resident
+    INPUTS; raises ValueError for an invalid document
+    '''
+    if not isinstance(document, dict):
+        raise ValueError('The parameter document must be a JSON object')
+    unknown = set(document) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f'Unknown parameters: {", ".join(sorted(unknown))}')
+
+    parameters = dict(DEFAULTS)
+    parameters.update(document)
+
+    # everything is checked here, since a run fails only after its 200
+    # response has started
+    if parameters['scenario'] not in SCENARIOS:
+        raise ValueError(f'scenario must be one of {", ".join(SCENARIOS)}')
+    if parameters['level'] not in LEVELS:
+        raise ValueError(f'level must be one of {", ".join(LEVELS)}')
+    if not isinstance(parameters['census_imm_hist2324'], bool):
+        raise ValueError('census_imm_hist2324 must be true or false')
+    for name in ('cdc_fert_adj', 'cdc_mort_adj'):
+        if not isinstance(parameters[name], (int, float)) or isinstance(parameters[name], bool):
+            raise ValueError(f'{name} must be a number')
+    year = parameters['final_projection_year']
+    if not isinstance(year, int) or isinstance(year, bool) or not LAUNCH_YEAR < year <= LAST_YEAR:
+        raise ValueError(f'final_projection_year must be a year in {LAUNCH_YEAR + 1}-{LAST_YEAR}')
+    for name in SCALES:
+        if not isinstance(parameters[name], dict):
+            raise ValueError(f'{name} must map states or counties to multipliers')
+        parameters[name] = inputs.county_scale(parameters[name])
+
+    return parameters
+
+
+def project(inputs, parameters):
+    '''
+    Project the run described by PARAMETERS (from parse_document()) from the
+    resident INPUTS, yielding the totals of each projection year as it is
+    projected
+    '''
+    level = parameters['level']
+    fertility_scale = parameters['fertility']
+    mortality_scale = parameters['mortality']
+    immigration_scale = parameters['immigration']
+    county_immigrants = inputs.immigrants(parameters['scenario'], parameters['census_imm_hist2324'])
+
+    pop = inputs.launch.copy()
+    for year in range(LAUNCH_YEAR + 1, parameters['final_projection_year'] + 1):
+        rates = YearRates(inputs.rates.mortality_rates(year - 1, parameters['cdc_mort_adj'], mortality_scale),
+                          inputs.rates.fertility_rates(year - 1, parameters['cdc_fert_adj']) * fertility_scale)
+
+        immigrants = county_immigrants[year] * immigration_scale
+        deaths = deaths_and_immigration(pop, rates, immigrants, inputs.validator)
+
+        inflows, outflows = inputs.migration_model.migrate(pop, inputs.coefs)
+        net_migration = inflows - outflows
+        births = migration_births_and_aging(pop, net_migration, rates, inputs.validator)
+
+        yield {'year': year,
+               'population': inputs.totals(pop, level),
+               'deaths': inputs.totals(deaths, level),
+               'immigration': inputs.totals(immigrants, level),
+               'migration': inputs.totals(net_migration, level),
+               'births': inputs.totals(births, level)}
+
+
+class ProjectionHandler(BaseHTTPRequestHandler):
+    '''
+    Answers POST /project with a streamed run and GET /status with the
+    resident inputs
+    '''
+    inputs = None
+
+    def do_GET(self):
+        if self.path != '/status':
+            self.send_json(404, {'error': f'Unknown path {self.path}'})
+            return
+
+        self.send_json(200, {'counties': len(self.inputs.layout.geoids),
+                             'scenarios': list(SCENARIOS),
+                             'immigration_cached': [list(key) for key in self.inputs.county_immigrants],
+                             'defaults': DEFAULTS})
+
+    def do_POST(self):
+        if self.path != '/project':
+            self.send_json(404, {'error': f'Unknown path {self.path}'})
+            return
+
+        try:
+            document = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            parameters = parse_document(document, self.inputs)
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+
+        t = time.time()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        self.write_line({'labels': self.inputs.labels(parameters['level'])})
+        for totals in project(self.inputs, parameters):
+            self.write_line(totals)
+        print(f"Projected {json.dumps(document)} in {time.time() - t:.1f}s")
+
+    def send_json(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.write_line(body)
+
+    def write_line(self, body):
+        self.wfile.write((json.dumps(body) + '\n').encode())
+        self.wfile.flush()
+
+
+def request(document, host=HOST, port=PORT):
+    '''
+    Run the parameter DOCUMENT on the service, yielding each line of the
+    response (the labels, then one projection year at a time) as it arrives
+    '''
+    req = urllib.request.Request(f'http://{host}:{port}/project',
+                                 data=json.dumps(document).encode(),
+                                 headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req) as response:
+        for line in response:
+            yield json.loads(line)
+
+
+def main(host=HOST, port=PORT):
+    '''
+    Prepare the inputs and serve runs until interrupted
+    '''
+    ProjectionHandler.inputs = WarmInputs()
+
+    server = ThreadingHTTPServer((host, port), ProjectionHandler)
+    print(f"Serving projections on http://{host}:{port}/project")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    print(time.ctime())
+    main()
@@ -0,0 +1,133 @@
+'''
+Comparison of the multi-year step mode of the Census projection with the
+annual step.
+
+A projection that takes 5-year steps (Projector.run(step=5), see
+Projector.run_steps()) advances whole cohorts one age group per step and
+evaluates the migration model once per step instead of once per year; the
+years within a step are interpolated. main() projects the same run both
+ways, on the 'dense' engine, and writes a report of how far the stepped
+projection is from the annual one to REPORT_DATABASE:
+
+    step_report_runs        run time and migration model evaluations of
+                            each run
+    step_report_years       national population of each year and the
+                            distribution of the county differences
+    step_report_age_groups  national population of each year by age group
+
+Differences are relative to the annual projection, in percent. The years
+that end a step (STEP_END) are projected; the others are interpolated.
+'''
+import math
+import os
+import time
+
+import numpy as np
+import polars as pl
+
+from iclus_v3_census import Projector
+from iclus_v3_config import OUTPUT_FOLDER, TIME_STAMP
+
+
+REPORT_DATABASE = os.path.join(OUTPUT_FOLDER, f'iclus_v3_steps_{TIME_STAMP}.sqlite')
+
+STEP = 5
+
+
+def difference_pct(annual, stepped):
+    '''
+    Difference of STEPPED from ANNUAL in percent of ANNUAL; NaN where ANNUAL
+    is 0
+    '''
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(annual > 0, (stepped - annual) / annual * 100.0, np.nan)
+
+
+def compare_steps(annual, stepped, step):
+    '''
+    The year and age group tables of the report, from the population time
+    series (CohortSeries) of the ANNUAL and the STEPPED projection of the
+    same run
+    '''
+    layout = annual.layout
+    first_year = annual.first_year
+
+    years = []
+    age_groups = []
+    for year in annual.years:
+        annual_pop = annual[year]
+        stepped_pop = stepped[year]
+
+        county_difference = np.abs(difference_pct(annual_pop.sum(axis=(1, 2, 3)), stepped_pop.sum(axis=(1, 2, 3))))
+        county_difference = county_difference[~np.isnan(county_difference)]
+        years.append({'YEAR': year,
+                      'STEP_END': bool((year - first_year + 1) % step == 0 or year == annual.years[-1]),
+                      'POPULATION_ANNUAL': float(annual_pop.sum()),
+                      'POPULATION_STEP': float(stepped_pop.sum()),
+                      'DIFFERENCE_PCT': float(difference_pct(annual_pop.sum(), stepped_pop.sum())),
+                      'COUNTY_MEAN_ABS_DIFFERENCE_PCT': float(county_difference.mean()),
+                      'COUNTY_P95_ABS_DIFFERENCE_PCT': float(np.percentile(county_difference, 95)),
+                      'COUNTY_MAX_ABS_DIFFERENCE_PCT': float(county_difference.max())})
+
+        annual_ages = annual_pop.sum(axis=(0, 1, 2))
+        stepped_ages = stepped_pop.sum(axis=(0, 1, 2))
+        age_groups.append(pl.DataFrame({'YEAR': year,
+                                        'AGE_GROUP': layout.age_groups,
+                                        'POPULATION_ANNUAL': annual_ages,
+                                        'POPULATION_STEP': stepped_ages,
+                                        'DIFFERENCE_PCT': difference_pct(annual_ages, stepped_ages)}))
+
+    return pl.DataFrame(years), pl.concat(age_groups).fill_nan(None)
+
+
+def write(report_database, table_name, df):
+    df.write_database(table_name=table_name,
+                      connection=f'sqlite:{report_database}',
+                      if_table_exists='replace',
+                      engine='adbc')
+
+
+def main(scenario, cdc_fert_adj, cdc_mort_adj, census_imm_hist2324, step=STEP, final_projection_year=2099,
+         report_database=None):
+    '''
+    Project one Census run with annual steps and with STEP-year steps, and
+    write the report comparing them
+    '''
+    report_database = REPORT_DATABASE if report_database is None else report_database
+    base = os.path.splitext(report_database)[0]
+
+    runs = []
+    models = {}
+    for run_step in (1, step):
+        model = Projector(scenario=scenario,
+                          cdc_fert_adj=cdc_fert_adj,
+                          cdc_mort_adj=cdc_mort_adj,
+                          census_imm_hist2324=census_imm_hist2324,
+                          engine='dense',
+                          output_database=f'{base}_step{run_step}.sqlite')
+        t = time.time()
+        model.run(final_projection_year, step=run_step)
+        runs.append({'STEP': run_step,
+                     'SECONDS': time.time() - t,
+                     'MIGRATION_EVALUATIONS': math.ceil((final_projection_year - model.launch_year) / run_step),
+                     'OUTPUT_DATABASE': model.output_database})
+        models[run_step] = model
+
+    runs = pl.DataFrame(runs)
+    years, age_groups = compare_steps(models[1].population_time_series, models[step].population_time_series, step)
+    write(report_database, 'step_report_runs', runs)
+    write(report_database, 'step_report_years', years)
+    write(report_database, 'step_report_age_groups', age_groups)
+
+    with pl.Config(tbl_rows=-1, tbl_cols=-1):
+        print(runs)
+        print(years.filter(pl.col('STEP_END')))
+
+
+if __name__ == '__main__':
+    print(time.ctime())
+    main(scenario='hi',
+         cdc_fert_adj=-0.055,
+         cdc_mort_adj=-0.15,
+         census_imm_hist2324=False)
+    print(time.ctime())
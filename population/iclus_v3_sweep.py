@@ -0,0 +1,72 @@
+'''
+Run several Census projections in parallel, one scenario per worker process.
+
+The static migration inputs (the 9.78M row county to county distance table,
+joined to the labor market and urban destination flags) are built once and
+written to an uncompressed Arrow IPC file. Every worker memory-maps that
+file, so all of the workers share a single copy of it through the operating
+system's page cache instead of each building and holding its own.
+'''
+import multiprocessing
+import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+import iclus_v3_census
+from iclus_v3_config import OUTPUT_FOLDER, TIME_STAMP
+from iclus_v3_migration import migration_plum_v3 as MigrationModel
+
+
+MIGRATION_INPUTS = os.path.join(OUTPUT_FOLDER, f'migration_inputs_{TIME_STAMP}.arrow')
+
+
+def run_scenario(kwargs):
+    '''
+    Worker entry point; runs one Census projection
+    '''
+    iclus_v3_census.main(**kwargs)
+
+    return kwargs['output_database']
+
+
+def main(scenarios, census_imm_hist2324, engine='frame', processes=None):
+    '''
+    Run each (scenario, cdc_fert_adj, cdc_mort_adj) tuple in SCENARIOS in its
+    own process, using at most PROCESSES workers (default: one per CPU). Each
+    scenario is written to its own output database; the list of databases is
+    returned in the same order as SCENARIOS.
+    '''
+    print("Preparing static migration inputs...", end='')
+    MigrationModel().write_distance(MIGRATION_INPUTS)
+    print("finished!")
+
+    jobs = []
+    for i, (scenario, cdc_fert_adj, cdc_mort_adj) in enumerate(scenarios):
+        output_database = os.path.join(OUTPUT_FOLDER, f'iclus_v3_census_{TIME_STAMP}_{scenario}_{i:02d}.sqlite')
+        jobs.append({'scenario': scenario,
+                     'cdc_fert_adj': cdc_fert_adj,
+                     'cdc_mort_adj': cdc_mort_adj,
+                     'census_imm_hist2324': census_imm_hist2324,
+                     'engine': engine,
+                     'output_database': output_database,
+                     'migration_inputs': MIGRATION_INPUTS})
+
+    # polars is not fork-safe, so workers are always spawned (this is also
+    # the only start method available on Windows)
+    try:
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn')) as executor:
+            output_databases = list(executor.map(run_scenario, jobs))
+    finally:
+        os.remove(MIGRATION_INPUTS)
+
+    return output_databases
+
+
+if __name__ == '__main__':
+    print(time.ctime())
+    main(scenarios=[(s, f, m) for s in ('hi', 'mid', 'low')
+                              for f in (-0.055, 0.0)
+                              for m in (-0.15, 0.0, 0.15)],
+         census_imm_hist2324=False,
+         engine='dense')
+    print(time.ctime())
@@ -0,0 +1,126 @@
+'''
+Per-phase timing and memory trace for the ICLUS v3 projectors.
+
+Every phase of a projection year (mortality, migration by race and age
+group, each output write, ...) is written as one JSON object per line:
+
+{"phase": "migration/race/age_group", "year": 2021, "race": "WHITE",
+ "age_group": "0-4", "rows": 9781256, "wall_s": 1.92, "cpu_s": 7.41,
+ "peak_rss_mb": 5230.4}
+
+Nested phases get a "/" separated path and inherit the year and tags of the
+phase they run inside of. Each thread has its own stack of running phases; a
+phase that runs on a worker thread names its enclosing phase with PARENT. Peak RSS comes from the resource module, or from
+psutil (if it is installed) on Windows; otherwise it is null.
+'''
+import json
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def peak_rss_mb():
+    '''
+    Peak resident set size of this process so far, in MB
+    '''
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, kilobytes everywhere else
+        if sys.platform == 'darwin':
+            return peak / 1024 ** 2
+        return peak / 1024
+
+    if psutil is not None:
+        memory = psutil.Process().memory_info()
+        return getattr(memory, 'peak_wset', memory.rss) / 1024 ** 2
+
+    return None
+
+
+class Tracer():
+    '''
+    Writes a JSONL trace to PATH; with no PATH phases are still timed, but
+    nothing is written
+    '''
+    def __init__(self, path=None):
+
+        self.path = path
+        self.file = None
+        if path is not None:
+            # appending lets a resumed run continue the same trace
+            self.file = open(path, 'a')
+
+        # records of the phases currently running in each thread, outermost
+        # first
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    @property
+    def stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def current(self):
+        '''
+        Record of the innermost phase running in this thread, or None
+        '''
+        return self.stack[-1] if self.stack else None
+
+    @contextmanager
+    def phase(self, name, year=None, rows=None, parent=None, **tags):
+        '''
+        Time the body of a with block as one phase. The record is yielded so
+        that the body can fill in values that are only known at the end,
+        e.g. record['rows'].
+        '''
+        if parent is None:
+            parent = self.current()
+        if parent is not None:
+            record = {'phase': f"{parent['phase']}/{name}"}
+            record.update({key: value for key, value in parent.items() if key not in ('phase', 'rows')})
+        else:
+            record = {'phase': name}
+        if year is not None:
+            record['year'] = year
+        record.update(tags)
+        record['rows'] = rows
+
+        self.stack.append(record)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield record
+        except BaseException:
+            record['failed'] = True
+            raise
+        finally:
+            self.stack.pop()
+            record['wall_s'] = round(time.perf_counter() - wall, 6)
+            record['cpu_s'] = round(time.process_time() - cpu, 6)
+            record['peak_rss_mb'] = peak_rss_mb()
+            self.write(record)
+
+    def write(self, record):
+        with self.lock:
+            if self.file is not None:
+                self.file.write(json.dumps(record) + '\n')
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
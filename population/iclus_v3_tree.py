@@ -0,0 +1,176 @@
+'''
+Run Census projections as a scenario tree.
+
+Historical immigration is used for 2021-2022 in every Census scenario (and
+for 2023-2024 as well with census_imm_hist2324), so runs that only differ in
+the Census scenario are identical for their first years. Runs can also be
+set up to change their fertility or mortality adjustment from a chosen year
+on. Instead of projecting every run from the launch year, the shared years
+are projected once: a child run branches off of its parent at the start of
+its branch year, with a copy of the parent's outputs so far and a
+checkpoint of the parent's population, and resumes from there (see
+Projector.branch).
+
+Every node of the tree is a complete run, written to its own output
+database.
+'''
+import os
+import time
+
+import numpy as np
+
+import iclus_v3_census
+from iclus_v3_config import OUTPUT_FOLDER, TIME_STAMP
+from iclus_v3_rates import census_national_immigration
+
+
+# the first projection year; a branch needs at least one projected year to
+# branch from
+FIRST_PROJECTION_YEAR = 2021
+
+
+class ScenarioNode():
+    '''
+    One run in a scenario tree. The root (BRANCH_YEAR None) is projected from
+    the launch year; every other node shares its parent's projection through
+    the year before BRANCH_YEAR and uses its own parameters from then on.
+    '''
+    def __init__(self, label, scenario, cdc_fert_adj, cdc_mort_adj, census_imm_hist2324, branch_year=None):
+
+        self.label = label
+        self.scenario = scenario
+        self.cdc_fert_adj = cdc_fert_adj
+        self.cdc_mort_adj = cdc_mort_adj
+        self.census_imm_hist2324 = census_imm_hist2324
+        self.branch_year = branch_year
+        self.children = []
+
+        self.output_database = os.path.join(OUTPUT_FOLDER, f'iclus_v3_census_{TIME_STAMP}_{label}.sqlite')
+
+    def branch(self, label, branch_year, **parameters):
+        '''
+        Add a child that branches off of this run in BRANCH_YEAR with some of
+        the parameters changed, e.g.
+
+        node.branch('hi_low_fert', 2030, cdc_fert_adj=-0.1)
+        '''
+        assert branch_year > (self.branch_year or FIRST_PROJECTION_YEAR)
+
+        kwargs = {'scenario': self.scenario,
+                  'cdc_fert_adj': self.cdc_fert_adj,
+                  'cdc_mort_adj': self.cdc_mort_adj,
+                  'census_imm_hist2324': self.census_imm_hist2324}
+        kwargs.update(parameters)
+
+        child = ScenarioNode(label, branch_year=branch_year, **kwargs)
+        self.children.append(child)
+
+        return child
+
+    def nodes(self):
+        '''
+        This node and every node below it, parents first
+        '''
+        yield self
+        for child in self.children:
+            yield from child.nodes()
+
+    def projector(self, engine):
+        resume_from = None if self.branch_year is None else self.output_database
+
+        return iclus_v3_census.Projector(scenario=self.scenario,
+                                         cdc_fert_adj=self.cdc_fert_adj,
+                                         cdc_mort_adj=self.cdc_mort_adj,
+                                         census_imm_hist2324=self.census_imm_hist2324,
+                                         engine=engine,
+                                         output_database=self.output_database,
+                                         resume_from=resume_from)
+
+
+def first_difference(a, b, final_projection_year):
+    '''
+    First projection year in which the national immigration A and B differ;
+    the year after FINAL_PROJECTION_YEAR if they never do
+    '''
+    for year in range(FIRST_PROJECTION_YEAR, final_projection_year + 1):
+        if not np.array_equal(a[year], b[year]):
+            return year
+
+    return final_projection_year + 1
+
+
+def from_scenarios(scenarios, census_imm_hist2324, final_projection_year=2099):
+    '''
+    Build scenario trees for a list of (scenario, cdc_fert_adj, cdc_mort_adj)
+    runs. A run branches off of the earlier run with the same adjustments
+    whose national immigration stays the same for the most years, in the
+    first year they differ; a run that shares no years with an earlier one
+    is the root of a new tree. Returns the list of roots.
+    '''
+    roots = []
+    national_immigration = {}
+    for i, (scenario, cdc_fert_adj, cdc_mort_adj) in enumerate(scenarios):
+        label = f'{scenario}_{i:02d}'
+
+        if scenario not in national_immigration:
+            national_immigration[scenario] = census_national_immigration(scenario, census_imm_hist2324)
+
+        parent = None
+        branch_year = FIRST_PROJECTION_YEAR
+        for root in roots:
+            if (root.cdc_fert_adj, root.cdc_mort_adj) != (cdc_fert_adj, cdc_mort_adj):
+                continue
+            year = first_difference(national_immigration[scenario], national_immigration[root.scenario], final_projection_year)
+            if year > branch_year:
+                parent, branch_year = root, year
+
+        if parent is None:
+            roots.append(ScenarioNode(label, scenario, cdc_fert_adj, cdc_mort_adj, census_imm_hist2324))
+        else:
+            # runs that never differ still get a run of their own, from the
+            # final year
+            parent.branch(label, min(branch_year, final_projection_year), scenario=scenario)
+
+    return roots
+
+
+def run_tree(root, engine='dense', final_projection_year=2099):
+    '''
+    Run every node of the tree under ROOT, each parent before its children;
+    returns {label: output_database}
+    '''
+    projectors = {root.label: root.projector(engine)}
+    for node in root.nodes():
+        for child in node.children:
+            assert child.branch_year <= final_projection_year
+            projectors[child.label] = child.projector(engine)
+            projectors[node.label].children.setdefault(child.branch_year, []).append(projectors[child.label])
+
+    output_databases = {}
+    for node in root.nodes():
+        projectors.pop(node.label).run(final_projection_year)
+        output_databases[node.label] = node.output_database
+
+    return output_databases
+
+
+def main(scenarios, census_imm_hist2324, engine='dense', final_projection_year=2099):
+    '''
+    Run each (scenario, cdc_fert_adj, cdc_mort_adj) tuple in SCENARIOS,
+    projecting the years they share only once; returns {label:
+    output_database}
+    '''
+    output_databases = {}
+    for root in from_scenarios(scenarios, census_imm_hist2324, final_projection_year):
+        output_databases.update(run_tree(root, engine, final_projection_year))
+
+    return output_databases
+
+
+if __name__ == '__main__':
+    print(time.ctime())
+    main(scenarios=[(s, f, m) for s in ('hi', 'mid', 'low')
+                              for f in (-0.055, 0.0)
+                              for m in (-0.15, 0.0, 0.15)],
+         census_imm_hist2324=True)
+    print(time.ctime())
@@ -0,0 +1,272 @@
+'''
+Tiered validation for the ICLUS v3 projectors.
+
+    'off'    no checks
+    'cheap'  every projection year, check the demographic balancing equation
+
+                 P(t+1) = P(t) - D + B + I + M
+
+             for every county, every state and the nation, from county totals
+             of the population and of each component
+    'full'   the cheap checks, plus the scans of every cell (no nulls, NaNs or
+             negative populations) after each component
+
+With 'cheap', the full scans can also be run on a sample of years: every year
+that is a multiple of SAMPLE_EVERY.
+
+Clipping negative populations to 0 and rounding to whole people also change
+the population, so the projectors apply both through the Validator, which
+measures them as adjustments. Clipping may only add population and rounding
+may only move each cell by half a person, so neither can hide a component
+that is lost or counted twice.
+'''
+import copy
+
+import numpy as np
+import polars as pl
+
+
+LEVELS = ('off', 'cheap', 'full')
+
+# sign of each component in the balancing equation
+COMPONENTS = {'deaths': -1,
+              'births': 1,
+              'immigration': 1,
+              'migration': 1}
+
+# relative tolerance for floating point error in the balance
+RTOL = 1e-9
+
+
+def county_totals(arr):
+    '''
+    Totals by GEOID of an array whose first axis is GEOID
+    '''
+    return arr.reshape(arr.shape[0], -1).sum(axis=1)
+
+
+class Validator():
+    '''
+    Balances each projection year of the population in LAYOUT at LEVEL.
+    Components are passed either as arrays with GEOID as the first axis or
+    as keyed DataFrames plus the name of the value column. block() gives a
+    Validator for the arrays of one block of counties.
+    '''
+    def __init__(self, layout, level='cheap', sample_every=None):
+
+        assert level in LEVELS
+        self.layout = layout
+        self.level = level
+        self.sample_every = sample_every
+
+        self.states, self.state_index = np.unique([geoid[:2] for geoid in layout.geoids], return_inverse=True)
+        self.cells_per_county = layout.size // len(layout.geoids)
+
+        # balance of the year being projected
+        self.year = None
+        self.population = None
+        self.components = None
+        self.adjustments = None
+        self.roundings = None
+
+        # counties that the arrays passed in cover (see block())
+        self.rows = slice(None)
+
+    @property
+    def enabled(self):
+        return self.level != 'off'
+
+    def full(self, year):
+        '''
+        Whether the full scans are run in YEAR
+        '''
+        if self.level == 'full':
+            return True
+        return self.level == 'cheap' and self.sample_every is not None and year % self.sample_every == 0
+
+    def totals(self, values, column=None):
+        if column is None:
+            return county_totals(values)
+        return self.layout.county_totals(values, column)
+
+    def start(self, year, population, column=None):
+        '''
+        Start balancing YEAR from the population at the start of the year
+        '''
+        if not self.enabled:
+            return
+
+        self.year = year
+        self.population = self.totals(population, column)
+        self.components = {name: np.zeros(len(self.layout.geoids)) for name in COMPONENTS}
+        self.adjustments = {'clip': np.zeros(len(self.layout.geoids)),
+                            'round': np.zeros(len(self.layout.geoids))}
+        self.roundings = np.zeros(len(self.layout.geoids))
+
+    def block(self, start, stop):
+        '''
+        A Validator for arrays of the counties START:STOP only, recording
+        into the balance of the year being projected; call after start()
+        '''
+        validator = copy.copy(self)
+        validator.rows = slice(start, stop)
+
+        return validator
+
+    def add(self, name, values, column=None):
+        '''
+        Add one component (as a positive amount; deaths are subtracted)
+        '''
+        if not self.enabled:
+            return
+
+        self.components[name][self.rows] += self.totals(values, column)
+
+    def scan(self, pop):
+        '''
+        Check that no cell of the population array POP is negative, in the
+        years the full scans are run
+        '''
+        if self.year is not None and self.full(self.year):
+            assert (pop >= 0).all(), f'{self.year}: negative population'
+
+    def clip(self, pop):
+        '''
+        Clip the population array POP at 0, in place
+        '''
+        before = county_totals(pop) if self.enabled else None
+        np.clip(pop, 0, None, out=pop)
+        if self.enabled:
+            self.adjustments['clip'][self.rows] += county_totals(pop) - before
+
+    def round(self, pop):
+        '''
+        Round the population array POP to whole people, in place
+        '''
+        before = county_totals(pop) if self.enabled else None
+        np.round(pop, out=pop)
+        if self.enabled:
+            self.adjustments['round'][self.rows] += county_totals(pop) - before
+            self.roundings[self.rows] += 1
+
+    def clip_frame(self, df):
+        '''
+        Clip the POPULATION column of DF at 0
+        '''
+        before = self.totals(df, 'POPULATION') if self.enabled else None
+        df = df.with_columns(pl.col('POPULATION').clip(lower_bound=0))
+        if self.enabled:
+            self.adjustments['clip'][self.rows] += self.totals(df, 'POPULATION') - before
+
+        return df
+
+    def round_frame(self, df, dtype=None):
+        '''
+        Round the POPULATION column of DF to whole people, casting it to
+        DTYPE if one is given
+        '''
+        before = self.totals(df, 'POPULATION') if self.enabled else None
+        population = pl.col('POPULATION').round(0)
+        if dtype is not None:
+            population = population.cast(dtype)
+        df = df.with_columns(population)
+        if self.enabled:
+            self.adjustments['round'][self.rows] += self.totals(df, 'POPULATION') - before
+            self.roundings[self.rows] += 1
+
+        return df
+
+    def adjust(self, name, df, before, after):
+        '''
+        Record a clip or round adjustment ('clip' or 'round') that was
+        applied inside a query plan, from the columns of DF with the
+        population BEFORE and AFTER it
+        '''
+        if not self.enabled:
+            return
+
+        self.adjust_totals(name, self.totals(df, before), self.totals(df, after))
+
+    def adjust_totals(self, name, before, after):
+        '''
+        Record a clip or round adjustment from the county totals of the
+        population BEFORE and AFTER it, e.g. summed over the blocks of an
+        out-of-core run
+        '''
+        if not self.enabled:
+            return
+
+        self.adjustments[name][self.rows] += after - before
+        if name == 'round':
+            self.roundings[self.rows] += 1
+
+    def balance(self, population, column=None):
+        '''
+        Check the balancing equation against the population at the end of
+        the year, for every county, every state and the nation
+        '''
+        if not self.enabled:
+            return
+
+        end = self.totals(population, column)
+        expected = self.population.copy()
+        scale = self.population + np.abs(end) + 1
+        for name, sign in COMPONENTS.items():
+            expected += sign * self.components[name]
+            scale += np.abs(self.components[name])
+
+        clipped = self.adjustments['clip']
+        rounded = self.adjustments['round']
+        assert (clipped >= -RTOL * scale).all(), f'{self.year}: clipping removed population'
+        assert (np.abs(rounded) <= 0.5 * self.cells_per_county * self.roundings + RTOL * scale).all(), \
+            f'{self.year}: rounding moved more than half a person per cell'
+
+        residual = end - (expected + clipped + rounded)
+        levels = (('county', np.array(self.layout.geoids), residual, scale),
+                  ('state', self.states, np.bincount(self.state_index, weights=residual), np.bincount(self.state_index, weights=scale)),
+                  ('national', np.array(['US']), np.array([residual.sum()]), np.array([scale.sum()])))
+        for level, names, level_residual, level_scale in levels:
+            bad = np.abs(level_residual) > RTOL * level_scale
+            assert not bad.any(), \
+                f'{self.year}: population does not balance for {level} {names[bad][0]} (off by {level_residual[bad][0]:,.3f})'
+
+
+class BatchValidator():
+    '''
+    The Validators of the members of a batch, each balancing its own member
+    of population arrays that have the member as the first axis
+    '''
+    def __init__(self, validators):
+
+        self.validators = validators
+
+    @property
+    def enabled(self):
+        return any(validator.enabled for validator in self.validators)
+
+    def full(self, year):
+        return any(validator.full(year) for validator in self.validators)
+
+    def start(self, year, population):
+        for validator, member_population in zip(self.validators, population):
+            validator.start(year, member_population)
+
+    def add(self, name, values):
+        for validator, member_values in zip(self.validators, values):
+            validator.add(name, member_values)
+
+    def scan(self, pop):
+        for validator, member_pop in zip(self.validators, pop):
+            validator.scan(member_pop)
+
+    def clip(self, pop):
+        for validator, member_pop in zip(self.validators, pop):
+            validator.clip(member_pop)
+
+    def round(self, pop):
+        for validator, member_pop in zip(self.validators, pop):
+            validator.round(member_pop)
+
+    def balance(self, population):
+        for validator, member_population in zip(self.validators, population):
+            validator.balance(member_population)
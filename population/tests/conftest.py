@@ -0,0 +1,226 @@
+'''
+Shared fixtures of the ICLUS v3 tests.
+
+The tests run on a small synthetic copy of the input databases (a dozen
+counties in four states), written to a temporary folder that
+ICLUS_V3_FOLDER points the modules at (see iclus_v3_config). The values are
+random but plausible; the tests only compare the engines with each other.
+'''
+import itertools
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+import numpy as np
+import polars as pl
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FOLDER = tempfile.mkdtemp(prefix='iclus_v3_tests_')
+
+
+def database_path(path):
+    '''
+    PATH in the form the modules' 'sqlite:' + path URIs expect: as is on
+    Windows; elsewhere with extra leading slashes, which both the connectorx
+    reader and the ADBC writer resolve to the same absolute path
+    '''
+    return path if os.name == 'nt' else '///' + path
+
+
+os.environ['ICLUS_V3_FOLDER'] = database_path(FOLDER)
+
+from iclus_v3_dimensions import AGE_GROUPS, RACES, SEXES  # noqa: E402
+
+STATES = ('01', '06', '41', '53')
+GEOIDS = tuple(f'{state}{county:03d}' for state in STATES for county in (1, 3, 5))
+IMMIGRATION_RACES = ('AIAN', 'ASIAN', 'BLACK', 'HISP_WHITE', 'NHPI', 'NH_WHITE', 'TWO_OR_MORE')
+FERTILITY_AGE_GROUPS = ('15-19', '20-24', '25-29', '30-34', '35-39', '40-44')
+YEARS = range(2005, 2101)
+
+LAUNCH_YEAR = 2020
+FINAL_YEAR = 2023
+
+# the Census run every test compares with
+SCENARIO = ('hi', -0.055, -0.15, False)
+
+# outputs, with the value columns of their long tables
+OUTPUTS = {'deaths': ('DEATHS',),
+           'immigration': ('NET_IMMIGRATION',),
+           'migration': ('INFLOWS', 'OUTFLOWS', 'NET_MIGRATION'),
+           'births': ('BIRTHS',),
+           'population': ('POPULATION',)}
+
+KEYS = ['YEAR', 'GEOID', 'RACE', 'SEX', 'AGE_GROUP']
+
+# migration model coefficients and their labels in the regression outputs
+COEFFICIENT_COLUMNS = ('count_.Intercept.', 'count_ln_Pi', 'count_ln_Pj', 'count_ln_Cij', 'count_ln_Tij',
+                       'count_ln_Pj_star', 'count_factor.SAME_LABOR_MARKET.1', 'count_factor.MICRODEST20.1',
+                       'count_factor.METRODEST20.1', 'zero_.Intercept.', 'zero_ln_Pi', 'zero_ln_Pj', 'zero_ln_Cij',
+                       'zero_ln_Tij', 'zero_ln_Pj_star', 'zero_factor.SAME_LABOR_MARKET.1',
+                       'zero_factor.MICRODEST20.1', 'zero_factor.METRODEST20.1')
+COEFFICIENTS = (-6.0, 0.7, 0.3, -0.05, -0.2, 0.01, 0.5, 0.1, 0.2, 1.0, -0.1, -0.05, 0.01, 0.02, 0.0, -0.3, 0.0, -0.1)
+COEFFICIENT_RACES = ('WHITE', 'BLACK', 'API', 'AIAN', 'OTHER')
+COEFFICIENT_AGE_GROUPS = tuple(age_group.replace('-', '_TO_') for age_group in AGE_GROUPS[1:-1]) + ('85_TO_115',)
+
+
+def write_table(database, table_name, rows, columns):
+    '''
+    Write ROWS (tuples of COLUMNS) to a new table of DATABASE
+    '''
+    df = pl.DataFrame(rows, schema=list(columns), orient='row')
+    types = {pl.Int64: 'INTEGER', pl.Float64: 'REAL', pl.String: 'TEXT'}
+    definition = ', '.join(f'"{column}" {types[dtype]}' for column, dtype in df.schema.items())
+
+    con = sqlite3.connect(database)
+    con.execute(f'CREATE TABLE "{table_name}" ({definition})')
+    con.executemany(f'INSERT INTO "{table_name}" VALUES ({", ".join("?" * df.width)})', df.rows())
+    con.commit()
+    con.close()
+
+
+def write_inputs(folder, seed=0):
+    '''
+    Write the synthetic input databases under FOLDER
+    '''
+    rng = np.random.default_rng(seed)
+    databases = os.path.join(folder, 'inputs', 'databases')
+    outputs = os.path.join(folder, 'outputs')
+    os.makedirs(databases)
+    os.makedirs(outputs)
+
+    def database(name):
+        return os.path.join(databases, f'{name}.sqlite')
+
+    cohorts = list(itertools.product(GEOIDS, AGE_GROUPS, RACES, SEXES))
+    county_size = dict(zip(GEOIDS, rng.lognormal(7, 1, len(GEOIDS))))
+    write_table(database('population'), 'county_population_ageracesex_2020',
+                [cohort + (int(rng.random() * county_size[cohort[0]]),) for cohort in cohorts],
+                ('GEOID', 'AGE_GROUP', 'RACE', 'SEX', 'POPULATION'))
+
+    # deaths per 100,000 by age group
+    deaths = dict(zip(AGE_GROUPS, (100, 15, 15, 50, 90, 110, 130, 160, 220, 330, 500, 800, 1200, 1800, 2800, 4500,
+                                   7500, 16000)))
+    write_table(database('cdc'), 'mortality_2018_2022_county',
+                [(race, age_group, sex, geoid, deaths[age_group] * rng.uniform(0.7, 1.3))
+                 for geoid, age_group, race, sex in cohorts],
+                ('RACE', 'AGE_GROUP', 'SEX', 'COFIPS', 'MORTALITY'))
+    write_table(database('cdc'), 'fertility_2018_2022_county',
+                [(geoid, 'MULTI' if race == 'TWO_OR_MORE' else race, age_group, rng.uniform(10, 110))
+                 for geoid, race, age_group in itertools.product(GEOIDS, RACES, FERTILITY_AGE_GROUPS)],
+                ('COFIPS', 'RACE', 'AGE_GROUP', 'FERTILITY'))
+
+    write_table(database('census'), 'census_np2023_asmr',
+                [(year, age_group, sex, 1 - (year - LAUNCH_YEAR) * 0.003)
+                 for year, age_group, sex in itertools.product(YEARS, AGE_GROUPS, SEXES)],
+                ('YEAR', 'AGE_GROUP', 'SEX', 'MORT_MULTIPLIER'))
+    write_table(database('census'), 'census_np2023_asfr',
+                [(year, age_group, 1 - (year - LAUNCH_YEAR) * 0.001)
+                 for year, age_group in itertools.product(YEARS, AGE_GROUPS)],
+                ('YEAR', 'AGE_GROUP', 'TFR_MULTIPLIER'))
+    for scenario, suffix in itertools.product(('hi', 'mid', 'low'), ('', '_with_historical2324')):
+        write_table(database('census'), f'census_np2023_asmig_{scenario}{suffix}',
+                    [(year, sex, age_group) + tuple(rng.uniform(-20, 400, len(IMMIGRATION_RACES)))
+                     for year, sex, age_group in itertools.product(YEARS, SEXES, AGE_GROUPS)],
+                    ('YEAR', 'SEX', 'AGE_GROUP') + IMMIGRATION_RACES)
+    for ratio in ('high', 'mid', 'low'):
+        fractions = rng.random((len(YEARS) * len(AGE_GROUPS) * len(SEXES), len(IMMIGRATION_RACES)))
+        fractions /= fractions.sum(axis=1, keepdims=True)
+        write_table(database('census'), f'annual_immigration_fraction_{ratio}',
+                    [key + tuple(row) for key, row in zip(itertools.product(YEARS, AGE_GROUPS, SEXES), fractions)],
+                    ('YEAR', 'AGE_GROUP', 'SEX') + IMMIGRATION_RACES)
+
+    # every county's share of each immigrant cohort
+    shares = rng.random((len(GEOIDS), len(IMMIGRATION_RACES) * len(AGE_GROUPS) * len(SEXES)))
+    shares /= shares.sum(axis=0)
+    write_table(database('acs'), 'acs_immigration_cohort_fractions_by_age_group_2006_2015',
+                [(geoid,) + cohort + (share,)
+                 for geoid, county_shares in zip(GEOIDS, shares)
+                 for cohort, share in zip(itertools.product(IMMIGRATION_RACES, AGE_GROUPS, SEXES), county_shares)],
+                ('GEOID', 'RACE', 'AGE_GROUP', 'SEX', 'COUNTY_FRACTION'))
+
+    write_table(database('migration'), 'fips_to_urb20_bea10_hhs',
+                [(geoid, int(geoid[:2]) * 10 + int(geoid[2:]) % 3, int(rng.integers(1, 4))) for geoid in GEOIDS],
+                ('COFIPS', 'BEA10', 'URBANDESTINATION20'))
+    xy = dict(zip(GEOIDS, rng.random((len(GEOIDS), 2)) * 3000))
+    write_table(database('analysis'), 'county_to_county_distance_2010',
+                [(origin, destination, float(np.hypot(*(xy[origin] - xy[destination]))) + 1)
+                 for origin, destination in itertools.permutations(GEOIDS, 2)],
+                ('ORIGIN_FIPS', 'DESTINATION_FIPS', 'Dij'))
+
+    coefficients = [(race, age_group) + tuple(COEFFICIENTS * rng.uniform(0.9, 1.1, len(COEFFICIENTS)))
+                    for race, age_group in itertools.product(COEFFICIENT_RACES, COEFFICIENT_AGE_GROUPS)]
+    regression_outputs = os.path.join(outputs, 'zinb_regression_outputs.sqlite')
+    write_table(regression_outputs, 'coefficients_Census_1990', coefficients,
+                ('RACE', 'AGE_GROUP') + COEFFICIENT_COLUMNS)
+    write_table(regression_outputs, 'significance_Census_1990',
+                [key[:2] + (0.01,) * len(COEFFICIENTS) + (1,) for key in coefficients],
+                ('RACE', 'AGE_GROUP') + COEFFICIENT_COLUMNS + ('CONVERGED',))
+
+
+def read_outputs(output_database, scenario='hi'):
+    '''
+    The long output tables of a run, {output: DataFrame} sorted by YEAR and
+    cohort
+    '''
+    con = sqlite3.connect(output_database)
+    outputs = {}
+    for name, values in OUTPUTS.items():
+        rows = con.execute(f'SELECT {", ".join(KEYS + list(values))} FROM {name}_by_race_sex_age_{scenario}_long').fetchall()
+        outputs[name] = pl.DataFrame(rows, schema=KEYS + list(values), orient='row').sort(KEYS)
+    con.close()
+
+    return outputs
+
+
+def assert_same_outputs(outputs, expected, years=None):
+    '''
+    Assert that two runs' outputs (see read_outputs()) have the same rows and
+    values for every year in YEARS (by default, every year of EXPECTED),
+    year by year
+    '''
+    for name, values in OUTPUTS.items():
+        years = sorted(expected[name].get_column('YEAR').unique()) if years is None else years
+        for year in years:
+            df = outputs[name].filter(pl.col('YEAR') == year)
+            expected_df = expected[name].filter(pl.col('YEAR') == year)
+            assert expected_df.height > 0
+            assert df.select(KEYS).equals(expected_df.select(KEYS)), f'{name} {year}: different rows'
+            for value in values:
+                np.testing.assert_allclose(df.get_column(value).to_numpy(), expected_df.get_column(value).to_numpy(),
+                                           rtol=1e-9, atol=1e-6, err_msg=f'{name} {year} {value}')
+
+
+@pytest.fixture(scope='session', autouse=True)
+def inputs():
+    '''
+    The synthetic inputs, written once for the session
+    '''
+    write_inputs(FOLDER)
+    yield FOLDER
+    shutil.rmtree(FOLDER, ignore_errors=True)
+
+
+@pytest.fixture
+def output_database(tmp_path):
+    '''
+    Path of a new output database
+    '''
+    return database_path(str(tmp_path / 'outputs.sqlite'))
+
+
+@pytest.fixture(scope='session')
+def expected(inputs, tmp_path_factory):
+    '''
+    Outputs of Projector.run with the 'frame' engine, the reference every
+    other engine is compared with
+    '''
+    import iclus_v3_census
+
+    output_database = database_path(str(tmp_path_factory.mktemp('expected') / 'outputs.sqlite'))
+    iclus_v3_census.Projector(*SCENARIO, engine='frame', output_database=output_database).run(FINAL_YEAR)
+
+    return read_outputs(output_database)
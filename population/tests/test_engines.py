@@ -0,0 +1,111 @@
+'''
+Every way of projecting a Census run matches Projector.run with the 'frame'
+engine, year by year, on the synthetic inputs (see conftest).
+'''
+import numpy as np
+import polars as pl
+import pytest
+
+import iclus_v3_census
+import iclus_v3_outofcore
+import iclus_v3_service
+import iclus_v3_tree
+
+from conftest import FINAL_YEAR, LAUNCH_YEAR, OUTPUTS, SCENARIO, STATES, assert_same_outputs, read_outputs
+
+
+@pytest.mark.parametrize('engine', ['frame', 'dense', 'leslie', 'lazy', 'streaming'])
+def test_engine(engine, output_database, expected):
+    iclus_v3_census.Projector(*SCENARIO, engine=engine, output_database=output_database).run(FINAL_YEAR)
+
+    assert_same_outputs(read_outputs(output_database), expected)
+
+
+@pytest.mark.parametrize('engine', ['frame', 'dense'])
+def test_resume(engine, output_database, expected, monkeypatch):
+    fertility_rates = iclus_v3_census.Projector.fertility_rates
+
+    def interrupted(self):
+        if self.current_projection_year == FINAL_YEAR:
+            raise RuntimeError('interrupted')
+        return fertility_rates(self)
+
+    monkeypatch.setattr(iclus_v3_census.Projector, 'fertility_rates', interrupted)
+    with pytest.raises(RuntimeError, match='interrupted'):
+        iclus_v3_census.Projector(*SCENARIO, engine=engine, output_database=output_database).run(FINAL_YEAR)
+    monkeypatch.undo()
+
+    iclus_v3_census.Projector(*SCENARIO, engine=engine, resume_from=output_database).run(FINAL_YEAR)
+
+    assert_same_outputs(read_outputs(output_database), expected)
+
+
+@pytest.mark.parametrize('engine', ['frame', 'dense'])
+def test_region(engine, output_database, expected):
+    # a region of every state is the whole country
+    iclus_v3_census.Projector(*SCENARIO, engine=engine, output_database=output_database,
+                              region=list(STATES)).run(FINAL_YEAR)
+
+    assert_same_outputs(read_outputs(output_database), expected)
+
+
+def test_tree(expected):
+    # a branch with the parameters of its parent continues the parent's run
+    root = iclus_v3_tree.ScenarioNode('root', *SCENARIO)
+    root.branch('branch', LAUNCH_YEAR + 2)
+
+    output_databases = iclus_v3_tree.run_tree(root, 'dense', FINAL_YEAR)
+
+    assert sorted(output_databases) == ['branch', 'root']
+    for output_database in output_databases.values():
+        assert_same_outputs(read_outputs(output_database), expected)
+
+
+def test_outofcore(tmp_path, output_database, expected, monkeypatch):
+    # several blocks and several chunks of every unit's pairs
+    monkeypatch.setattr(iclus_v3_outofcore, 'PAIR_CHUNK', 7)
+    scenario, cdc_fert_adj, cdc_mort_adj, census_imm_hist2324 = SCENARIO
+    store = str(tmp_path / 'store')
+    iclus_v3_outofcore.build_store(store, scenario, census_imm_hist2324, block_size=5)
+
+    model = iclus_v3_outofcore.OutOfCoreProjector(store, cdc_fert_adj, cdc_mort_adj, validation='full')
+    model.run(FINAL_YEAR)
+    model.export(output_database)
+
+    assert_same_outputs(read_outputs(output_database), expected)
+
+
+@pytest.fixture(scope='module')
+def warm_inputs(inputs):
+    return iclus_v3_service.WarmInputs()
+
+
+def test_service(warm_inputs, expected):
+    scenario, cdc_fert_adj, cdc_mort_adj, census_imm_hist2324 = SCENARIO
+    parameters = iclus_v3_service.parse_document({'scenario': scenario,
+                                                  'cdc_fert_adj': cdc_fert_adj,
+                                                  'cdc_mort_adj': cdc_mort_adj,
+                                                  'census_imm_hist2324': census_imm_hist2324,
+                                                  'final_projection_year': FINAL_YEAR}, warm_inputs)
+
+    years = []
+    geoids = warm_inputs.labels('county')
+    for totals in iclus_v3_service.project(warm_inputs, parameters):
+        years.append(totals['year'])
+        for name, values in OUTPUTS.items():
+            value = 'NET_MIGRATION' if name == 'migration' else values[0]
+            county_totals = (expected[name].filter(pl.col('YEAR') == totals['year'])
+                             .group_by('GEOID').agg(pl.col(value).sum())
+                             .sort('GEOID'))
+            assert county_totals.get_column('GEOID').to_list() == geoids
+            np.testing.assert_allclose(totals[name], county_totals.get_column(value).to_numpy(),
+                                       rtol=1e-9, atol=1e-6, err_msg=f'{name} {totals["year"]}')
+
+    assert years == list(range(LAUNCH_YEAR + 1, FINAL_YEAR + 1))
+
+
+def test_service_rejects_invalid_documents(warm_inputs):
+    for document in ({'scenario': 'x'}, {'fertility': {'99': 1.0}}, {'mortality': {'06': -1}},
+                     {'final_projection_year': LAUNCH_YEAR}, {'unknown': 1}):
+        with pytest.raises(ValueError):
+            iclus_v3_service.parse_document(document, warm_inputs)